@@ -1,2 +1,5 @@
-from .calculation import *
-from .parser import *
+# subpackages and their heavy dependencies (rdkit, rdmc, rmgpy) are only
+# imported when used
+from .lazy_import import lazy_star_import
+
+__getattr__, __dir__ = lazy_star_import(__name__, ["calculation", "parser"])
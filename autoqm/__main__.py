@@ -0,0 +1,40 @@
+from argparse import ArgumentParser
+
+
+def main():
+    parser = ArgumentParser(prog="autoqm")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = subparsers.add_parser(
+        "worker",
+        help="run the non-TS pipeline, pulling jobs of any stage until none is left or the allocation ends",
+    )
+    from autoqm.calculation.nonts_pipeline import add_nonts_arguments, run_worker
+
+    add_nonts_arguments(worker_parser)
+    worker_parser.add_argument(
+        "--poll_interval",
+        type=int,
+        default=300,
+        help="seconds to wait for other workers when no job is pending but some are still running",
+    )
+    worker_parser.add_argument(
+        "--stale_tmp_age",
+        type=float,
+        default=172800,
+        help="seconds after which a claimed job is taken as left behind by a killed worker and not waited for",
+    )
+    worker_parser.add_argument(
+        "--max_idle_polls",
+        type=int,
+        default=36,
+        help="number of polls in a row without a job to run after which the worker stops waiting for other workers",
+    )
+
+    args = parser.parse_args()
+    if args.command == "worker":
+        run_worker(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,6 @@
 from rdkit import Chem
 
 from rdmc.mol import RDKitMol
-from rdmc.external.rmg import from_rdkit_mol
-
-from arkane.statmech import is_linear
 
 from .utils import (
     enumerate_bonds,
@@ -26,6 +23,10 @@ def make_arkane_species_input_file(
     use_bond_corrections=True,
     arkane_species_input_path="species.py",
 ):
+    # rmgpy and arkane take seconds to import, only pay for it when used
+    from rdmc.external.rmg import from_rdkit_mol
+    from arkane.statmech import is_linear
+
     # make RDKit molecule
     rdmc_mol = RDKitMol.FromSmiles(smi)
     rdkit_mol = rdmc_mol._mol
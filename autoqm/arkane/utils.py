@@ -9,17 +9,13 @@ from rdkit.Chem.EnumerateStereoisomers import (
     GetStereoisomerCount,
 )
 
-from rmgpy.qm.qmdata import QMData
-from rmgpy.molecule.molecule import Molecule
-from rmgpy.molecule.element import get_element
-from rmgpy.qm.symmetry import PointGroupCalculator
-from rmgpy.molecule.resonance import generate_kekule_structure
-
 
 def enumerate_bonds(rmg_mol):
     """
     Modified from ARC
     """
+    from rmgpy.molecule.resonance import generate_kekule_structure
+
     mol_list = generate_kekule_structure(rmg_mol)
     if mol_list:
         return mol_list[0].enumerate_bonds()
@@ -43,6 +39,10 @@ def determine_symmetry(symbols, coords):
     """
     Modified from ARC
     """
+    from rmgpy.qm.qmdata import QMData
+    from rmgpy.molecule.element import get_element
+    from rmgpy.qm.symmetry import PointGroupCalculator
+
     atom_numbers = list()
     for symbol in symbols:
         atom_numbers.append(get_element(symbol).number)
@@ -1,6 +1,23 @@
-from .cosmo_calculation import *
-from .dft_calculation import *
-from .reset_r_p_complex import *
-from .semiempirical_calculation import *
-from .wft_calculation import *
-from .ff_conf_generation import *
+from ..lazy_import import lazy_star_import
+
+__getattr__, __dir__ = lazy_star_import(
+    __name__,
+    [
+        "cosmo_calculation",
+        "dft_calculation",
+        "reset_r_p_complex",
+        "semiempirical_calculation",
+        "wft_calculation",
+        "ff_conf_generation",
+        "remediation",
+        "conf_rmsd",
+        "conformer_ensemble",
+        "watchdog",
+        "cost_model",
+        "job_admission",
+        "job_queue",
+        "nonts_pipeline",
+        "tar_writer",
+        "dlpno_pipeline",
+    ],
+)
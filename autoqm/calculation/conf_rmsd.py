@@ -0,0 +1,228 @@
+import itertools
+
+import numpy as np
+from rdkit import Chem
+
+# terminal O or N conjugated with another terminal O or N through their common
+# neighbor, as in carboxylic acids, carboxylates or nitro groups
+CONJUGATED_TERMINAL_ATOM = Chem.MolFromSmarts(
+    "[O,N;D1;$([O,N;D1]-[*]=[O,N;D1]),$([O,N;D1]=[*]-[O,N;D1])]~[*]"
+)
+
+
+def symmetrize_conjugated_terminal_groups(mol):
+    """
+    Copy of mol where the terminal atoms of conjugated groups are made
+    equivalent, like symmetrizeConjugatedTerminalGroups of AllChem.GetBestRMS.
+    """
+    mol = Chem.RWMol(mol)
+    for atom_idx, neighbor_idx in mol.GetSubstructMatches(CONJUGATED_TERMINAL_ATOM):
+        mol.GetAtomWithIdx(atom_idx).SetFormalCharge(0)
+        bond = mol.GetBondBetweenAtoms(atom_idx, neighbor_idx)
+        bond.SetBondType(Chem.BondType.ONEANDAHALF)
+        bond.SetIsAromatic(False)
+    return mol
+
+
+def get_symmetry_permutations(mol, max_matches=10000):
+    """
+    Atom index permutations mapping mol onto itself. These are the mappings
+    AllChem.GetBestRMS enumerates on every call, with the same symmetrization
+    of conjugated terminal groups, here computed once per molecule.
+    """
+    mol = symmetrize_conjugated_terminal_groups(mol)
+    matches = mol.GetSubstructMatches(
+        mol, uniquify=False, useChirality=False, maxMatches=max_matches
+    )
+    if len(matches) >= max_matches:
+        print(
+            f"Warning: symmetry permutations of {Chem.MolToSmiles(mol)} truncated "
+            f"to {max_matches}"
+        )
+    if not matches:
+        matches = [tuple(range(mol.GetNumAtoms()))]
+    return np.array(matches, dtype=int)
+
+
+def get_hydrogen_symmetry(mol, max_matches=10000):
+    """
+    Symmetry of mol with explicit hydrogens without enumerating the orders of
+    interchangeable hydrogens, which grow as 6 per methyl and 2 per methylene.
+    Returns the permutations of the heavy atoms extended to the hydrogens, and
+    the groups of hydrogens bonded to the same heavy atom, whose order
+    min_rmsd_to picks for each alignment.
+    """
+    nh, heavy_atoms = get_heavy_atoms(mol)
+    if len(heavy_atoms) == mol.GetNumAtoms():
+        return get_symmetry_permutations(mol, max_matches), []
+
+    hydrogens = [
+        sorted(
+            neighbor.GetIdx()
+            for neighbor in mol.GetAtomWithIdx(int(i)).GetNeighbors()
+            if neighbor.GetAtomicNum() == 1
+        )
+        for i in heavy_atoms
+    ]
+    n_hydrogens = np.array([len(h) for h in hydrogens])
+
+    perms = []
+    for heavy_perm in get_symmetry_permutations(nh, max_matches):
+        # the heavy atom matches ignore hydrogens, e.g. of radical centers
+        if (n_hydrogens[heavy_perm] != n_hydrogens).any():
+            continue
+        perm = np.arange(mol.GetNumAtoms())
+        for i, j in enumerate(heavy_perm):
+            perm[heavy_atoms[i]] = heavy_atoms[j]
+            perm[hydrogens[i]] = hydrogens[j]
+        perms.append(perm)
+    h_groups = [np.array(h, dtype=int) for h in hydrogens if len(h) > 1]
+    return np.array(perms, dtype=int), h_groups
+
+
+def get_heavy_atoms(mol):
+    """
+    mol without hydrogens and the indices in mol of the atoms it keeps, or mol
+    itself and all indices if no atom is left.
+    """
+    mol = Chem.Mol(mol)
+    mol.RemoveAllConformers()
+    for atom in mol.GetAtoms():
+        atom.SetIntProp("heavy_atom_index", atom.GetIdx())
+    nh = Chem.RemoveHs(mol)
+    if nh.GetNumAtoms() == 0:
+        return mol, np.arange(mol.GetNumAtoms())
+    index = [atom.GetIntProp("heavy_atom_index") for atom in nh.GetAtoms()]
+    return nh, np.array(index, dtype=int)
+
+
+def center_coords(coords):
+    return coords - coords.mean(axis=-2, keepdims=True)
+
+
+def gyration_singular_values(coords):
+    """
+    Singular values of centered (..., n_atoms, 3) coordinates. They are invariant
+    to rotations and atom permutations, and sum((sx - sy)**2) / n_atoms is a lower
+    bound of the squared RMSD between two conformers after best alignment.
+    """
+    return np.linalg.svd(coords, compute_uv=False)
+
+
+def batch_kabsch_rmsd(x, ys, perms, chunk_size=1000000):
+    """
+    Minimum RMSD over the symmetry permutations perms between the centered
+    conformer x (n_atoms, 3) and each of the centered conformers ys
+    (n_confs, n_atoms, 3), all aligned at once with the Kabsch algorithm.
+    """
+    n_atoms = max(x.shape[0], 1)
+    x_norm = np.sum(x**2)
+    ys_norm = np.sum(ys**2, axis=(1, 2))
+
+    best = np.full(ys.shape[0], np.inf)
+    perms_per_chunk = max(1, chunk_size // max(ys.shape[0], 1))
+    for start in range(0, len(perms), perms_per_chunk):
+        xp = x[perms[start : start + perms_per_chunk]]
+        # covariance for every (conformer, permutation) pair
+        h = np.einsum("mni,pnj->mpij", ys, xp)
+        u, s, vt = np.linalg.svd(h)
+        d = np.sign(np.linalg.det(u) * np.linalg.det(vt))
+        s[..., -1] *= d
+        msd = (x_norm + ys_norm[:, None] - 2 * s.sum(axis=-1)) / n_atoms
+        best = np.minimum(best, msd.min(axis=1))
+    return np.sqrt(np.clip(best, 0, None))
+
+
+def dedup_conformers(coords, perms, rms_thresh):
+    """
+    Greedy RMSD deduplication of coords (n_confs, n_atoms, 3) in the given order.
+    A conformer is kept if it is at least rms_thresh away from every conformer
+    kept before it. Returns the indices of the kept conformers.
+    """
+    coords = center_coords(np.asarray(coords, dtype=float))
+    n_atoms = max(coords.shape[1], 1)
+    svs = gyration_singular_values(coords)
+
+    keep = [0]
+    for i in range(1, coords.shape[0]):
+        kept = np.array(keep)
+        # skip the alignment for pairs that are distinct by the invariant bound
+        lower_bound = np.sqrt(np.sum((svs[kept] - svs[i]) ** 2, axis=1) / n_atoms)
+        candidates = kept[lower_bound < rms_thresh]
+        if len(candidates):
+            rmsd = batch_kabsch_rmsd(coords[i], coords[candidates], perms)
+            if (rmsd < rms_thresh).any():
+                continue
+        keep.append(i)
+    return keep
+
+
+def kabsch_rotation(x, y):
+    """
+    Rotation r minimizing the RMSD between x @ r and y, both centered
+    (n_atoms, 3).
+    """
+    u, s, vt = np.linalg.svd(x.T @ y)
+    u[:, -1] *= np.sign(np.linalg.det(u) * np.linalg.det(vt))
+    return u @ vt
+
+
+def assign_hydrogens(x, y, perm, h_groups, max_iter=10):
+    """
+    perm with the hydrogens of each of h_groups ordered so that x[perm] is
+    closest to y, starting from the alignment on the other atoms. All orders
+    are tried when fewer than 3 atoms are left to align on.
+    """
+    fixed = np.ones(len(perm), dtype=bool)
+    for group in h_groups:
+        fixed[group] = False
+
+    if fixed.sum() < 3:
+        candidates = []
+        for orders in itertools.product(
+            *[itertools.permutations(perm[group]) for group in h_groups]
+        ):
+            candidate = perm.copy()
+            for group, order in zip(h_groups, orders):
+                candidate[group] = order
+            candidates.append(candidate)
+        return np.array(candidates)
+
+    # align on the other atoms, then on all atoms until the order is stable
+    perm = perm.copy()
+    for _ in range(max_iter):
+        xf, yf = x[perm][fixed], y[fixed]
+        rotation = kabsch_rotation(center_coords(xf), center_coords(yf))
+        aligned = (x - xf.mean(axis=0)) @ rotation + yf.mean(axis=0)
+        prev_perm = perm.copy()
+        for group in h_groups:
+            perm[group] = min(
+                itertools.permutations(perm[group]),
+                key=lambda order: np.sum((aligned[list(order)] - y[group]) ** 2),
+            )
+        if (perm == prev_perm).all() and fixed.all():
+            break
+        fixed[:] = True
+    return perm[None]
+
+
+def min_rmsd_to(coords, ref_coords, perms, h_groups=()):
+    """
+    Minimum symmetry-aware RMSD of coords (n_atoms, 3) to each of ref_coords
+    (n_refs, n_atoms, 3). With the hydrogen groups of get_hydrogen_symmetry,
+    the hydrogens of each permutation are ordered per reference, which is
+    exact for near duplicates but may overestimate the RMSD of distant
+    conformers.
+    """
+    x = center_coords(np.asarray(coords, dtype=float))
+    ys = center_coords(np.asarray(ref_coords, dtype=float))
+    if not len(h_groups):
+        return batch_kabsch_rmsd(x, ys, perms)
+
+    rmsd = np.empty(len(ys))
+    for i, y in enumerate(ys):
+        y_perms = np.concatenate(
+            [assign_hydrogens(x, y, perm, h_groups) for perm in perms]
+        )
+        rmsd[i] = batch_kabsch_rmsd(x, y[None], y_perms)[0]
+    return rmsd
@@ -0,0 +1,72 @@
+import numpy as np
+from rdkit import Chem
+from rdkit.Geometry import Point3D
+
+from .conf_rmsd import get_heavy_atoms
+
+
+class ConformerEnsemble:
+    """
+    Conformers of one molecule stored as an (n_confs, n_atoms, 3) coordinate
+    array and an (n_confs,) energy array. The molecule without conformers is
+    kept as a topology template and an RDKit Mol is only built in to_mol.
+    """
+
+    def __init__(self, mol, coords, energies):
+        self.mol = Chem.Mol(mol)
+        self.mol.RemoveAllConformers()
+        self.coords = np.asarray(coords, dtype=float).reshape(
+            -1, self.mol.GetNumAtoms(), 3
+        )
+        self.energies = np.asarray(energies, dtype=float).reshape(-1)
+
+    @classmethod
+    def from_mol(cls, mol, diz):
+        """
+        Build an ensemble from the conformers of mol listed in diz, a list of
+        (energy, conf id).
+        """
+        coords = [mol.GetConformer(int(id)).GetPositions() for en, id in diz]
+        energies = [float(en) for en, id in diz]
+        return cls(mol, coords, energies)
+
+    def __len__(self):
+        return len(self.energies)
+
+    def __getitem__(self, index):
+        """
+        Select conformers with a slice, a boolean mask or an index array.
+        """
+        if isinstance(index, int):
+            index = [index]
+        return ConformerEnsemble(self.mol, self.coords[index], self.energies[index])
+
+    def extend(self, other):
+        return ConformerEnsemble(
+            self.mol,
+            np.concatenate([self.coords, other.coords]),
+            np.concatenate([self.energies, other.energies]),
+        )
+
+    def sort(self):
+        return self[np.argsort(self.energies, kind="stable")]
+
+    def relative(self):
+        return ConformerEnsemble(
+            self.mol, self.coords, self.energies - self.energies.min()
+        )
+
+    def heavy_atoms(self):
+        """
+        The template without hydrogens and the indices of the atoms it keeps.
+        """
+        return get_heavy_atoms(self.mol)
+
+    def to_mol(self):
+        mol = Chem.Mol(self.mol)
+        for coords in self.coords:
+            conf = Chem.Conformer(mol.GetNumAtoms())
+            for i, (x, y, z) in enumerate(coords):
+                conf.SetAtomPosition(i, Point3D(x, y, z))
+            mol.AddConformer(conf, assignId=True)
+        return mol
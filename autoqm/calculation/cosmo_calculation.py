@@ -7,12 +7,18 @@ import time
 import traceback
 import pickle as pkl
 import tarfile
+import hashlib
 
 from .utils import REPLACE_LETTER
+from .tar_writer import JournaledTarWriter
 
 from rdkit import Chem
 from .file_parser import mol2xyz
 
+# Turbomole methods run by turbomole_calc, in order, and part of the key of
+# cached results. The .cosmo and .energy files are taken from the first one.
+TURBOMOLE_METHODS = ("BP-TZVPD-FINE-COSMO-SP", "BP-TZVPD-GAS-SP")
+
 
 def cosmo_calc(
     mol_id,
@@ -27,204 +33,391 @@ def cosmo_calc(
     tmp_mol_dir,
     save_dir,
     input_dir,
+    batch_size=1,
+    flush_every=10,
+    solvents=None,
+    turbomole_cache_dir=None,
 ):
-
-    # create and move to working directory
+    cosmo_calc_multi_solute(
+        [mol_id],
+        cosmotherm_path,
+        cosmo_database_path,
+        [charge],
+        [mult],
+        T_list,
+        df_pure,
+        [xyz],
+        scratch_dir,
+        [tmp_mol_dir],
+        [save_dir],
+        [input_dir],
+        batch_size=batch_size,
+        flush_every=flush_every,
+        solvents=solvents,
+        turbomole_cache_dir=turbomole_cache_dir,
+    )
+
+
+def cosmo_calc_multi_solute(
+    mol_ids,
+    cosmotherm_path,
+    cosmo_database_path,
+    charges,
+    mults,
+    T_list,
+    df_pure,
+    xyzs,
+    scratch_dir,
+    tmp_mol_dirs,
+    save_dirs,
+    input_dirs,
+    batch_size=1,
+    flush_every=10,
+    solvents=None,
+    turbomole_cache_dir=None,
+):
+    """
+    Turbomole and COSMO-RS calculations of several molecules. Turbomole runs
+    per molecule, then all the molecules are solutes of the same cosmotherm
+    runs, batch_size solvents at a time, and the results are split back into
+    the tar file of each molecule. Results are written to the tar files every
+    flush_every cosmotherm runs. solvents is the SolventSet of df_pure if
+    already made. Turbomole results are shared between molecules with the same
+    geometry through turbomole_cache_dir.
+    """
     current_dir = os.getcwd()
-    scratch_dir_mol_id = os.path.join(scratch_dir, f"{mol_id}")
-    os.makedirs(scratch_dir_mol_id)
-    os.chdir(scratch_dir_mol_id)
-
-    # open the tar file
-    tar_file = f"{mol_id}.tar"
-    tar_file_path = os.path.join(save_dir, tar_file)
-    if os.path.exists(tar_file_path):
-        tar = tarfile.open(tar_file_path, "r")
-        member_basename_list = set(
-            os.path.basename(member.name) for member in tar.getmembers()
-        )
-    else:
-        tar = tarfile.open(tar_file_path, "w")
-        member_basename_list = set()
 
-    energyfile = f"{mol_id}.energy"
-    cosmofile = f"{mol_id}.cosmo"
-    if energyfile in member_basename_list and cosmofile in member_basename_list:
-        # extract to files
-        tar.extract(energyfile, path=".")
-        tar.extract(cosmofile, path=".")
-        tar.close()
-        tar = tarfile.open(tar_file_path, "a")
-    else:
-        tar.close()
-        tar = tarfile.open(tar_file_path, "a")
-
-        # turbomole
-        print(f"Running Turbomole for {mol_id}...")
+    if solvents is None:
+        solvents = SolventSet(df_pure, cosmotherm_path, cosmo_database_path)
+    rows = solvents.rows
+    cosmo_names = solvents.cosmo_names
+
+    solutes = []
+    for mol_id, charge, mult, xyz, tmp_mol_dir, save_dir, input_dir in zip(
+        mol_ids, charges, mults, xyzs, tmp_mol_dirs, save_dirs, input_dirs
+    ):
+        # create and move to working directory
+        scratch_dir_mol_id = os.path.join(scratch_dir, f"{mol_id}")
+        os.makedirs(scratch_dir_mol_id)
+        os.chdir(scratch_dir_mol_id)
+
+        # members are read from the journal of the tar file, which is then
+        # appended to in batches
+        writer = JournaledTarWriter(
+            os.path.join(save_dir, f"{mol_id}.tar"), flush_every=flush_every
+        )
 
-        num_atoms = len(xyz.splitlines())
-        xyz = str(num_atoms) + "\n\n" + xyz
+        if not turbomole_calc(
+            mol_id, charge, mult, xyz, writer, tmp_mol_dir, turbomole_cache_dir
+        ):
+            os.chdir(current_dir)
+            continue
 
-        os.makedirs("xyz")
-        xyz_mol_id = f"{mol_id}.xyz"
-        with open(os.path.join("xyz", xyz_mol_id), "w+") as f:
-            f.write(xyz)
+        # solvents are run in order and a run stops at the first failure, so
+        # every solvent up to the last one with a .tab is done
+        n_done = 0
+        for index, cosmo_name in enumerate(cosmo_names):
+            if f"{mol_id}_{cosmo_name}.tab" in writer.members:
+                n_done = index + 1
+        solutes.append(
+            (mol_id, scratch_dir_mol_id, writer, tmp_mol_dir, input_dir, n_done)
+        )
 
-        txtfile = f"{mol_id}.txt"
-        with open(txtfile, "w+") as f:
-            f.write(f"{mol_id} {charge} {mult}")
+    if not solutes:
+        return
 
-        # run the job
-        logfile = f"{mol_id}.log"
-        outfile = f"{mol_id}.out"
-        with open(outfile, "w") as out:
-            subprocess.run(
-                f"calculate -l {txtfile} -m BP-TZVPD-FINE-COSMO-SP -f xyz -din xyz > {logfile}",
-                shell=True,
-                stdout=out,
-                stderr=out,
-            )
-            subprocess.run(
-                f"calculate -l {txtfile} -m BP-TZVPD-GAS-SP -f xyz -din xyz > {logfile}",
-                shell=True,
-                stdout=out,
-                stderr=out,
-            )
+    # cosmotherm runs in the working directory of the first solute
+    work_dir = solutes[0][1]
+    os.chdir(work_dir)
+    for mol_id, scratch_dir_mol_id, *_ in solutes[1:]:
+        shutil.copyfile(
+            os.path.join(scratch_dir_mol_id, f"{mol_id}.cosmo"), f"{mol_id}.cosmo"
+        )
 
-        cosmo_done = False
-        energy_done = False
+    # solutes resumed from different solvents are run separately
+    n_done_to_solutes = dict()
+    for solute in solutes:
+        n_done_to_solutes.setdefault(solute[5], []).append(solute)
 
-        # copy the cosmo and energy files
-        for file in os.listdir("CosmofilesBP-TZVPD-FINE-COSMO-SP"):
-            if file.endswith("cosmo"):
-                shutil.copyfile(
-                    os.path.join("CosmofilesBP-TZVPD-FINE-COSMO-SP", file), file
-                )
-                tar.add(file)
-                tar.close()
-                tar = tarfile.open(tar_file_path, "a")
-                cosmo_done = True
-                break
-
-        for file in os.listdir("EnergyfilesBP-TZVPD-FINE-COSMO-SP"):
-            if file.endswith("energy"):
-                shutil.copyfile(
-                    os.path.join("EnergyfilesBP-TZVPD-FINE-COSMO-SP", file), file
+    done_solutes = []
+    try:
+        for n_done, group in n_done_to_solutes.items():
+            group_ids = [solute[0] for solute in group]
+
+            # prepare for cosmo calculation, batch_size solvents per cosmotherm run
+            failed = False
+            for index in range(n_done, len(rows), batch_size):
+                batch_rows = rows[index : index + batch_size]
+                # the files of a batch are named after its last solvent
+                cosmo_name = cosmo_names[index + len(batch_rows) - 1]
+                inpfile = f"{group_ids[0]}_{cosmo_name}.inp"
+                tabfile = f"{group_ids[0]}_{cosmo_name}.tab"
+                outfile = f"{group_ids[0]}_{cosmo_name}.out"
+                if len(batch_rows) == 1:
+                    solvent_names = f"{index} {batch_rows[0].cosmo_name}"
+                else:
+                    solvent_names = f"{index} {batch_rows[0].cosmo_name} to {index + len(batch_rows) - 1} {batch_rows[-1].cosmo_name}"
+                solute_names = " ".join(str(mol_id) for mol_id in group_ids)
+
+                print(
+                    f"Running COSMO calculation for {solute_names} in {solvent_names}..."
                 )
-                tar.add(file)
-                tar.close()
-                tar = tarfile.open(tar_file_path, "a")
-                energy_done = True
-                break
 
-        if not (cosmo_done and energy_done):
-            shutil.copyfile(
-                os.path.join("xyz", xyz_mol_id), os.path.join(tmp_mol_dir, xyz_mol_id)
-            )
-            shutil.copyfile(txtfile, os.path.join(tmp_mol_dir, txtfile))
-            shutil.copyfile(outfile, os.path.join(tmp_mol_dir, outfile))
-            shutil.copyfile(logfile, os.path.join(tmp_mol_dir, logfile))
-            print(f"Turbomole calculation failed for {mol_id}")
-            print("Output files:")
-            with open(outfile, "r") as f:
-                print(f.read())
-            print("Log files:")
-            with open(logfile, "r") as f:
-                print(f.read())
-            os.chdir(current_dir)
-            return
+                script = generate_cosmo_batch_input(
+                    [str(mol_id) for mol_id in group_ids],
+                    cosmotherm_path,
+                    cosmo_database_path,
+                    T_list,
+                    batch_rows,
+                    compounds=solvents.compounds[index : index + batch_size],
+                )
 
-        print(f"Turbomole calculation done for {mol_id}")
+                with open(inpfile, "w+") as f:
+                    f.write(script)
 
-    # prepare for cosmo calculation
-    for index, row in df_pure.iterrows():
-        cosmo_name = "".join(
-            letter if letter not in REPLACE_LETTER else REPLACE_LETTER[letter]
-            for letter in row.cosmo_name
-        )
-        inpfile = f"{mol_id}_{cosmo_name}.inp"
-        tabfile = f"{mol_id}_{cosmo_name}.tab"
-        outfile = f"{mol_id}_{cosmo_name}.out"
+                cosmo_command = os.path.join(
+                    cosmotherm_path, "COSMOtherm", "BIN-LINUX", "cosmotherm"
+                )
+                subprocess.run(f"{cosmo_command} {inpfile}", shell=True)
+
+                if not os.path.exists(tabfile):
+                    for mol_id, _, _, tmp_mol_dir, _, _ in group:
+                        shutil.copyfile(inpfile, os.path.join(tmp_mol_dir, inpfile))
+                        shutil.copyfile(outfile, os.path.join(tmp_mol_dir, outfile))
+                    print(
+                        f"COSMO calculation failed for {solute_names} in {solvent_names}"
+                    )
+                    with open(inpfile, "r") as f:
+                        print(f.read())
+                    with open(outfile, "r") as f:
+                        print(f.read())
+                    failed = True
+                    break
+
+                if len(batch_rows) > 1 or len(group) > 1:
+                    # keep only the rows of the solvent of each job and the solute
+                    with open(tabfile, "r") as f:
+                        solute_tabs = split_cosmo_batch_tab(
+                            f.read(), len(batch_rows), len(T_list), len(group)
+                        )
+                else:
+                    solute_tabs = None
+
+                for k, (mol_id, _, writer, _, _, _) in enumerate(group):
+                    mol_inpfile = f"{mol_id}_{cosmo_name}.inp"
+                    mol_tabfile = f"{mol_id}_{cosmo_name}.tab"
+                    mol_outfile = f"{mol_id}_{cosmo_name}.out"
+                    if mol_inpfile != inpfile:
+                        shutil.copyfile(inpfile, mol_inpfile)
+                        shutil.copyfile(outfile, mol_outfile)
+                    if solute_tabs is not None:
+                        with open(mol_tabfile, "w") as f:
+                            f.write(solute_tabs[k])
+                    writer.add([mol_inpfile, mol_tabfile, mol_outfile])
+
+                print(f"COSMO calculation done for {solute_names} in {solvent_names}")
+
+            if not failed:
+                done_solutes += group
+    finally:
+        # keep the results completed before a failure or an interruption
+        for _, _, writer, _, _, _ in solutes:
+            writer.close()
 
-        if tabfile in member_basename_list:
-            continue
+    os.chdir(current_dir)
 
-        print(f"Running COSMO calculation for {mol_id} in {index} {row.cosmo_name}...")
+    for mol_id, scratch_dir_mol_id, _, tmp_mol_dir, input_dir, _ in done_solutes:
+        print(f"Removing temporary folder of {mol_id}...")
+        if os.path.exists(tmp_mol_dir):
+            if not os.listdir(tmp_mol_dir):
+                shutil.rmtree(tmp_mol_dir)
+            else:
+                print(f"Some jobs for {mol_id} failed. See {tmp_mol_dir} for details.")
+        else:
+            print("Removed by other worker? Skipping...")
 
-        script = generate_cosmo_input(
-            str(mol_id), cosmotherm_path, cosmo_database_path, T_list, row
-        )
+        print(f"Removing temporary file of {mol_id}...")
+        try:
+            os.remove(os.path.join(input_dir, f"{mol_id}.tmp"))
+        except FileNotFoundError as e:
+            print(e)
+            print("Removed by other worker? Skipping...")
 
-        with open(inpfile, "w+") as f:
-            f.write(script)
+    # the working directory of the first solute holds the cosmotherm files of
+    # all of them and is kept while any solute failed
+    all_done = len(done_solutes) == len(solutes)
+    for solute in done_solutes:
+        if all_done or solute is not solutes[0]:
+            shutil.rmtree(solute[1])
 
-        cosmo_command = os.path.join(
-            cosmotherm_path, "COSMOtherm", "BIN-LINUX", "cosmotherm"
-        )
-        subprocess.run(f"{cosmo_command} {inpfile}", shell=True)
-
-        if not os.path.exists(tabfile):
-            shutil.copyfile(inpfile, os.path.join(tmp_mol_dir, inpfile))
-            shutil.copyfile(outfile, os.path.join(tmp_mol_dir, outfile))
-            print(f"COSMO calculation failed for {mol_id} in {index} {row.cosmo_name}")
-            with open(inpfile, "r") as f:
-                print(f.read())
-            with open(outfile, "r") as f:
-                print(f.read())
-            os.chdir(current_dir)
-            return
-        else:
-            tar.add(inpfile)
-            tar.add(tabfile)
-            tar.add(outfile)
-            tar.close()
-            tar = tarfile.open(tar_file_path, "a")
 
-            print(f"COSMO calculation done for {mol_id} in {index} {row.cosmo_name}")
+def get_geometry_key(xyz, charge, mult, method=" ".join(TURBOMOLE_METHODS), decimals=4):
+    """
+    Hash of the elements and coordinates, rounded to decimals angstrom, of the
+    coordinate lines of xyz with the charge, multiplicity and method. Atom
+    lines are sorted so that the key does not depend on the atom order.
+    """
+    lines = []
+    for line in xyz.splitlines():
+        data = line.split()
+        if len(data) != 4:
+            continue
+        # + 0.0 turns -0.0 into 0.0
+        coords = [round(float(x), decimals) + 0.0 for x in data[1:]]
+        lines.append(" ".join([data[0]] + [f"{x:.{decimals}f}" for x in coords]))
+    key = "\n".join(sorted(lines)) + f"\n{charge} {mult} {method}"
+    return hashlib.sha256(key.encode()).hexdigest()
 
-    tar.close()
 
-    print("Removing temporary folder...")
-    if os.path.exists(tmp_mol_dir):
-        if not os.listdir(tmp_mol_dir):
-            shutil.rmtree(tmp_mol_dir)
-        else:
-            print(f"Some jobs for {mol_id} failed. See {tmp_mol_dir} for details.")
-    else:
-        print("Removed by other worker? Skipping...")
+def turbomole_calc(
+    mol_id, charge, mult, xyz, writer, tmp_mol_dir, turbomole_cache_dir=None
+):
+    """
+    Make {mol_id}.cosmo and {mol_id}.energy in the working directory, taken
+    from the tar file of the molecule if it has them, from turbomole_cache_dir
+    if a molecule with the same geometry, charge and multiplicity was computed
+    before, or from Turbomole. Results are written to the tar file right away.
+    Returns False if Turbomole failed.
+    """
+    energyfile = f"{mol_id}.energy"
+    cosmofile = f"{mol_id}.cosmo"
+    if energyfile in writer.members and cosmofile in writer.members:
+        # extract to files
+        with tarfile.open(writer.tar_file_path, "r") as tar:
+            tar.extract(energyfile, path=".")
+            tar.extract(cosmofile, path=".")
+        return True
+
+    if turbomole_cache_dir is not None:
+        key = get_geometry_key(xyz, charge, mult)
+        cache_dir = os.path.join(turbomole_cache_dir, key[:2], key)
+        if os.path.exists(os.path.join(cache_dir, "turbomole.energy")):
+            print(f"Reusing Turbomole results {key} for {mol_id}")
+            shutil.copyfile(os.path.join(cache_dir, "turbomole.cosmo"), cosmofile)
+            shutil.copyfile(os.path.join(cache_dir, "turbomole.energy"), energyfile)
+            writer.add([cosmofile, energyfile])
+            writer.flush()
+            return True
+
+    # turbomole
+    print(f"Running Turbomole for {mol_id}...")
+
+    num_atoms = len(xyz.splitlines())
+    xyz = str(num_atoms) + "\n\n" + xyz
+
+    os.makedirs("xyz")
+    xyz_mol_id = f"{mol_id}.xyz"
+    with open(os.path.join("xyz", xyz_mol_id), "w+") as f:
+        f.write(xyz)
+
+    txtfile = f"{mol_id}.txt"
+    with open(txtfile, "w+") as f:
+        f.write(f"{mol_id} {charge} {mult}")
+
+    # run the job
+    logfile = f"{mol_id}.log"
+    outfile = f"{mol_id}.out"
+    with open(outfile, "w") as out:
+        for method in TURBOMOLE_METHODS:
+            subprocess.run(
+                f"calculate -l {txtfile} -m {method} -f xyz -din xyz > {logfile}",
+                shell=True,
+                stdout=out,
+                stderr=out,
+            )
 
-    print("Removing temporary file...")
-    try:
-        os.remove(os.path.join(input_dir, f"{mol_id}.tmp"))
-    except FileNotFoundError as e:
-        print(e)
-        print("Removed by other worker? Skipping...")
+    cosmo_done = False
+    energy_done = False
+    cosmo_files = []
+
+    # copy the cosmo and energy files
+    cosmo_dir = f"Cosmofiles{TURBOMOLE_METHODS[0]}"
+    energy_dir = f"Energyfiles{TURBOMOLE_METHODS[0]}"
+    for file in os.listdir(cosmo_dir):
+        if file.endswith("cosmo"):
+            shutil.copyfile(os.path.join(cosmo_dir, file), file)
+            cosmo_files.append(file)
+            cosmo_done = True
+            break
+
+    for file in os.listdir(energy_dir):
+        if file.endswith("energy"):
+            shutil.copyfile(os.path.join(energy_dir, file), file)
+            cosmo_files.append(file)
+            energy_done = True
+            break
+
+    writer.add(cosmo_files)
+    writer.flush()
+
+    if not (cosmo_done and energy_done):
+        shutil.copyfile(
+            os.path.join("xyz", xyz_mol_id), os.path.join(tmp_mol_dir, xyz_mol_id)
+        )
+        shutil.copyfile(txtfile, os.path.join(tmp_mol_dir, txtfile))
+        shutil.copyfile(outfile, os.path.join(tmp_mol_dir, outfile))
+        shutil.copyfile(logfile, os.path.join(tmp_mol_dir, logfile))
+        print(f"Turbomole calculation failed for {mol_id}")
+        print("Output files:")
+        with open(outfile, "r") as f:
+            print(f.read())
+        print("Log files:")
+        with open(logfile, "r") as f:
+            print(f.read())
+        return False
+
+    if turbomole_cache_dir is not None:
+        # written aside and renamed, so that readers see complete entries
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        tmp_cache_dir = f"{cache_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_cache_dir, exist_ok=True)
+        for file in cosmo_files:
+            extension = os.path.splitext(file)[1]
+            shutil.copyfile(
+                file, os.path.join(tmp_cache_dir, f"turbomole{extension}")
+            )
+        try:
+            os.rename(tmp_cache_dir, cache_dir)
+        except OSError:
+            # cached by another worker meanwhile
+            shutil.rmtree(tmp_cache_dir)
 
-    os.chdir(current_dir)
-    shutil.rmtree(scratch_dir_mol_id)
+    print(f"Turbomole calculation done for {mol_id}")
+    return True
 
 
 def generate_cosmo_input(name, cosmotherm_path, cosmo_database_path, T_list, row):
     """
     Modified from ACS and Yunsie's code
     """
+    return generate_cosmo_batch_input(
+        [name], cosmotherm_path, cosmo_database_path, T_list, [row]
+    )
 
-    script = f"""ctd = BP_TZVPD_FINE_21.ctd cdir = "{cosmotherm_path}/COSMOthermX/../COSMOtherm/CTDATA-FILES" ldir = "{cosmotherm_path}/COSMOthermX/../licensefiles"
-notempty wtln ehfile
-!! generated by COSMOthermX !!
-"""
 
-    # solvent
+def get_solvent_dir(row, cosmotherm_path, cosmo_database_path):
+    """
+    Database folder of the .cosmo files of a solvent of the pure solvent list.
+    """
     first_letter = row.cosmo_name[0]
     if not first_letter.isalpha() and not first_letter.isnumeric():
         first_letter = "0"
     if row.source == "COSMOtherm":
-        solvent_dir = (
-            f"{cosmotherm_path}/COSMOtherm/DATABASE-COSMO/BP-TZVPD-FINE/{first_letter}"
-        )
+        return f"{cosmotherm_path}/COSMOtherm/DATABASE-COSMO/BP-TZVPD-FINE/{first_letter}"
     elif row.source == "COSMObase":
-        solvent_dir = f"{cosmo_database_path}/BP-TZVPD-FINE/{first_letter}"
-    script += 'f = "' + row.cosmo_name + '_c0.cosmo" fdir="' + solvent_dir + '"'
+        return f"{cosmo_database_path}/BP-TZVPD-FINE/{first_letter}"
+
+
+def get_solvent_files(row):
+    return [f"{row.cosmo_name}_c{k}.cosmo" for k in range(int(row.cosmo_conf))]
+
+
+def get_solvent_compound(row, solvent_dir):
+    """
+    Compound lines of a solvent of the pure solvent list, with all its
+    conformers, whose .cosmo files are in solvent_dir.
+    """
+    script = 'f = "' + row.cosmo_name + '_c0.cosmo" fdir="' + solvent_dir + '"'
     if int(row.cosmo_conf) > 1:
         script += ' Comp = "' + row.cosmo_name + '" [ VPfile'
         for k in range(1, int(row.cosmo_conf)):
@@ -240,14 +433,133 @@ notempty wtln ehfile
         script += " ]\n"
     else:
         script += " VPfile\n"
+    return script
+
+
+def stage_file(src, dst):
+    """
+    Copy src to dst unless an identical copy is there, through a temporary
+    file so that other processes never read a partial copy.
+    """
+    if os.path.exists(dst) and os.path.getsize(dst) == os.path.getsize(src):
+        return
+    tmp_dst = f"{dst}.{os.getpid()}.tmp"
+    shutil.copyfile(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+
+
+class SolventSet:
+    """
+    The solvents of df_pure resolved once per run: their file names and their
+    compound lines for COSMOtherm inputs. With local_dir, e.g. node-local
+    scratch, the .cosmo files of all the conformers of each solvent are first
+    copied there and the compound lines read the copies.
+    """
+
+    def __init__(self, df_pure, cosmotherm_path, cosmo_database_path, local_dir=None):
+        self.rows = [row for _, row in df_pure.iterrows()]
+        self.cosmo_names = [
+            "".join(
+                letter if letter not in REPLACE_LETTER else REPLACE_LETTER[letter]
+                for letter in row.cosmo_name
+            )
+            for row in self.rows
+        ]
+
+        if local_dir is not None:
+            print(f"Copying solvent .cosmo files to {local_dir}...")
+            os.makedirs(local_dir, exist_ok=True)
+        self.compounds = []
+        for row in self.rows:
+            solvent_dir = get_solvent_dir(row, cosmotherm_path, cosmo_database_path)
+            if local_dir is not None:
+                try:
+                    for file in get_solvent_files(row):
+                        stage_file(
+                            os.path.join(solvent_dir, file),
+                            os.path.join(local_dir, file),
+                        )
+                    solvent_dir = os.path.abspath(local_dir)
+                except FileNotFoundError as e:
+                    print(e)
+                    print(f"Reading {row.cosmo_name} from {solvent_dir}")
+            self.compounds.append(get_solvent_compound(row, solvent_dir))
+
+
+def generate_cosmo_batch_input(
+    names, cosmotherm_path, cosmo_database_path, T_list, rows, compounds=None
+):
+    """
+    Input for a single cosmotherm run of the solutes in names in every solvent
+    of rows. The solvents come first in the compound list, followed by the
+    solutes, and there is one henry job per solvent and temperature in which
+    all the solutes are at infinite dilution. With one solvent and one solute
+    this is the input of generate_cosmo_input. compounds are the compound
+    lines of the solvents if already rendered, e.g. by SolventSet.
+    """
 
-    # solute
-    script += 'f = "' + name + '.cosmo" fdir="." VPfile\n'
-    for T in T_list:
-        script += "henry  xh={ 1 0 } tk=" + str(T) + " GSOLV  \n"
+    script = f"""ctd = BP_TZVPD_FINE_21.ctd cdir = "{cosmotherm_path}/COSMOthermX/../COSMOtherm/CTDATA-FILES" ldir = "{cosmotherm_path}/COSMOthermX/../licensefiles"
+notempty wtln ehfile
+!! generated by COSMOthermX !!
+"""
+
+    # solvents
+    if compounds is None:
+        compounds = [
+            get_solvent_compound(
+                row, get_solvent_dir(row, cosmotherm_path, cosmo_database_path)
+            )
+            for row in rows
+        ]
+    script += "".join(compounds)
+
+    # solutes
+    for name in names:
+        script += 'f = "' + name + '.cosmo" fdir="." VPfile\n'
+
+    n_compounds = len(rows) + len(names)
+    for i in range(len(rows)):
+        xh = ["1" if k == i else "0" for k in range(n_compounds)]
+        for T in T_list:
+            script += (
+                "henry  xh={ " + " ".join(xh) + " } tk=" + str(T) + " GSOLV  \n"
+            )
     return script
 
 
+def split_cosmo_batch_tab(tab, n_solvents, n_temps, n_solutes=1):
+    """
+    Split the .tab output of an input from generate_cosmo_batch_input into one
+    .tab per solute. Each result table keeps only the rows of the solvent of
+    its job and of the solute, as in the output of a single solvent input.
+    """
+    solute_tabs = [[] for _ in range(n_solutes)]
+    n_jobs = 0
+    solvent_nr = None
+    in_table = False
+    for line in tab.splitlines(keepends=True):
+        if "Settings  job" in line:
+            n_jobs += 1
+            try:
+                job = int(line.split("job")[1].split(":")[0])
+            except ValueError:
+                job = n_jobs
+            solvent_nr = (job - 1) // n_temps + 1
+        data = line.split()
+        if in_table and data and data[0].isdigit():
+            nr = int(data[0])
+            if nr == solvent_nr:
+                for solute_tab in solute_tabs:
+                    solute_tab.append(line)
+            elif nr > n_solvents:
+                solute_tabs[nr - n_solvents - 1].append(line)
+            continue
+        in_table = "Nr Compound" in line
+        for solute_tab in solute_tabs:
+            solute_tab.append(line)
+    return ["".join(solute_tab) for solute_tab in solute_tabs]
+
+
 def read_cosmo_tab_result(tab_file_path):
     """
     Modified from Yunsie's code
@@ -0,0 +1,266 @@
+import json
+
+import numpy as np
+
+# wall time (s) of one job as prefactor * n_heavy_atoms ** exponent for the
+# default levels of theory and core counts of each stage, on the generous side
+DEFAULT_STAGE_COSTS = {
+    "FF_conf": (5.0, 1.5),
+    "semiempirical_opt": (30.0, 1.5),
+    "DFT_opt_freq": (60.0, 2.0),
+    "TS_DFT_opt_freq": (120.0, 2.0),
+    "COSMO": (60.0, 2.0),
+    "QM_des": (30.0, 2.0),
+    "DLPNO_sp": (20.0, 2.5),
+    "DLPNO_sp_f12": (200.0, 2.5),
+}
+
+# elements up to neon, so that sizing an xyz block does not need rdkit
+FIRST_TWO_ROWS = {"H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne"}
+
+
+def get_element_size(symbols, mult=1):
+    """
+    Size features of a molecule from the element symbols of its atoms.
+    """
+    heavy = [symbol for symbol in symbols if symbol.upper() not in ("H", "1")]
+    n_third_row = sum(
+        symbol.isalpha() and symbol.capitalize() not in FIRST_TWO_ROWS
+        for symbol in heavy
+    )
+    return {
+        "n_atoms": len(symbols),
+        "n_heavy_atoms": len(heavy),
+        "n_hetero_atoms": sum(symbol.upper() != "C" for symbol in heavy),
+        "n_third_row_atoms": n_third_row,
+        "mult": mult,
+    }
+
+
+def get_smiles_size(smi):
+    """
+    Size features of a smiles. For a reaction smiles the reactants are
+    counted, which have all the atoms of the TS.
+    """
+    from rdkit import Chem
+
+    smi = smi.split(">>")[0]
+    mol = Chem.AddHs(Chem.MolFromSmiles(smi))
+    mult = sum(atom.GetNumRadicalElectrons() for atom in mol.GetAtoms()) + 1
+    return get_element_size([atom.GetSymbol() for atom in mol.GetAtoms()], mult)
+
+
+def get_xyz_size(xyz, mult=1):
+    """
+    Size features of the coordinate lines of an xyz block, with or without
+    its two header lines.
+    """
+    symbols = []
+    for line in xyz.splitlines():
+        data = line.split()
+        if len(data) == 4:
+            try:
+                [float(x) for x in data[1:]]
+            except ValueError:
+                continue
+            symbols.append(data[0])
+    return get_element_size(symbols, mult)
+
+
+def get_features(size):
+    """
+    Regression features of a size dict: constant, log of the heavy and total
+    atom counts, open shell flag and the fractions of hetero and third row
+    atoms.
+    """
+    n_heavy_atoms = max(size["n_heavy_atoms"], 1)
+    return np.array(
+        [
+            1.0,
+            np.log(n_heavy_atoms),
+            np.log(max(size["n_atoms"], 1)),
+            float(size.get("mult", 1) > 1),
+            size.get("n_hetero_atoms", 0) / n_heavy_atoms,
+            size.get("n_third_row_atoms", 0) / n_heavy_atoms,
+        ]
+    )
+
+
+def time_to_seconds(time_tuple):
+    """
+    Seconds in a (days, hours, minutes, seconds) tuple as parsed from the
+    Job cpu time and Elapsed time lines.
+    """
+    days, hours, mins, secs = time_tuple
+    return days * 86400 + hours * 3600 + mins * 60 + secs
+
+
+def fit_log_linear(sizes, values, ridge=1e-3):
+    """
+    Least squares fit of log(values) on the features of sizes, with a small
+    ridge term so that a few similar molecules still give a stable fit.
+    """
+    X = np.array([get_features(size) for size in sizes])
+    y = np.log(np.asarray(values, dtype=float))
+    A = X.T @ X + ridge * np.eye(X.shape[1])
+    coef = np.linalg.solve(A, X.T @ y)
+    residuals = y - X @ coef
+    return {
+        "coef": coef.tolist(),
+        "sigma": float(np.sqrt(np.mean(residuals**2))),
+        "n": len(y),
+    }
+
+
+def fit_parallel_fraction(records, n_grid=101):
+    """
+    Amdahl parallel fraction f minimizing the residual of the log-linear fit
+    of wall / ((1 - f) + f / n_procs), the serial time, over records with
+    wall times at several core counts. None if all the records have the same
+    core count, which leaves f undetermined.
+    """
+    if len({r["n_procs"] for r in records}) < 2:
+        return None
+    sizes = [r["size"] for r in records]
+    best_f, best_sigma = None, None
+    for f in np.linspace(0, 1, n_grid):
+        serial = [r["wall"] / ((1 - f) + f / r["n_procs"]) for r in records]
+        sigma = fit_log_linear(sizes, serial)["sigma"]
+        if best_sigma is None or sigma < best_sigma:
+            best_f, best_sigma = float(f), sigma
+    return best_f
+
+
+def predict_log_linear(fit, size, n_sigma=0.0):
+    return float(np.exp(get_features(size) @ fit["coef"] + n_sigma * fit["sigma"]))
+
+
+class CostModel:
+    """
+    Predict the wall time, memory and core count of a job of a stage from
+    the size of its molecule. fits holds, per stage and level of theory, the
+    fitted serial time (total work), Amdahl parallel fraction, typical core
+    count and memory, see fit. Without a fit the wall time falls back to the
+    power law of stage_costs, which overrides entries of DEFAULT_STAGE_COSTS.
+    """
+
+    def __init__(self, stage_costs=None, fits=None):
+        self.stage_costs = dict(DEFAULT_STAGE_COSTS)
+        if stage_costs is not None:
+            self.stage_costs.update(stage_costs)
+        self.fits = fits if fits is not None else dict()
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get("stage_costs"), data.get("fits"))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"stage_costs": self.stage_costs, "fits": self.fits}, f, indent=2)
+
+    def get_fit(self, stage, level_of_theory=None):
+        """
+        The fit of stage for level_of_theory. Without a level of theory, the
+        fit of the stage is used if only one level was fitted.
+        """
+        stage_fits = self.fits.get(stage, dict())
+        if level_of_theory is not None:
+            return stage_fits.get(level_of_theory)
+        if len(stage_fits) == 1:
+            return next(iter(stage_fits.values()))
+        return None
+
+    def fit(self, stage, level_of_theory, records, min_records=10):
+        """
+        Fit stage at level_of_theory from records of finished jobs, dicts with
+        a size and any of wall (s), n_procs and mem (MB, the memory a job
+        needed, per core for ORCA). Quantities with fewer than min_records
+        are not fitted. A cpu time in the records is not used, Gaussian sums
+        it over the cores and ORCA does not report it.
+        """
+        fit = dict()
+
+        # the serial time comes from how the wall times scale with the number
+        # of cores, which needs jobs run on at least two core counts
+        timed = [r for r in records if r.get("wall") and r.get("n_procs")]
+        if len(timed) >= min_records:
+            sizes = [r["size"] for r in timed]
+            f = fit_parallel_fraction(timed)
+            if f is not None:
+                serial = [r["wall"] / ((1 - f) + f / r["n_procs"]) for r in timed]
+                fit["work"] = fit_log_linear(sizes, serial)
+                fit["parallel_fraction"] = f
+            else:
+                # only valid for jobs on the same number of cores
+                fit["wall"] = fit_log_linear(sizes, [r["wall"] for r in timed])
+            fit["n_procs"] = int(np.median([r["n_procs"] for r in timed]))
+
+        mem = [r for r in records if r.get("mem")]
+        if len(mem) >= min_records:
+            fit["mem"] = fit_log_linear(
+                [r["size"] for r in mem], [r["mem"] for r in mem]
+            )
+
+        self.fits.setdefault(stage, dict())[level_of_theory] = fit
+        return fit
+
+    def predict_wall(self, stage, size, level_of_theory=None, n_procs=None):
+        """
+        Wall time (s) of a job on n_procs cores, by default the typical core
+        count of the fit. A fit from a single core count only predicts jobs on
+        that many cores, others fall back to the power law of stage_costs.
+        """
+        fit = self.get_fit(stage, level_of_theory)
+        if fit is not None and "work" in fit:
+            work = predict_log_linear(fit["work"], size)
+            f = fit.get("parallel_fraction", 0.0)
+            n_procs = n_procs if n_procs is not None else fit.get("n_procs", 1)
+            return work * ((1 - f) + f / n_procs)
+        if fit is not None and "wall" in fit and n_procs in (None, fit["n_procs"]):
+            return predict_log_linear(fit["wall"], size)
+
+        prefactor, exponent = self.stage_costs[stage]
+        return prefactor * max(size["n_heavy_atoms"], 1) ** exponent
+
+    def predict_mem(self, stage, size, level_of_theory=None, default=None, n_sigma=2.0):
+        """
+        Memory (MB) a job needs, n_sigma residual standard deviations above the
+        fit so that most jobs get enough, or default without a fit.
+        """
+        fit = self.get_fit(stage, level_of_theory)
+        if fit is None or "mem" not in fit:
+            return default
+        return predict_log_linear(fit["mem"], size, n_sigma)
+
+    def predict_n_procs(
+        self,
+        stage,
+        max_procs,
+        level_of_theory=None,
+        size=None,
+        min_efficiency=0.7,
+        min_wall=600,
+    ):
+        """
+        Largest core count up to max_procs with a parallel efficiency
+        1 / (n_procs * (1 - f) + f) of at least min_efficiency, or max_procs
+        without a fit. With the size of the molecule, cores are taken off while
+        the predicted wall time is below min_wall seconds, so that small
+        molecules with little work leave the cores to other jobs.
+        """
+        fit = self.get_fit(stage, level_of_theory)
+        if fit is None or "parallel_fraction" not in fit:
+            return max_procs
+        f = fit["parallel_fraction"]
+        if f >= 1:
+            n_procs = max_procs
+        else:
+            n_procs = int((1 / min_efficiency - f) / (1 - f))
+            n_procs = min(max(n_procs, 1), max_procs)
+        if size is not None and "work" in fit:
+            work = predict_log_linear(fit["work"], size)
+            while n_procs > 1 and work * ((1 - f) + f / n_procs) < min_wall:
+                n_procs -= 1
+        return n_procs
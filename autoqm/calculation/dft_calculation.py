@@ -14,6 +14,7 @@ from pathlib import Path
 from .file_parser import mol2xyz, xyz2com, clean_xyz_str
 from .grab_QM_descriptors import read_log
 from .log_parser import G16Log
+from .watchdog import run_with_watchdog, ConnectivityCheck, SCFOscillationCheck
 from autoqm.parser.dft_opt_freq_parser import read_log_file, check_job_status
 
 
@@ -114,7 +115,18 @@ def dft_scf_opt(
     scratch_dir,
     subinputs_dir,
     suboutputs_dir,
+    remove_tmp=True,
+    watchdog=False,
+    ref_adj=None,
+    watchdog_poll_interval=10,
 ):
+    """
+    Run a Gaussian optimization of job_xyz and copy its log to suboutputs_dir.
+    With watchdog, the running log is checked for SCF oscillation, unless the
+    route uses a quadratically convergent SCF, and, if ref_adj is given, for
+    changes of the connectivity, and the job is killed as soon as either
+    shows up.
+    """
     current_dir = os.getcwd()
 
     job_scratch_dir = os.path.join(scratch_dir, f"{job_id}")
@@ -135,26 +147,38 @@ def dft_scf_opt(
     logfile = f"{job_id}.log"
     outfile = f"{job_id}.out"
 
+    watchdog_checks = []
+    if watchdog:
+        scf_check = SCFOscillationCheck.from_route(level_of_theory)
+        if scf_check is not None:
+            watchdog_checks.append(scf_check)
+        if ref_adj is not None:
+            watchdog_checks.append(ConnectivityCheck(ref_adj))
+
     start_time = time.time()
     with open(outfile, "w") as out:
-        subprocess.run(
+        reason = run_with_watchdog(
             "{} < {} >> {}".format(g16_command, comfile, logfile),
-            shell=True,
-            stdout=out,
-            stderr=out,
+            logfile,
+            out,
+            checks=watchdog_checks,
+            poll_interval=watchdog_poll_interval,
         )
     end_time = time.time()
     print(
         f"Optimization of {job_id} with {level_of_theory} took {end_time - start_time} seconds."
     )
+    if reason is not None:
+        print(f"Watchdog killed {job_id}: {reason}")
 
     shutil.copyfile(logfile, os.path.join(suboutputs_dir, f"{job_id}.log"))
-    try:
-        os.remove(os.path.join(subinputs_dir, f"{job_id}.tmp"))
-    except FileNotFoundError:
-        print(
-            f"{os.path.join(subinputs_dir, f'{job_id}.tmp')} not found. Already deleted?"
-        )
+    if remove_tmp:
+        try:
+            os.remove(os.path.join(subinputs_dir, f"{job_id}.tmp"))
+        except FileNotFoundError:
+            print(
+                f"{os.path.join(subinputs_dir, f'{job_id}.tmp')} not found. Already deleted?"
+            )
 
     job_stat = check_job_status(read_log_file(logfile))
 
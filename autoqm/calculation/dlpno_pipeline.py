@@ -0,0 +1,552 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import shutil
+import signal
+import sys
+import threading
+
+from autoqm.calculation.cost_model import get_xyz_size
+from autoqm.calculation.job_admission import JobAdmission
+from autoqm.calculation.job_queue import (
+    get_pending_jobs,
+    order_jobs,
+    DirListing,
+    JobClaimer,
+)
+from autoqm.calculation.utils import add_scheduling_arguments
+from autoqm.calculation.wft_calculation import (
+    dlpno_sp_calc,
+    get_orca_level_of_theory,
+    get_orca_resources,
+    set_orca_resources,
+)
+from autoqm.calculation.watchdog import terminate_job
+from autoqm.parser.orca_parser import inspect_orca_log
+
+# errors that ORCA may get past with more memory per core
+MEMORY_ERRORS = {"maxcore", "gtoint", "mdci"}
+# errors of the input itself, the later levels of the molecule are skipped
+INPUT_ERRORS = {"basis", "coordinates"}
+# ORCA can use more memory than maxcore, which should be about this fraction of
+# the memory per core
+ORCA_MAXCORE_FRACTION = 0.75
+
+
+def add_dlpno_arguments(parser):
+    """
+    Arguments of the DLPNO single point calculations on the inputs made by
+    scripts/calculation/make_dlpno_sp_input.py.
+    """
+    parser.add_argument(
+        "--output_folder", type=str, default="output", help="output folder name"
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        type=str,
+        required=True,
+        help="node-local scratch directory, e.g. $TMPDIR, ORCA is run in a subfolder per job",
+    )
+    parser.add_argument(
+        "--DLPNO_sp_folders",
+        type=str,
+        nargs="+",
+        default=["DLPNO_sp", "DLPNO_sp_f12"],
+        help="folders of the levels to run, in order: the job of a molecule at a level starts once the molecule is done with the previous levels",
+    )
+    parser.add_argument(
+        "--DLPNO_sp_max_attempts",
+        type=int,
+        default=3,
+        help="number of ORCA runs of a job in this allocation, memory errors are retried with twice the maxcore on half the cores",
+    )
+    parser.add_argument(
+        "--DLPNO_sp_max_passes",
+        type=int,
+        default=5,
+        help="number of passes through the levels, stopping early when a pass runs no job",
+    )
+    parser.add_argument(
+        "--DLPNO_sp_node_procs",
+        type=int,
+        default=None,
+        help="cores shared by the ORCA jobs run at the same time, from SLURM or the machine if not given",
+    )
+    parser.add_argument(
+        "--DLPNO_sp_node_mem",
+        type=int,
+        default=None,
+        help="memory (MB) shared by the ORCA jobs run at the same time, from SLURM or the machine if not given",
+    )
+    parser.add_argument("--ORCA_path", type=str, required=True, help="path to ORCA")
+    add_scheduling_arguments(parser)
+    return parser
+
+
+def get_node_resources(n_procs=None, mem=None):
+    """
+    Cores and memory (MB) of the node, from SLURM or the machine where not
+    given.
+    """
+    if n_procs is None:
+        n_procs = int(os.environ.get("SLURM_CPUS_ON_NODE", 0))
+        if not n_procs:
+            n_procs = len(os.sched_getaffinity(0))
+    if mem is None:
+        mem = int(os.environ.get("SLURM_MEM_PER_NODE", 0))
+        if not mem:
+            mem = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+    return n_procs, mem
+
+
+class NodeResources:
+    """
+    Cores and memory (MB) of the node left to the ORCA jobs run at the same
+    time. acquire blocks until a job fits or stop_event is set.
+    """
+
+    def __init__(self, n_procs, mem):
+        self.n_procs = n_procs
+        self.mem = mem
+        self.free_procs = n_procs
+        self.free_mem = mem
+        self.condition = threading.Condition()
+
+    def acquire(self, n_procs, mem, stop_event=None):
+        with self.condition:
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                if n_procs <= self.free_procs and mem <= self.free_mem:
+                    break
+                # wake up regularly to see the stop event
+                self.condition.wait(timeout=10)
+            self.free_procs -= n_procs
+            self.free_mem -= mem
+            return True
+
+    def release(self, n_procs, mem):
+        with self.condition:
+            self.free_procs += n_procs
+            self.free_mem += mem
+            self.condition.notify_all()
+
+
+class DLPNOPipeline:
+    """
+    Queue of the DLPNO single point jobs of all the levels. Each job gets the
+    cores and maxcore predicted by the cost model for its level of theory,
+    and jobs are run side by side while they fit on the node. Jobs of a level
+    without such a fit keep the resources of their input and run one at a
+    time. ORCA is run in
+    node-local scratch and its log classified with inspect_orca_log: normal
+    terminations and final errors are copied to the outputs, memory errors are
+    retried with more memory per core, and runs that stopped without a
+    termination message are retried and finally released for a later
+    allocation. The attempts of a job are recorded in
+    {mol_id}_remediation.json next to its log, for fit_cost_model.py.
+    On SIGTERM, no more jobs are started and the running ORCA processes are
+    terminated, each thread then releases its own job.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        submit_dir = os.path.abspath(os.getcwd())
+        output_dir = os.path.join(submit_dir, args.output_folder)
+        self.stages = list(args.DLPNO_sp_folders)
+        self.stage_dirs = {
+            stage: os.path.join(output_dir, stage) for stage in self.stages
+        }
+        os.makedirs(args.scratch_dir, exist_ok=True)
+
+        # only claim jobs that are predicted to finish before the allocation ends
+        self.admission = JobAdmission.from_args(args)
+        self.node = NodeResources(
+            *get_node_resources(args.DLPNO_sp_node_procs, args.DLPNO_sp_node_mem)
+        )
+        print(f"{self.node.n_procs} cores and {self.node.mem} MB for ORCA jobs")
+        self.sizes = dict()
+        # error of the final log of a molecule at a stage, read once
+        self.log_errors = dict()
+        # jobs released by this worker, left for a later allocation
+        self.released = set()
+        # set when the worker stops, running jobs are then released
+        self.stop_event = threading.Event()
+        self.stop_signal = None
+        # running ORCA processes by job, terminated when the worker stops
+        self.procs = dict()
+        self.procs_lock = threading.RLock()
+
+    @property
+    def stopping(self):
+        return self.stop_event.is_set()
+
+    def stop(self):
+        """
+        Start no more jobs and terminate the running ORCA processes.
+        """
+        with self.procs_lock:
+            self.stop_event.set()
+            procs = list(self.procs.values())
+        for proc in procs:
+            terminate_job(proc, group=True)
+
+    def handle_sigterm(self, signum, frame):
+        # the main thread stops claiming and returns, no exception is raised
+        # so that no claimed job is left between the claimer and a thread
+        print(f"Received signal {signum}, stopping the running jobs")
+        self.stop_signal = signum
+        self.stop()
+
+    def register_process(self, job, proc):
+        with self.procs_lock:
+            self.procs[job] = proc
+            stopping = self.stopping
+        # started after the running processes were terminated
+        if stopping:
+            terminate_job(proc, group=True)
+
+    def unregister_process(self, job):
+        with self.procs_lock:
+            self.procs.pop(job, None)
+
+    def get_input_size(self, stage, mol_id, subinputs_dir):
+        key = (stage, mol_id)
+        if key not in self.sizes:
+            for ext in [".in", ".tmp"]:
+                input_path = os.path.join(subinputs_dir, f"{mol_id}{ext}")
+                if os.path.exists(input_path):
+                    with open(input_path) as f:
+                        self.sizes[key] = get_xyz_size(f.read())
+                    break
+            else:
+                return None
+        return self.sizes[key]
+
+    def get_log_path(self, stage, mol_id):
+        return os.path.join(
+            self.stage_dirs[stage],
+            "outputs",
+            f"outputs_{mol_id // 1000}",
+            f"{mol_id}.log",
+        )
+
+    def list_pending_jobs(self, stage):
+        return get_pending_jobs(os.path.join(self.stage_dirs[stage], "inputs"))
+
+    def is_claimed(self, stage, mol_id, listing=None):
+        tmp_input_path = os.path.join(
+            self.stage_dirs[stage],
+            "inputs",
+            f"inputs_{mol_id // 1000}",
+            f"{mol_id}.tmp",
+        )
+        if listing is not None:
+            return listing.exists(tmp_input_path)
+        return os.path.exists(tmp_input_path)
+
+    def get_ready_jobs(self, stage, pending_jobs):
+        """
+        Pending jobs of the stage whose molecule is done with the previous
+        stages, that is has neither a pending nor a running job there. Jobs
+        after an input error at a previous stage, and jobs this worker already
+        released, are left out. Running jobs are seen from one listing per
+        input folder, and the logs of the previous stages are read once.
+        """
+        previous_stages = self.stages[: self.stages.index(stage)]
+        waiting = set()
+        for previous_stage in previous_stages:
+            waiting.update(
+                mol_id for mol_id, _ in self.list_pending_jobs(previous_stage)
+            )
+        listing = DirListing()
+        ready_jobs = []
+        for mol_id, subinputs_dir in pending_jobs:
+            if (stage, mol_id) in self.released:
+                continue
+            if mol_id in waiting or any(
+                self.is_claimed(previous_stage, mol_id, listing)
+                for previous_stage in previous_stages
+            ):
+                continue
+            input_error = self.get_input_error(previous_stages, mol_id)
+            if input_error is not None:
+                print(f"Skipping {stage} for {mol_id}: {input_error} error before")
+                continue
+            ready_jobs.append((mol_id, subinputs_dir))
+        return ready_jobs
+
+    def get_input_error(self, stages, mol_id):
+        """
+        Input error of the logs of the molecule at stages, which it is done
+        with, so that their logs are final and cached.
+        """
+        for stage in stages:
+            key = (stage, mol_id)
+            if key not in self.log_errors:
+                log_path = self.get_log_path(stage, mol_id)
+                error = None
+                if os.path.exists(log_path):
+                    error = inspect_orca_log(log_path)["error"]
+                self.log_errors[key] = error
+            if self.log_errors[key] in INPUT_ERRORS:
+                return self.log_errors[key]
+        return None
+
+    def run_stage(self, stage, pending_jobs=None):
+        """
+        Claim and run the ready jobs of the stage, returns the number of jobs
+        run.
+        """
+        args = self.args
+        if pending_jobs is None:
+            pending_jobs = self.list_pending_jobs(stage)
+        ready_jobs = self.get_ready_jobs(stage, pending_jobs)
+        job_dirs = dict(ready_jobs)
+
+        def predict_cost(mol_id):
+            size = self.get_input_size(stage, mol_id, job_dirs[mol_id])
+            if size is None:
+                return 0.0
+            return self.admission.cost_model.predict_wall(stage, size)
+
+        def admit(mol_id):
+            size = self.get_input_size(stage, mol_id, job_dirs[mol_id])
+            # done by another worker since it was listed
+            if size is None:
+                return False
+            return self.admission.admit(stage, size, mol_id)
+
+        # the threads release their own jobs when the worker stops
+        claimer = JobClaimer(
+            order_jobs(ready_jobs, args.job_order, predict_cost),
+            batch_size=args.claim_batch_size,
+            admit=admit,
+            release_on_sigterm=False,
+        )
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.node.n_procs) as executor:
+            try:
+                for mol_id, subinputs_dir in claimer:
+                    job = (mol_id, subinputs_dir)
+                    if self.stopping:
+                        claimer.release([job])
+                        break
+                    n_procs, mem = self.prepare_job(stage, mol_id, subinputs_dir)
+                    if not self.node.acquire(n_procs, mem, self.stop_event):
+                        claimer.release([job])
+                        break
+                    futures.append(
+                        executor.submit(
+                            self.run_packed_job,
+                            stage,
+                            mol_id,
+                            subinputs_dir,
+                            n_procs,
+                            mem,
+                        )
+                    )
+            except BaseException:
+                # running jobs release themselves instead of retrying
+                self.stop()
+                raise
+        for future in futures:
+            future.result()
+        return len(futures)
+
+    def plan_job(self, stage, script, size):
+        """
+        (maxcore, nprocs) of a job: the core count with a good parallel
+        efficiency for the size of its molecule and the memory per core
+        predicted by the cost model for its level of theory, those of the
+        input where not fitted, within the memory of the node.
+        """
+        maxcore, n_procs = get_orca_resources(script)
+        if maxcore is None or n_procs is None:
+            return maxcore, n_procs
+        level_of_theory = get_orca_level_of_theory(script)
+        cost_model = self.admission.cost_model
+        n_procs = cost_model.predict_n_procs(
+            stage, min(n_procs, self.node.n_procs), level_of_theory, size
+        )
+        predicted_maxcore = cost_model.predict_mem(stage, size, level_of_theory)
+        if predicted_maxcore is not None:
+            maxcore = int(math.ceil(predicted_maxcore))
+        max_n_procs = int(self.node.mem * ORCA_MAXCORE_FRACTION // maxcore)
+        return maxcore, max(min(n_procs, max_n_procs), 1)
+
+    def prepare_job(self, stage, mol_id, subinputs_dir):
+        """
+        Set the planned maxcore and nprocs in the input of a claimed job and
+        return the cores and memory (MB) it takes on the node.
+        """
+        tmp_input_path = os.path.join(subinputs_dir, f"{mol_id}.tmp")
+        with open(tmp_input_path) as f:
+            script = f.read()
+        fit = self.admission.cost_model.get_fit(
+            stage, get_orca_level_of_theory(script)
+        )
+        if not fit or ("parallel_fraction" not in fit and "mem" not in fit):
+            # without a fit of the cores or the memory of its level, the job
+            # keeps the resources of its input and has the node to itself
+            return self.node.n_procs, self.node.mem
+        maxcore, n_procs = self.plan_job(
+            stage, script, self.get_input_size(stage, mol_id, subinputs_dir)
+        )
+        if maxcore is None or n_procs is None:
+            # the whole node for inputs without %maxcore or nprocs
+            return self.node.n_procs, self.node.mem
+        if (maxcore, n_procs) != get_orca_resources(script):
+            with open(tmp_input_path, "w") as f:
+                f.write(set_orca_resources(script, maxcore, n_procs))
+        mem = math.ceil(maxcore * n_procs / ORCA_MAXCORE_FRACTION)
+        return n_procs, min(mem, self.node.mem)
+
+    def run_packed_job(self, stage, mol_id, subinputs_dir, n_procs, mem):
+        try:
+            self.run_job(stage, mol_id, subinputs_dir)
+        finally:
+            self.node.release(n_procs, mem)
+
+    def run_job(self, stage, mol_id, subinputs_dir):
+        """
+        Run ORCA on a claimed job until it terminates or max attempts are used.
+        The job is done, its .tmp file removed, when the log is final, and
+        released otherwise with the log kept next to its input.
+        """
+        args = self.args
+        tmp_input_path = os.path.join(subinputs_dir, f"{mol_id}.tmp")
+        log_path = self.get_log_path(stage, mol_id)
+        scratch_dir = os.path.join(args.scratch_dir, f"{stage}_{mol_id}")
+
+        log_info = None
+        scratch_log_path = None
+        retry = False
+        history = []
+        try:
+            for attempt in range(1, args.DLPNO_sp_max_attempts + 1):
+                if self.stopping:
+                    break
+                with open(tmp_input_path) as f:
+                    script = f.read()
+                maxcore, nprocs = get_orca_resources(script)
+                print(
+                    f"Running {stage} for {mol_id} on {nprocs} cores with maxcore {maxcore}, attempt {attempt}..."
+                )
+                try:
+                    scratch_log_path = dlpno_sp_calc(
+                        mol_id,
+                        args.ORCA_path,
+                        script,
+                        scratch_dir,
+                        on_start=lambda proc: self.register_process(
+                            (stage, mol_id), proc
+                        ),
+                    )
+                finally:
+                    self.unregister_process((stage, mol_id))
+                log_info = inspect_orca_log(scratch_log_path)
+                retry = False
+                status, error = log_info["status"], log_info["error"]
+                if status != "normal" and self.stopping:
+                    # terminated because the worker stops
+                    break
+                if status == "normal":
+                    failure = "normal"
+                elif error in MEMORY_ERRORS:
+                    failure = "memory_insufficient"
+                else:
+                    failure = error if error is not None else "incomplete"
+                history.append(
+                    {
+                        "attempt": attempt,
+                        "level_of_theory": get_orca_level_of_theory(script),
+                        "n_procs": nprocs,
+                        "job_ram": maxcore,
+                        "failure": failure,
+                        "error": error,
+                        "wall": log_info["wall"],
+                    }
+                )
+                if status == "normal":
+                    print(f"{stage} for {mol_id} done")
+                    break
+                if error in MEMORY_ERRORS:
+                    if maxcore is None or nprocs is None or nprocs == 1:
+                        print(f"{stage} for {mol_id} failed: {error} error")
+                        break
+                    # same memory per node, twice as much per core
+                    maxcore, nprocs = maxcore * 2, max(nprocs // 2, 1)
+                    print(
+                        f"{error} error for {mol_id}, retrying with maxcore {maxcore} and {nprocs} cores"
+                    )
+                    # kept in the input so that it stays if the job is released
+                    with open(tmp_input_path, "w") as f:
+                        f.write(set_orca_resources(script, maxcore, nprocs))
+                    retry = True
+                    continue
+                if status == "error":
+                    print(f"{stage} for {mol_id} failed: {error} error")
+                    break
+                print(f"{stage} for {mol_id} stopped without termination message")
+
+            # a memory error with an adjusted input left to try is not final,
+            # nor is an error of a run terminated because the worker stops
+            if log_info is not None and (
+                log_info["status"] == "normal"
+                or (log_info["error"] is not None and not retry and not self.stopping)
+            ):
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                shutil.copyfile(scratch_log_path, log_path)
+                history_path = os.path.join(
+                    os.path.dirname(log_path), f"{mol_id}_remediation.json"
+                )
+                with open(history_path, "w") as f:
+                    json.dump(history, f, indent=2)
+                try:
+                    os.remove(tmp_input_path)
+                except FileNotFoundError:
+                    print(f"{tmp_input_path} not found. Already deleted?")
+            else:
+                print(f"Releasing {stage} for {mol_id} for a later allocation")
+                self.released.add((stage, mol_id))
+                if scratch_log_path is not None and os.path.exists(scratch_log_path):
+                    shutil.copyfile(
+                        scratch_log_path,
+                        os.path.join(subinputs_dir, f"{mol_id}.log"),
+                    )
+                try:
+                    os.rename(
+                        tmp_input_path, os.path.join(subinputs_dir, f"{mol_id}.in")
+                    )
+                except FileNotFoundError:
+                    print(f"{tmp_input_path} not found. Already released?")
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def run_dlpno(args):
+    """
+    Pass through the levels in order until a pass runs no job, so that the
+    jobs of a level whose molecule was at a previous level in another worker
+    are picked up in a later pass.
+    """
+    pipeline = DLPNOPipeline(args)
+    previous_handler = signal.signal(signal.SIGTERM, pipeline.handle_sigterm)
+    try:
+        for n_pass in range(1, args.DLPNO_sp_max_passes + 1):
+            n_run = 0
+            for stage in pipeline.stages:
+                n_run += pipeline.run_stage(stage)
+                print(f"{stage} pass {n_pass} done.")
+                if pipeline.stopping:
+                    break
+            if n_run == 0 or pipeline.stopping:
+                break
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+    if pipeline.stop_signal is not None:
+        print("Stopped, the running jobs were released")
+        sys.exit(128 + pipeline.stop_signal)
+    print("Done!")
@@ -1,14 +1,247 @@
 from __future__ import print_function, absolute_import
 import shutil
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from rdkit import Chem
 from rdkit.Chem import AllChem
 from .log_parser import XtbLog
-from .file_parser import write_mol_to_sdf, load_sdf
+from .file_parser import write_mol_to_sdf
+from .conf_rmsd import get_symmetry_permutations, dedup_conformers
+from .conformer_ensemble import ConformerEnsemble
 import os
 from rdmc.mol import RDKitMol
 
+HARTREE_TO_EV = 27.211386245988
+
+
+def run_gfnff_opt(mol_block, xtb_path, scratch_dir, name):
+    """
+    Optimize one conformer with the xtb binary in its own scratch directory.
+    Returns (status, energy, coords, adjacency matrix, log text).
+    """
+    conf_scratch_dir = os.path.join(scratch_dir, name)
+    os.makedirs(conf_scratch_dir)
+    try:
+        input_file = f"{name}.sdf"
+        with open(os.path.join(conf_scratch_dir, input_file), "w") as f:
+            f.write(mol_block + "$$$$\n")
+
+        # one thread per xtb process, the parallelism comes from the pool
+        env = dict(os.environ, OMP_NUM_THREADS="1", MKL_NUM_THREADS="1")
+        xtb_command = os.path.join(xtb_path, "xtb")
+        output_file = os.path.join(conf_scratch_dir, f"{name}.log")
+        with open(output_file, "w") as out:
+            subprocess.call(
+                [xtb_command, "--gfnff", input_file, "--opt"],
+                stdout=out,
+                stderr=out,
+                cwd=conf_scratch_dir,
+                env=env,
+            )
+
+        log = XtbLog(output_file)
+        if not log.termination:
+            return "failed", None, None, None, None
+        try:
+            en = float(log.E)
+        except:
+            with open(output_file, "r") as f:
+                return "energy error", None, None, None, f.read()
+
+        opt_mol = Chem.MolFromMolFile(
+            os.path.join(conf_scratch_dir, "xtbopt.sdf"),
+            removeHs=False,
+            sanitize=False,
+        )
+        coords = opt_mol.GetConformer().GetPositions()
+        return "done", en, coords, Chem.GetAdjacencyMatrix(opt_mol), None
+    finally:
+        shutil.rmtree(conf_scratch_dir, ignore_errors=True)
+
+
+def run_gfnff_opt_api(symbols, coords, charges, name):
+    """
+    Optimize one conformer with GFN-FF through xtb-python and ASE without
+    starting any subprocess.
+    Returns (status, energy, coords, adjacency matrix, log text).
+    """
+    from ase import Atoms
+    from ase.optimize import BFGS
+    from xtb.ase.calculator import XTB
+
+    atoms = Atoms(symbols, positions=coords, charges=charges)
+    atoms.calc = XTB(method="GFN-FF")
+    try:
+        converged = BFGS(atoms, logfile=None).run(fmax=0.05, steps=1000)
+    except Exception:
+        return "failed", None, None, None, None
+    if not converged:
+        return "failed", None, None, None, None
+
+    en = atoms.get_potential_energy() / HARTREE_TO_EV
+    coords = atoms.get_positions()
+    xyz = "\n".join(
+        f"{s} {x:.8f} {y:.8f} {z:.8f}" for s, (x, y, z) in zip(symbols, coords)
+    )
+    post_mol = RDKitMol.FromXYZ(xyz, header=False, sanitize=False)
+    return "done", en, coords, post_mol.GetAdjacencyMatrix(), None
+
+
+def has_xtb_api():
+    try:
+        import ase.optimize
+        import xtb.ase.calculator
+    except ImportError:
+        return False
+    return True
+
+
+def gfnff_opt_confs(
+    mol,
+    conf_ids,
+    xtb_path,
+    scratch_dir,
+    mol_id,
+    n_procs=1,
+    backend="subprocess",
+    id_offset=0,
+):
+    """
+    Optimize the conformers of mol with GFN-FF and return
+    {conf_id: (status, energy, coords, adjacency matrix, log text)}.
+    backend is "subprocess" for the xtb binary, run as single threaded
+    processes over a pool of n_procs threads, "api" for xtb-python, run one
+    optimization at a time on up to n_procs OpenMP threads, or "auto" to use
+    xtb-python when it is installed.
+    """
+    if backend in ("api", "auto"):
+        # read when the xtb library is first loaded, so that the OpenMP
+        # threads of xtb-python stay within n_procs
+        os.environ.setdefault("OMP_NUM_THREADS", str(n_procs))
+    if backend == "auto":
+        backend = "api" if has_xtb_api() else "subprocess"
+    # xtb-python calculators are not documented as thread safe
+    n_workers = 1 if backend == "api" else n_procs
+
+    symbols = [atom.GetSymbol() for atom in mol.GetAtoms()]
+    charges = [atom.GetFormalCharge() for atom in mol.GetAtoms()]
+
+    results = dict()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = dict()
+        for id in conf_ids:
+            name = f"{mol_id}_{id + id_offset}"
+            if backend == "api":
+                coords = mol.GetConformer(id).GetPositions()
+                future = executor.submit(
+                    run_gfnff_opt_api, symbols, coords, charges, name
+                )
+            else:
+                mol_block = Chem.MolToMolBlock(mol, confId=id)
+                future = executor.submit(
+                    run_gfnff_opt, mol_block, xtb_path, scratch_dir, name
+                )
+            futures[id] = future
+        for id, future in futures.items():
+            results[id] = future.result()
+    return results
+
+
+def embed_confs(smi, num_confs, max_try, rms, seed, n_procs=1):
+    mol = RDKitMol.FromSmiles(smi)
+    mol.EmbedMultipleConfs(
+        num_confs,
+        maxAttempts=max_try,
+        pruneRmsThresh=rms,
+        randomSeed=seed,
+        useExpTorsionAnglePrefs=True,
+        useBasicKnowledge=True,
+        numThreads=n_procs,
+    )
+    return mol._mol
+
+
+def ff_opt_confs(
+    mol,
+    ids,
+    conf_search_FF,
+    XTB_path,
+    gfnff_scratch_dir,
+    mol_id,
+    subinputs_dir,
+    n_procs=1,
+    GFNFF_backend="subprocess",
+    id_offset=0,
+):
+    """
+    Optimize the conformers ids of mol in place with conf_search_FF and return
+    the list of (energy, conf id) of the conformers that passed the checks.
+    id_offset only shifts the conformer names used for files and messages.
+    """
+    diz = []
+    if conf_search_FF == "MMFF94s":
+        # build the force field once and minimize all conformers in one
+        # multi-threaded call
+        prop = AllChem.MMFFGetMoleculeProperties(mol, mmffVariant="MMFF94s")
+        ff = AllChem.MMFFGetMoleculeForceField(mol, prop)
+        results = AllChem.OptimizeMoleculeConfs(mol, ff, numThreads=n_procs)
+        for conf, (not_converged, en) in zip(mol.GetConformers(), results):
+            if conf.GetId() in ids:
+                econf = (float(en), conf.GetId())
+                diz.append(econf)
+    elif conf_search_FF == "GFNFF":
+        pre_adj = Chem.GetAdjacencyMatrix(mol)
+        results = gfnff_opt_confs(
+            mol,
+            ids,
+            XTB_path,
+            gfnff_scratch_dir,
+            mol_id,
+            n_procs=n_procs,
+            backend=GFNFF_backend,
+            id_offset=id_offset,
+        )
+        for id in ids:
+            status, en, coords, post_adj, log_text = results[id]
+            name = f"{mol_id}_{id + id_offset}"
+            if status == "energy error":
+                output_file_mol_id = f"{name}.log"
+                output_file_path = os.path.join(subinputs_dir, output_file_mol_id)
+                with open(output_file_path, "w") as f:
+                    f.write(log_text)
+                print(f"Error in {output_file_mol_id} file")
+                raise RuntimeError(f"Cannot read GFNFF energy of {name}")
+            elif status == "done":
+                if (pre_adj == post_adj).all():
+                    conf = mol.GetConformer(id)
+                    for i in range(mol.GetNumAtoms()):
+                        conf.SetAtomPosition(i, coords[i].tolist())
+                    econf = (en, id)
+                    diz.append(econf)
+                else:
+                    print(f"{name} failed adjacency matrix check")
+            else:
+                print(f"{name} failed optimization")
+    return diz
+
+
+def filter_confs(ensemble, E_cutoff_fraction, rmspost):
+    """
+    Apply the energy window and the post-optimization RMSD filter to a
+    ConformerEnsemble and return the survivors sorted by energy.
+    """
+    if E_cutoff_fraction:
+        ensemble = energy_filter(ensemble, E_cutoff_fraction)
+    else:
+        ensemble = ensemble.sort()
+
+    if rmspost and len(ensemble) > 1:
+        ensemble = postrmsd(ensemble, rmspost)
+    return ensemble
+
 
 # algorithm to generate nc conformations
 def _genConf(
@@ -25,7 +258,22 @@ def _genConf(
     scratch_dir,
     suboutputs_dir,
     subinputs_dir,
+    n_procs=1,
+    GFNFF_backend="subprocess",
+    tmpfs_dir="/dev/shm",
+    adaptive=False,
+    conf_round_size=50,
+    conf_patience=2,
+    conf_E_tol=1e-4,
 ):
+    """
+    Embed, optimize and filter the conformers of smi and save the lowest energy
+    ones to {mol_id}_confs.sdf. With adaptive, conformers are embedded and
+    optimized in rounds of conf_round_size with different random seeds, and
+    sampling stops once conf_patience successive rounds leave the relative
+    energies of the n_lowest_E_confs_to_save lowest unique conformers within
+    the energy window unchanged to conf_E_tol.
+    """
     mol = RDKitMol.FromSmiles(smi)
     nr = int(AllChem.CalcNumRotatableBonds(mol._mol))
 
@@ -34,115 +282,126 @@ def _genConf(
     num_confs = (
         num_confs if num_confs > n_lowest_E_confs_to_save else n_lowest_E_confs_to_save
     )
-    mol.EmbedMultipleConfs(
-        num_confs,
-        maxAttempts=max_try,
-        pruneRmsThresh=rms,
-        randomSeed=1,
-        useExpTorsionAnglePrefs=True,
-        useBasicKnowledge=True,
-    )
-    mol = mol._mol
-    ids = list(range(mol.GetNumConformers()))
-    if len(ids) == 0:
+    round_size = min(conf_round_size, num_confs) if adaptive else num_confs
+
+    # embedded rounds are kept so that a fallback force field starts from the
+    # same geometries
+    embedded = []
+
+    def get_round(k):
+        if k == len(embedded):
+            n_round = min(round_size, num_confs - k * round_size)
+            # nearby values of randomSeed repeat conformers in RDKit, e.g.
+            # randomSeed=2 gives every other conformer of randomSeed=1, so the
+            # rounds after the first get unrelated seeds from a SeedSequence
+            seed = 1
+            if k > 0:
+                seed = int(np.random.SeedSequence([1, k]).generate_state(1)[0] >> 1)
+            embedded.append(embed_confs(smi, n_round, max_try, rms, seed, n_procs))
+        return Chem.Mol(embedded[k])
+
+    n_rounds = -(-num_confs // round_size)
+    if get_round(0).GetNumConformers() == 0:
         print(f"{mol_id} failed embedding")
         return
+
+    # run the GFNFF optimizations in tmpfs when available
+    if tmpfs_dir and os.path.isdir(tmpfs_dir) and os.access(tmpfs_dir, os.W_OK):
+        gfnff_scratch_dir = tempfile.mkdtemp(prefix=f"{mol_id}_", dir=tmpfs_dir)
     else:
-        print(f"{len(ids)} embedded for {mol_id}")
+        gfnff_scratch_dir = tempfile.mkdtemp(prefix=f"{mol_id}_", dir=scratch_dir)
 
-    diz = []
-    pre_adj = Chem.GetAdjacencyMatrix(mol)
-    current_dir = os.getcwd()
+    try:
+        for conf_search_FF in conf_search_FFs:
+            ensemble = None
+            n_embedded = 0
+            n_stale = 0
+            prev_lowest_ens = None
+            for k in range(n_rounds):
+                round_mol = get_round(k)
+                round_ids = list(range(round_mol.GetNumConformers()))
+                if len(round_ids) == 0:
+                    print(f"{mol_id} no more conformers embedded in round {k}")
+                    break
+                print(f"{len(round_ids)} embedded for {mol_id}")
 
-    for conf_search_FF in conf_search_FFs:
-        for id in ids:
-            if conf_search_FF == "MMFF94s":
-                prop = AllChem.MMFFGetMoleculeProperties(mol, mmffVariant="MMFF94s")
-                ff = AllChem.MMFFGetMoleculeForceField(mol, prop, confId=id)
-                ff.Minimize()
-                en = float(ff.CalcEnergy())
-                econf = (en, id)
-                diz.append(econf)
-            elif conf_search_FF == "GFNFF":
-                scratch_dir_mol_id = os.path.join(scratch_dir, f"{mol_id}_{id}")
-                os.makedirs(scratch_dir_mol_id)
-                os.chdir(scratch_dir_mol_id)
-
-                input_file_mol_id = f"{mol_id}_{id}.sdf"
-                write_mol_to_sdf(mol, input_file_mol_id, id)
-
-                xtb_command = os.path.join(XTB_path, "xtb")
-                output_file_mol_id = f"{mol_id}_{id}.log"
-                with open(output_file_mol_id, "w") as out:
-                    subprocess.call(
-                        [xtb_command, "--gfnff", input_file_mol_id, "--opt"],
-                        stdout=out,
-                        stderr=out,
+                round_diz = ff_opt_confs(
+                    round_mol,
+                    round_ids,
+                    conf_search_FF,
+                    XTB_path,
+                    gfnff_scratch_dir,
+                    mol_id,
+                    subinputs_dir,
+                    n_procs=n_procs,
+                    GFNFF_backend=GFNFF_backend,
+                    id_offset=n_embedded,
+                )
+                n_embedded += len(round_ids)
+
+                round_ensemble = ConformerEnsemble.from_mol(round_mol, round_diz)
+                if ensemble is None:
+                    ensemble = round_ensemble
+                else:
+                    ensemble = ensemble.extend(round_ensemble)
+
+                if not adaptive or k == n_rounds - 1:
+                    continue
+                if len(ensemble) == 0:
+                    continue
+
+                # a round is stale if the relative energies of the unique lowest
+                # energy conformers did not change
+                kept = filter_confs(ensemble, E_cutoff_fraction, rmspost)
+                lowest_ens = kept.energies[:n_lowest_E_confs_to_save]
+                if (
+                    prev_lowest_ens is not None
+                    and len(lowest_ens) == len(prev_lowest_ens)
+                    and np.allclose(
+                        lowest_ens, prev_lowest_ens, rtol=0, atol=conf_E_tol
+                    )
+                ):
+                    n_stale += 1
+                else:
+                    n_stale = 0
+                prev_lowest_ens = lowest_ens
+                if n_stale >= conf_patience:
+                    print(
+                        f"{mol_id} conformer sampling converged after {n_embedded} embedded conformers"
                     )
-                if os.path.exists(output_file_mol_id):
-                    log = XtbLog(output_file_mol_id)
-                    if log.termination:
-                        try:
-                            en = float(log.E)
-                        except:
-                            shutil.copyfile(
-                                output_file_mol_id,
-                                os.path.join(subinputs_dir, output_file_mol_id),
-                            )
-                            print(f"Error in {output_file_mol_id} file")
-                            raise
-                        opt_mol = load_sdf("xtbopt.sdf")[0]
-                        post_adj = Chem.GetAdjacencyMatrix(opt_mol)
-                        if (pre_adj == post_adj).all():
-                            opt_conf = opt_mol.GetConformer()
-                            conf = mol.GetConformer(id)
-                            for i in range(mol.GetNumAtoms()):
-                                pt = opt_conf.GetAtomPosition(i)
-                                conf.SetAtomPosition(i, (pt.x, pt.y, pt.z))
-                            econf = (en, id)
-                            diz.append(econf)
-                        else:
-                            print(f"{mol_id}_{id} failed adjacency matrix check")
-                    else:
-                        print(f"{mol_id}_{id} failed optimization")
-                os.chdir(current_dir)
-                shutil.rmtree(scratch_dir_mol_id)
-
-        if len(diz) == 0:
+                    break
+
+            if ensemble is None or len(ensemble) == 0:
+                print(
+                    f"{mol_id} no conformer found after optimization with {conf_search_FF}"
+                )
+                continue
+            else:
+                print(
+                    f"{len(ensemble)} conformers found for {mol_id} after optimization with {conf_search_FF}"
+                )
+
+            ensemble = filter_confs(ensemble, E_cutoff_fraction, rmspost)
+
             print(
-                f"{mol_id} no conformer found after optimization with {conf_search_FF}"
+                f"{len(ensemble)} conformers found for {mol_id} after rmse and energy cutoff"
             )
-            continue
-        else:
-            print(
-                f"{len(ids)} conformers found for {mol_id} after optimization with {conf_search_FF}"
+            # only the saved conformers are turned back into a Mol
+            to_save = ensemble[:n_lowest_E_confs_to_save]
+            save_path = os.path.join(suboutputs_dir, "{}_confs.sdf".format(mol_id))
+            write_mol_to_sdf(
+                to_save.to_mol(),
+                save_path,
+                confIds=list(range(len(to_save))),
+                confEns=to_save.energies.tolist(),
             )
-
-        if E_cutoff_fraction:
-            n, diz2 = energy_filter(mol, diz, E_cutoff_fraction)
-        else:
-            n = mol
-            diz2 = diz
-
-        if rmspost and n.GetNumConformers() > 1:
-            o, diz3 = postrmsd(n, diz2, rmspost)
-        else:
-            o = n
-            diz3 = diz2
-
-        mol = o
-        ids = diz3
-
-        print(f"{len(ids)} conformers found for {mol_id} after rmse and energy cutoff")
-        ids_to_save = [id for (en, id) in ids[:n_lowest_E_confs_to_save]]
-        ens_to_save = [en for (en, id) in ids[:n_lowest_E_confs_to_save]]
-        save_path = os.path.join(suboutputs_dir, "{}_confs.sdf".format(mol_id))
-        write_mol_to_sdf(mol, save_path, confIds=ids_to_save, confEns=ens_to_save)
-        try:
-            os.remove(os.path.join(subinputs_dir, f"{mol_id}.tmp"))
-        except FileNotFoundError:
-            pass
-        return
+            try:
+                os.remove(os.path.join(subinputs_dir, f"{mol_id}.tmp"))
+            except FileNotFoundError:
+                pass
+            return
+    finally:
+        shutil.rmtree(gfnff_scratch_dir, ignore_errors=True)
 
     print(f"{mol_id} failed to find conformers")
     try:
@@ -155,47 +414,18 @@ def _genConf(
 
 
 # filter conformers based on relative energy
-def energy_filter(m, diz, E_cutoff_fraction):
-    diz.sort()
-    mini = float(diz[0][0])
+def energy_filter(ensemble, E_cutoff_fraction):
+    ensemble = ensemble.sort()
+    mini = ensemble.energies[0]
     sup = mini + abs(mini) * E_cutoff_fraction
-    n = Chem.Mol(m)
-    n.RemoveAllConformers()
-    n.AddConformer(m.GetConformer(int(diz[0][1])))
-    nid = []
-    ener = []
-    nid.append(int(diz[0][1]))
-    ener.append(float(diz[0][0]) - mini)
-    del diz[0]
-    for x, y in diz:
-        if x <= sup:
-            n.AddConformer(m.GetConformer(int(y)))
-            nid.append(int(y))
-            ener.append(float(x - mini))
-        else:
-            break
-    diz2 = list(zip(ener, nid))
-    return n, diz2
+    return ensemble[ensemble.energies <= sup].relative()
 
 
 # filter conformers based on geometric RMS
-def postrmsd(n, diz2, rmspost):
-    diz2.sort(key=lambda x: x[0])
-    o = Chem.Mol(n)
-    confidlist = [diz2[0][1]]
-    enval = [diz2[0][0]]
-    nh = Chem.RemoveHs(n)
-    del diz2[0]
-    for z, w in diz2:
-        confid = int(w)
-        p = 0
-        for conf2id in confidlist:
-            rmsd = AllChem.GetBestRMS(nh, nh, prbId=confid, refId=conf2id)
-            if rmsd < rmspost:
-                p = p + 1
-                break
-        if p == 0:
-            confidlist.append(int(confid))
-            enval.append(float(z))
-    diz3 = list(zip(enval, confidlist))
-    return o, diz3
+def postrmsd(ensemble, rmspost):
+    ensemble = ensemble.sort()
+    # symmetry permutations are computed once and all alignments are batched
+    nh, heavy_atoms = ensemble.heavy_atoms()
+    perms = get_symmetry_permutations(nh)
+    keep = dedup_conformers(ensemble.coords[:, heavy_atoms], perms, rmspost)
+    return ensemble[keep]
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import time
+
+from .cost_model import CostModel
+
+
+def parse_slurm_time(time_str):
+    """
+    Seconds in a SLURM time string, [days-]hours:minutes:seconds,
+    minutes:seconds or minutes. None for UNLIMITED or anything unparsable.
+    """
+    time_str = time_str.strip()
+    days = 0
+    if "-" in time_str:
+        days, time_str = time_str.split("-", 1)
+        days = int(days)
+    try:
+        parts = [int(part) for part in time_str.split(":")]
+    except ValueError:
+        return None
+    if len(parts) == 1:
+        seconds = parts[0] * 60
+    elif len(parts) == 2:
+        seconds = parts[0] * 60 + parts[1]
+    elif len(parts) == 3:
+        seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
+    else:
+        return None
+    return days * 86400 + seconds
+
+
+def get_job_end_time(walltime=None):
+    """
+    End of the allocation as a unix time. walltime is the remaining time
+    given on the command line; otherwise, or if it is UNLIMITED,
+    SLURM_JOB_END_TIME or the time left reported by squeue are used. None if
+    the end is unknown.
+    """
+    if walltime is not None:
+        seconds = parse_slurm_time(walltime)
+        if seconds is not None:
+            return time.time() + seconds
+
+    if os.environ.get("SLURM_JOB_END_TIME"):
+        return float(os.environ["SLURM_JOB_END_TIME"])
+
+    job_id = os.environ.get("SLURM_JOB_ID")
+    if job_id is None:
+        return None
+    try:
+        time_left = subprocess.run(
+            ["squeue", "-h", "-j", job_id, "-o", "%L"],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        ).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    time_left = time_left.splitlines()[0] if time_left.strip() else ""
+    seconds = parse_slurm_time(time_left) if time_left else None
+    if seconds is None:
+        return None
+    return time.time() + seconds
+
+
+class JobAdmission:
+    """
+    Decide whether a worker should claim a job: the runtime predicted by
+    cost_model, times safety_factor, plus margin seconds for copying results
+    back must fit in the time left before end_time. Without an end time every
+    job is admitted.
+    """
+
+    def __init__(self, end_time=None, cost_model=None, margin=300, safety_factor=1.5):
+        self.end_time = end_time
+        self.cost_model = cost_model if cost_model is not None else CostModel()
+        self.margin = margin
+        self.safety_factor = safety_factor
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Build from the arguments added by add_scheduling_arguments.
+        """
+        end_time = get_job_end_time(args.walltime)
+        if end_time is not None:
+            print(f"Allocation ends in {end_time - time.time():.0f} seconds")
+        cost_model = None
+        if args.cost_model is not None:
+            cost_model = CostModel.load(args.cost_model)
+        return cls(
+            end_time,
+            cost_model=cost_model,
+            margin=args.admission_margin,
+            safety_factor=args.admission_safety_factor,
+        )
+
+    def remaining(self):
+        if self.end_time is None:
+            return float("inf")
+        return self.end_time - time.time()
+
+    def admit(self, stage, size, job_id=None, reserved=0.0):
+        """
+        reserved is the predicted wall time (s) of jobs that run before this
+        one in the same process, e.g. the other molecules of a group, which
+        have to fit in the time left as well.
+        """
+        predicted = self.safety_factor * (
+            self.cost_model.predict_wall(stage, size) + reserved
+        )
+        remaining = self.remaining()
+        if predicted + self.margin <= remaining:
+            return True
+        print(
+            f"Not starting {stage} job {job_id}: predicted {predicted:.0f} s, {remaining:.0f} s left"
+        )
+        return False
@@ -0,0 +1,148 @@
+import os
+import signal
+import sys
+
+
+def get_pending_jobs(inputs_dir):
+    """
+    (job id, input dir) of every {job id}.in file below inputs_dir, whatever
+    the layout of its subfolders.
+    """
+    jobs = []
+    for subinputs_dir, _, files in os.walk(inputs_dir):
+        for input_file in files:
+            if input_file.endswith(".in"):
+                jobs.append((int(input_file[: -len(".in")]), subinputs_dir))
+    return jobs
+
+
+def order_jobs(jobs, job_order="lpt", cost=None):
+    """
+    Order pending jobs for claiming. With "lpt" the job with the largest cost,
+    a function of the job id, comes first, so that all the workers of an array
+    start on the long jobs and the short ones fill in at the end. "input"
+    keeps the order of the job ids.
+    """
+    if job_order == "lpt" and cost is not None:
+        return sorted(jobs, key=lambda job: (-cost(job[0]), job[0]))
+    return sorted(jobs)
+
+
+def claim_job(subinputs_dir, job_id):
+    """
+    Claim a job by renaming its .in file to .tmp. Returns False if another
+    worker got it first.
+    """
+    tmp_input_path = os.path.join(subinputs_dir, f"{job_id}.tmp")
+    if os.path.exists(tmp_input_path):
+        return False
+    try:
+        os.rename(os.path.join(subinputs_dir, f"{job_id}.in"), tmp_input_path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class DirListing:
+    """
+    Existence checks against one cached listdir per folder instead of one
+    stat per file, to keep the metadata load of scanning thousands of jobs
+    on a shared file system low. Files made by other workers after a folder
+    was first listed are not seen.
+    """
+
+    def __init__(self):
+        self.listings = dict()
+
+    def list(self, folder):
+        if folder not in self.listings:
+            try:
+                self.listings[folder] = set(os.listdir(folder))
+            except FileNotFoundError:
+                self.listings[folder] = set()
+        return self.listings[folder]
+
+    def exists(self, path):
+        folder, name = os.path.split(os.path.normpath(path))
+        return name in self.list(folder)
+
+    def add(self, path):
+        folder, name = os.path.split(os.path.normpath(path))
+        self.list(folder).add(name)
+
+    def makedirs(self, path):
+        if not self.exists(path):
+            os.makedirs(path, exist_ok=True)
+            self.add(path)
+
+
+class JobClaimer:
+    """
+    Iterate over ordered pending jobs, claiming them batch_size at a time.
+    admit, a function of the job id, is checked when a job is claimed and
+    again when it is started. Claimed jobs that were not started are
+    released, renamed back to .in, when the iteration ends for any reason.
+    On SIGTERM, as sent by SLURM at the time limit, the running job is
+    released as well, unless release_on_sigterm is False for callers that
+    run the jobs in other threads and release them there.
+    """
+
+    def __init__(self, jobs, batch_size=1, admit=None, release_on_sigterm=True):
+        self.jobs = list(jobs)
+        self.batch_size = batch_size
+        self.admit = admit
+        self.release_on_sigterm = release_on_sigterm
+        self.claimed = []
+        self.current = None
+
+    def claim_batch(self):
+        while self.jobs and len(self.claimed) < self.batch_size:
+            job_id, subinputs_dir = self.jobs.pop(0)
+            if self.admit is not None and not self.admit(job_id):
+                continue
+            if claim_job(subinputs_dir, job_id):
+                self.claimed.append((job_id, subinputs_dir))
+
+    def release(self, jobs):
+        for job_id, subinputs_dir in jobs:
+            try:
+                os.rename(
+                    os.path.join(subinputs_dir, f"{job_id}.tmp"),
+                    os.path.join(subinputs_dir, f"{job_id}.in"),
+                )
+            except FileNotFoundError:
+                continue
+            print(f"Released {job_id}")
+
+    def handle_sigterm(self, signum, frame):
+        if self.current is not None:
+            self.release([self.current])
+            self.current = None
+        sys.exit(128 + signum)
+
+    def __iter__(self):
+        previous_handler = None
+        if self.release_on_sigterm:
+            try:
+                previous_handler = signal.signal(signal.SIGTERM, self.handle_sigterm)
+            except ValueError:
+                # not the main thread
+                pass
+        try:
+            while True:
+                if not self.claimed:
+                    self.claim_batch()
+                    if not self.claimed:
+                        return
+                job = self.claimed.pop(0)
+                if self.admit is not None and not self.admit(job[0]):
+                    self.release([job])
+                    continue
+                self.current = job
+                yield job
+                self.current = None
+        finally:
+            self.release(self.claimed)
+            self.claimed = []
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
@@ -0,0 +1,666 @@
+import os
+import time
+
+import pandas as pd
+from rdkit import Chem
+from rdmc.mol import RDKitMol
+
+from autoqm.calculation.ff_conf_generation import _genConf
+from autoqm.calculation.semiempirical_calculation import semiempirical_opt
+from autoqm.calculation.remediation import dft_scf_opt_with_remediation
+from autoqm.calculation.cost_model import get_smiles_size
+from autoqm.calculation.job_admission import JobAdmission
+from autoqm.calculation.job_queue import (
+    get_pending_jobs,
+    order_jobs,
+    JobClaimer,
+    DirListing,
+)
+from autoqm.calculation.utils import add_scheduling_arguments
+from autoqm.parser.semiempirical_opt_parser import (
+    semiempirical_opt_parser,
+    get_mol_id_to_semiempirical_opted_xyz,
+)
+
+
+def add_nonts_arguments(parser):
+    """
+    Arguments of the force-field conformer search -> semiempirical optimization
+    -> DFT optimization & frequency pipeline.
+    """
+    parser.add_argument(
+        "--input_smiles",
+        type=str,
+        required=True,
+        help="input smiles included in a .csv file",
+    )
+    parser.add_argument(
+        "--output_folder", type=str, default="output", help="output folder name"
+    )
+    parser.add_argument(
+        "--task_id",
+        type=int,
+        default=0,
+        help="task id for the calculation",
+    )
+    parser.add_argument(
+        "--num_tasks",
+        type=int,
+        default=1,
+        help="number of tasks for the calculation",
+    )
+
+    # conformer searching
+    parser.add_argument(
+        "--FF_conf_folder",
+        type=str,
+        default="FF_conf",
+        help="Folder name for FF searched conformers",
+    )
+    parser.add_argument(
+        "--max_n_conf",
+        type=int,
+        default=800,
+        help="maximum number of FF conformers. nc = 3**n_rotatable_bonds, n_conf = nc if nc < max_n_conf else max_n_conf",
+    )
+    parser.add_argument(
+        "-max_conf_try",
+        type=int,
+        default=2000,
+        help="maximum attempt for conformer generating, "
+        "this is useful for molecules with many chiral centers.",
+    )
+    parser.add_argument(
+        "-rmspre",
+        type=float,
+        required=False,
+        default=0.1,
+        help="rms threshold pre optimization",
+    )
+    parser.add_argument(
+        "--rmspost",
+        type=float,
+        required=False,
+        default=0.4,
+        help="rms threshold post FF minimization",
+    )
+    parser.add_argument(
+        "--E_cutoff_fraction",
+        type=float,
+        required=False,
+        default=0.5,
+        help="energy window for FF minimization.",
+    )
+    parser.add_argument(
+        "--n_lowest_E_confs_to_save",
+        type=int,
+        default=10,
+        help="number of lowest energy conformers to save",
+    )
+    parser.add_argument(
+        "--FF_conf_n_procs",
+        type=int,
+        default=len(os.sched_getaffinity(0)),
+        help="number of threads for conformer embedding and FF optimization, defaults to the cores available to this task",
+    )
+    parser.add_argument(
+        "--GFNFF_backend",
+        type=str,
+        default="subprocess",
+        choices=["subprocess", "api", "auto"],
+        help="run GFNFF optimizations with the xtb binary, in process with xtb-python, or with xtb-python when installed",
+    )
+    parser.add_argument(
+        "--FF_conf_tmpfs_dir",
+        type=str,
+        default="/dev/shm",
+        help="in-memory scratch directory for GFNFF optimizations, falls back to scratch_dir if not available",
+    )
+    parser.add_argument(
+        "--adaptive_conf_sampling",
+        action="store_true",
+        help="embed and optimize conformers in rounds and stop once new rounds no longer change the lowest energy conformers",
+    )
+    parser.add_argument(
+        "--conf_round_size",
+        type=int,
+        default=50,
+        help="number of conformers embedded per round with --adaptive_conf_sampling",
+    )
+    parser.add_argument(
+        "--conf_patience",
+        type=int,
+        default=2,
+        help="number of successive rounds without new low energy conformers before stopping with --adaptive_conf_sampling",
+    )
+
+    # semiempirical optimization calculation
+    parser.add_argument(
+        "--semiempirical_opt_folder",
+        type=str,
+        default="semiempirical_opt",
+        help="folder for semiempirical optimization",
+    )
+    parser.add_argument(
+        "--gaussian_semiempirical_opt_theory",
+        type=str,
+        default="#opt=(calcall,maxcycle=128,noeig,nomicro,cartesian)",
+        help="level of theory for the Gaussian semiempirical calculation",
+    )
+    parser.add_argument(
+        "--gaussian_semiempirical_opt_n_procs",
+        type=int,
+        default=16,
+        help="number of process for Gaussian semiempirical calculations",
+    )
+    parser.add_argument(
+        "--gaussian_semiempirical_opt_job_ram",
+        type=int,
+        default=8000,
+        help="amount of ram (MB) allocated for each Gaussian semiempirical calculation",
+    )
+    parser.add_argument(
+        "--semiempirical_opt_mode",
+        type=str,
+        default="gaussian",
+        choices=["gaussian", "xtb_ohess", "xtb_opt"],
+        help="run GFN2-xTB through the Gaussian external interface, or directly with the xtb optimizer with (xtb_ohess) or without (xtb_opt) frequencies",
+    )
+    parser.add_argument(
+        "--semiempirical_cancel_duplicates",
+        action="store_true",
+        help="cancel conformer optimizations whose forces converge onto a minimum already found for the molecule",
+    )
+    parser.add_argument(
+        "--semiempirical_duplicate_rms_thresh",
+        type=float,
+        default=0.1,
+        help="RMSD threshold (angstrom) for a running conformer optimization to count as a duplicate minimum",
+    )
+    parser.add_argument(
+        "--semiempirical_watchdog",
+        action="store_true",
+        help="kill Gaussian semiempirical optimizations whose connectivity drifts away from the smiles",
+    )
+
+    # DFT optimization and frequency calculation
+    parser.add_argument(
+        "--DFT_opt_freq_folder",
+        type=str,
+        default="DFT_opt_freq",
+        help="folder for DFT optimization and frequency calculation",
+    )
+    parser.add_argument(
+        "--DFT_opt_freq_theory",
+        type=str,
+        default="#P opt=(calcfc,maxcycle=128,noeig,nomicro,cartesian) freq scf=(xqc) iop(7/33=1) iop(2/9=2000) guess=mix wb97xd/def2svp",
+        help="level of theory for the DFT calculation",
+    )
+    parser.add_argument(
+        "--DFT_opt_freq_theory_backup",
+        type=str,
+        default="#P opt=(calcall,maxcycle=64,noeig,nomicro,cartesian) freq scf=(tight, xqc) iop(7/33=1) iop(2/9=2000) guess=mix wb97xd/def2svp",
+        help="level of theory for the DFT calculation if DFT_opt_freq_theory failed",
+    )
+    parser.add_argument(
+        "--DFT_opt_freq_max_retries",
+        type=int,
+        default=3,
+        help="maximum number of resubmissions of a failed DFT calculation",
+    )
+    parser.add_argument(
+        "--DFT_watchdog",
+        action="store_true",
+        help="kill DFT optimizations with an oscillating SCF or a changed connectivity and resubmit them right away",
+    )
+    parser.add_argument(
+        "--DFT_opt_freq_n_procs",
+        type=int,
+        default=16,
+        help="number of process for DFT calculations",
+    )
+    parser.add_argument(
+        "--DFT_opt_freq_job_ram",
+        type=int,
+        default=62400,  # 3900*16
+        help="amount of ram (MB) allocated for each DFT calculation",
+    )
+    parser.add_argument(
+        "--DFT_opt_freq_auto_resources",
+        action="store_true",
+        help="choose the number of processors (up to DFT_opt_freq_n_procs) and the ram of each DFT calculation from --cost_model",
+    )
+
+    # specify paths
+    parser.add_argument(
+        "--XTB_path",
+        type=str,
+        required=False,
+        default=None,
+        help="path to installed XTB",
+    )
+    parser.add_argument(
+        "--G16_path",
+        type=str,
+        required=False,
+        default=None,
+        help="path to installed Gaussian 16",
+    )
+    parser.add_argument(
+        "--RDMC_path",
+        type=str,
+        required=False,
+        default=None,
+        help="path to RDMC to use xtb-gaussian script for xtb optimization calculation.",
+    )
+    parser.add_argument(
+        "--COSMOtherm_path",
+        type=str,
+        required=False,
+        default=None,
+        help="path to COSMOthermo",
+    )
+    parser.add_argument(
+        "--COSMO_database_path",
+        type=str,
+        required=False,
+        default=None,
+        help="path to COSMO_database",
+    )
+    parser.add_argument(
+        "--ORCA_path", type=str, required=False, default=None, help="path to ORCA"
+    )
+    parser.add_argument(
+        "--scratch_dir", type=str, required=True, help="scratch directory"
+    )
+    add_scheduling_arguments(parser)
+
+
+NONTS_STAGES = ["FF_conf", "semiempirical_opt", "DFT_opt_freq"]
+
+STAGE_DESCRIPTIONS = {
+    "FF_conf": "conformer searching",
+    "semiempirical_opt": "semiempirical optimization",
+    "DFT_opt_freq": "DFT optimization and frequency calculation",
+}
+
+
+class NontsPipeline:
+    """
+    The molecules of the input csv, with the charge and multiplicity from their
+    smiles, and the stages of the non-TS pipeline run on them. Built once per
+    process, so that a worker pulling many jobs parses the csv and the smiles
+    only once.
+    """
+
+    def __init__(self, args):
+        self.args = args
+
+        assert (
+            args.XTB_path is not None
+        ), f"XTB_PATH must be provided for GFNFF conformer search"
+        assert (
+            args.G16_path is not None
+        ), f"G16_PATH must be provided for semiempirical optimization and DFT optimization and frequency calculation"
+        assert (
+            args.RDMC_path is not None
+        ), f"RDMC_PATH must be provided for xtb optimization calculation"
+
+        submit_dir = os.path.abspath(os.getcwd())
+        output_dir = os.path.join(submit_dir, args.output_folder)
+        self.stage_dirs = {
+            "FF_conf": os.path.join(output_dir, args.FF_conf_folder),
+            "semiempirical_opt": os.path.join(
+                output_dir, args.semiempirical_opt_folder
+            ),
+            "DFT_opt_freq": os.path.join(output_dir, args.DFT_opt_freq_folder),
+        }
+        self.runners = {
+            "FF_conf": self.run_FF_conf,
+            "semiempirical_opt": self.run_semiempirical_opt,
+            "DFT_opt_freq": self.run_DFT_opt_freq,
+        }
+
+        df = pd.read_csv(args.input_smiles)
+        assert len(df["id"]) == len(set(df["id"])), "ids must be unique"
+
+        # create id to smile mapping
+        mol_ids = df["id"].tolist()
+        smiles_list = df["smi"].tolist()
+        self.mol_id_to_smi = dict(zip(mol_ids, smiles_list))
+        self.mol_id_to_charge = dict()
+        self.mol_id_to_mult = dict()
+        for k, v in self.mol_id_to_smi.items():
+            try:
+                mol = Chem.MolFromSmiles(v)
+            except Exception as e:
+                print(f"Cannot translate smi {v} to molecule for species {k}")
+
+            try:
+                charge = Chem.GetFormalCharge(mol)
+                self.mol_id_to_charge[k] = charge
+            except Exception as e:
+                print(f"Cannot determine molecular charge for species {k} with smi {v}")
+
+            num_radical_elec = 0
+            for atom in mol.GetAtoms():
+                num_radical_elec += atom.GetNumRadicalElectrons()
+            self.mol_id_to_mult[k] = num_radical_elec + 1
+
+        os.makedirs(args.scratch_dir, exist_ok=True)
+        self.mol_ids_smis = list(zip(mol_ids, smiles_list))
+
+        # only claim jobs that are predicted to finish before the allocation ends
+        self.admission = JobAdmission.from_args(args)
+
+    def predict_cost(self, stage, mol_id):
+        return self.admission.cost_model.predict_wall(
+            stage, get_smiles_size(self.mol_id_to_smi[mol_id])
+        )
+
+    def get_output_path(self, stage, mol_id):
+        """
+        File whose existence marks the stage as done for mol_id.
+        """
+        suboutputs_dir = os.path.join(
+            self.stage_dirs[stage], "outputs", f"outputs_{mol_id // 1000}"
+        )
+        if stage == "FF_conf":
+            return os.path.join(suboutputs_dir, f"{mol_id}_confs.sdf")
+        if stage == "semiempirical_opt":
+            return os.path.join(suboutputs_dir, f"{mol_id}.tar")
+        return os.path.join(suboutputs_dir, f"{mol_id}", f"{mol_id}.log")
+
+    def make_inputs(self, stage):
+        """
+        Make an input file for every molecule of this task that is not done
+        with the stage but done with the previous one.
+        """
+        args = self.args
+        print(f"Making input files for {STAGE_DESCRIPTIONS[stage]}...")
+
+        stage_dir = self.stage_dirs[stage]
+        os.makedirs(os.path.join(stage_dir, "inputs"), exist_ok=True)
+        os.makedirs(os.path.join(stage_dir, "outputs"), exist_ok=True)
+        stage_index = NONTS_STAGES.index(stage)
+
+        # one listdir per folder instead of a few stats per molecule
+        listing = DirListing()
+        for mol_id, smi in self.mol_ids_smis[
+            args.task_id : len(self.mol_ids_smis) : args.num_tasks
+        ]:
+            ids = mol_id // 1000
+            subinputs_dir = os.path.join(stage_dir, "inputs", f"inputs_{ids}")
+            suboutputs_dir = os.path.join(stage_dir, "outputs", f"outputs_{ids}")
+            listing.makedirs(suboutputs_dir)
+            if listing.exists(self.get_output_path(stage, mol_id)):
+                continue
+            if stage_index > 0 and not listing.exists(
+                self.get_output_path(NONTS_STAGES[stage_index - 1], mol_id)
+            ):
+                continue
+            listing.makedirs(subinputs_dir)
+            mol_id_path = os.path.join(subinputs_dir, f"{mol_id}.in")
+            if not listing.exists(mol_id_path) and not listing.exists(
+                os.path.join(subinputs_dir, f"{mol_id}.tmp")
+            ):
+                with open(mol_id_path, "w") as f:
+                    f.write("")
+                print(
+                    f"Making input file for {STAGE_DESCRIPTIONS[stage]} for {mol_id}..."
+                )
+
+    def list_pending_jobs(self, stage):
+        return get_pending_jobs(os.path.join(self.stage_dirs[stage], "inputs"))
+
+    def run_stage(self, stage, pending_jobs=None):
+        """
+        Claim and run the pending jobs of the stage, returns the number of
+        jobs run.
+        """
+        args = self.args
+        if pending_jobs is None:
+            pending_jobs = self.list_pending_jobs(stage)
+        claimer = JobClaimer(
+            order_jobs(
+                pending_jobs,
+                args.job_order,
+                lambda mol_id: self.predict_cost(stage, mol_id),
+            ),
+            batch_size=args.claim_batch_size,
+            admit=lambda mol_id: self.admission.admit(
+                stage, get_smiles_size(self.mol_id_to_smi[mol_id]), mol_id
+            ),
+        )
+        n_run = 0
+        for mol_id, subinputs_dir in claimer:
+            self.runners[stage](mol_id, subinputs_dir)
+            n_run += 1
+        return n_run
+
+    def run_FF_conf(self, mol_id, subinputs_dir):
+        args = self.args
+        ids = mol_id // 1000
+        suboutputs_dir = os.path.join(
+            self.stage_dirs["FF_conf"], "outputs", f"outputs_{ids}"
+        )
+        smi = self.mol_id_to_smi[mol_id]
+        print(f"Conformer searching with force field for {mol_id} {smi}...")
+        start_time = time.time()
+        _genConf(
+            smi,
+            mol_id,
+            args.XTB_path,
+            ["GFNFF", "MMFF94s"],
+            args.max_n_conf,
+            args.max_conf_try,
+            args.rmspre,
+            args.E_cutoff_fraction,
+            args.rmspost,
+            args.n_lowest_E_confs_to_save,
+            args.scratch_dir,
+            suboutputs_dir,
+            subinputs_dir,
+            n_procs=args.FF_conf_n_procs,
+            GFNFF_backend=args.GFNFF_backend,
+            tmpfs_dir=args.FF_conf_tmpfs_dir,
+            adaptive=args.adaptive_conf_sampling,
+            conf_round_size=args.conf_round_size,
+            conf_patience=args.conf_patience,
+        )
+        end_time = time.time()
+        print(
+            f"Time for conformer search for {mol_id} took {end_time - start_time} seconds"
+        )
+
+    def run_semiempirical_opt(self, mol_id, subinputs_dir):
+        args = self.args
+        ids = mol_id // 1000
+        suboutputs_dir = os.path.join(
+            self.stage_dirs["semiempirical_opt"], "outputs", f"outputs_{ids}"
+        )
+        smi = self.mol_id_to_smi[mol_id]
+        charge = self.mol_id_to_charge[mol_id]
+        mult = self.mol_id_to_mult[mol_id]
+        print(f"Optimizing conformers with semiempirical method for {mol_id} {smi}...")
+
+        tmp_mol_dir = os.path.join(suboutputs_dir, f"{mol_id}")
+        os.makedirs(tmp_mol_dir, exist_ok=True)
+
+        mols = RDKitMol.FromFile(self.get_output_path("FF_conf", mol_id))
+        mol_id_to_FF_opted_xyz_dict = {}
+        mol_id_to_FF_opted_xyz_dict[mol_id] = {}
+        for conf_id, mol in enumerate(mols):
+            mol_id_to_FF_opted_xyz_dict[mol_id][conf_id] = mol.ToXYZ()
+
+        start_time = time.time()
+        semiempirical_opt(
+            mol_id,
+            charge,
+            mult,
+            mol_id_to_FF_opted_xyz_dict,
+            args.XTB_path,
+            args.RDMC_path,
+            args.G16_path,
+            args.gaussian_semiempirical_opt_theory,
+            args.gaussian_semiempirical_opt_n_procs,
+            args.gaussian_semiempirical_opt_job_ram,
+            args.scratch_dir,
+            tmp_mol_dir,
+            suboutputs_dir,
+            subinputs_dir,
+            smi=smi,
+            cancel_duplicates=args.semiempirical_cancel_duplicates,
+            check_connectivity=args.semiempirical_watchdog,
+            duplicate_rms_thresh=args.semiempirical_duplicate_rms_thresh,
+            opt_mode=args.semiempirical_opt_mode,
+        )
+        end_time = time.time()
+        print(
+            f"Time for semiempirical optimization for {mol_id} took {end_time - start_time} seconds"
+        )
+
+    def run_DFT_opt_freq(self, mol_id, subinputs_dir):
+        args = self.args
+        smi = self.mol_id_to_smi[mol_id]
+        charge = self.mol_id_to_charge[mol_id]
+        mult = self.mol_id_to_mult[mol_id]
+
+        output_mol_dir = os.path.dirname(self.get_output_path("DFT_opt_freq", mol_id))
+        os.makedirs(output_mol_dir, exist_ok=True)
+
+        print(
+            f"Optimizing lowest energy semiempirical opted conformer with DFT method for {mol_id} {smi}..."
+        )
+
+        failed_job, valid_job = semiempirical_opt_parser(
+            mol_id, smi, self.get_output_path("semiempirical_opt", mol_id)
+        )
+
+        mols = RDKitMol.FromFile(self.get_output_path("FF_conf", mol_id))
+        FF_opted_xyz = next(iter(mols)).ToXYZ()
+
+        if valid_job:
+            mol_id_to_semiempirical_opted_xyz = get_mol_id_to_semiempirical_opted_xyz(
+                valid_job
+            )
+            job_xyz = mol_id_to_semiempirical_opted_xyz[mol_id]
+            level_of_theory = args.DFT_opt_freq_theory
+        else:
+            print(f"All semiempirical opted conformers failed for {mol_id}")
+            print(failed_job)
+
+            print(
+                "Trying to optimize lowest energy FF opted conformer with DFT method..."
+            )
+            job_xyz = FF_opted_xyz
+            level_of_theory = args.DFT_opt_freq_theory_backup
+
+        n_procs = args.DFT_opt_freq_n_procs
+        job_ram = args.DFT_opt_freq_job_ram
+        if args.DFT_opt_freq_auto_resources:
+            cost_model = self.admission.cost_model
+            size = get_smiles_size(smi)
+            n_procs = cost_model.predict_n_procs(
+                "DFT_opt_freq", args.DFT_opt_freq_n_procs, size=size
+            )
+            # keep the ram per processor unless more is needed
+            job_ram = int(
+                max(
+                    job_ram * n_procs / args.DFT_opt_freq_n_procs,
+                    cost_model.predict_mem("DFT_opt_freq", size, default=0),
+                )
+            )
+            print(f"Using {n_procs} processors and {job_ram} MB")
+
+        # failed jobs are classified and resubmitted with targeted
+        # keyword changes, falling back to the lowest energy FF
+        # opted conformer with the backup theory
+        dft_scf_opt_with_remediation(
+            mol_id,
+            job_xyz,
+            args.G16_path,
+            level_of_theory,
+            n_procs,
+            job_ram,
+            charge,
+            mult,
+            args.scratch_dir,
+            subinputs_dir,
+            output_mol_dir,
+            backup_xyz=FF_opted_xyz,
+            backup_level_of_theory=args.DFT_opt_freq_theory_backup,
+            max_retries=args.DFT_opt_freq_max_retries,
+            watchdog=args.DFT_watchdog,
+            ref_adj=RDKitMol.FromSmiles(smi).GetAdjacencyMatrix(),
+        )
+
+    def has_running_jobs(self, max_age=None):
+        """
+        Whether any worker holds a claimed job, whose outputs may still make
+        new inputs ready. Jobs claimed more than max_age seconds ago are taken
+        as left behind by a killed worker.
+        """
+        now = time.time()
+        for stage in NONTS_STAGES:
+            for root, _, files in os.walk(
+                os.path.join(self.stage_dirs[stage], "inputs")
+            ):
+                for file in files:
+                    if not file.endswith(".tmp"):
+                        continue
+                    if max_age is None:
+                        return True
+                    # the claim renames the input, which only updates its ctime
+                    try:
+                        stat = os.stat(os.path.join(root, file))
+                    except FileNotFoundError:
+                        continue
+                    if now - max(stat.st_mtime, stat.st_ctime) < max_age:
+                        return True
+        return False
+
+
+def run_worker(args):
+    """
+    Pull jobs of any stage until none is left or none fits in the time left.
+    Stages are passed through in order, so the outputs of a job are picked
+    up as inputs of the next stage in the following pass. When nothing is
+    pending but other workers still hold jobs, wait poll_interval seconds
+    for their outputs, ignoring jobs claimed more than stale_tmp_age seconds
+    ago and at most max_idle_polls times in a row.
+    """
+    pipeline = NontsPipeline(args)
+    n_passes = 0
+    n_idle_polls = 0
+    while True:
+        n_pending = 0
+        n_run = 0
+        for stage in NONTS_STAGES:
+            pipeline.make_inputs(stage)
+            pending_jobs = pipeline.list_pending_jobs(stage)
+            n_pending += len(pending_jobs)
+            n_run += pipeline.run_stage(stage, pending_jobs)
+        n_passes += 1
+        if n_run > 0:
+            n_idle_polls = 0
+            continue
+        if n_pending > 0 and any(
+            pipeline.list_pending_jobs(stage) for stage in NONTS_STAGES
+        ):
+            # pending jobs that were not taken by other workers were not admitted
+            print("No pending job fits in the time left")
+            break
+        if not pipeline.has_running_jobs(args.stale_tmp_age):
+            print("No job left")
+            break
+        if pipeline.admission.remaining() < args.poll_interval + args.admission_margin:
+            print("Allocation ends before other workers finish")
+            break
+        if args.max_idle_polls is not None and n_idle_polls >= args.max_idle_polls:
+            # the workers holding the jobs run the next stages of their outputs
+            print(f"No job became ready after {n_idle_polls} polls")
+            break
+        n_idle_polls += 1
+        time.sleep(args.poll_interval)
+    print(f"Worker done after {n_passes} passes")
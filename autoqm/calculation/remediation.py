@@ -0,0 +1,341 @@
+import os
+import re
+import json
+import shutil
+
+from .log_parser import G16Log
+from .dft_calculation import dft_scf_opt
+from .watchdog import get_watchdog_reason, CONNECTIVITY_REASON, SCF_OSCILLATION_REASON
+from autoqm.parser.dft_opt_freq_parser import load_geometry
+
+# failure class -> substrings searched in the log, checked in this order
+G16_FAILURE_PATTERNS = [
+    ("memory_request", ["could not allocate memory"]),
+    ("memory_insufficient", ["Out-of-memory error", "insufficient memory"]),
+    ("small_distance", ["Small interatomic distances encountered"]),
+    ("formbx", ["FormBX had a problem", "Error in internal coordinate system"]),
+    (
+        "scf_convergence",
+        ["Convergence failure -- run terminated", "SCF has not converged"],
+    ),
+    ("maxcycle", ["Number of steps exceeded", "Optimization stopped"]),
+]
+
+ROUTE_TOKEN = re.compile(r"[^\s=(]+=\([^)]*\)|[^\s(]+\([^)]*\)|\S+")
+
+
+def tail_lines(logfile, n_bytes=65536):
+    with open(logfile, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - n_bytes))
+        return f.read().decode("utf-8", errors="ignore").splitlines()
+
+
+def classify_g16_failure(logfile):
+    """
+    Classify the failure of a Gaussian job from its termination and error line.
+    Returns (failure class, error line).
+    """
+    if not os.path.isfile(logfile):
+        return "no_log", None
+
+    try:
+        glog = G16Log(str(logfile))
+    except Exception:
+        return "unknown", None
+    if glog.termination:
+        return "normal", None
+
+    lines = tail_lines(logfile)
+    reason = get_watchdog_reason(lines[-5:])
+    if reason == CONNECTIVITY_REASON:
+        return "watchdog_connectivity", reason
+    elif reason == SCF_OSCILLATION_REASON:
+        return "watchdog_scf_oscillation", reason
+
+    for failure, patterns in G16_FAILURE_PATTERNS:
+        for line in lines:
+            if any(pattern in line for pattern in patterns):
+                return failure, glog.error
+
+    if glog.error is None:
+        # no error termination at all, the job was killed
+        return "killed", None
+    if "l9999.exe" in glog.error:
+        return "link9999", glog.error
+    return "unknown", glog.error
+
+
+def parse_route(route):
+    """
+    Split a Gaussian route line into its prefix (#, #P, #N) and an ordered
+    dict mapping lowercase keyword to a list of options.
+    """
+    tokens = ROUTE_TOKEN.findall(route.strip())
+    prefix = ""
+    if tokens and tokens[0].startswith("#"):
+        prefix = tokens.pop(0)
+        # the prefix can be glued to the first keyword, e.g. "#opt=(...)"
+        if prefix.upper() not in ("#", "#P", "#N", "#T"):
+            tokens.insert(0, prefix.lstrip("#"))
+            prefix = "#"
+
+    keywords = dict()
+    for token in tokens:
+        if "=" in token and not token.lower().startswith("iop"):
+            keyword, value = token.split("=", 1)
+            options = [x.strip() for x in value.strip("()").split(",") if x.strip()]
+        else:
+            keyword, options = token, []
+        keywords[keyword.lower()] = options
+    return prefix, keywords
+
+
+def make_route(prefix, keywords):
+    tokens = [prefix] if prefix else []
+    for keyword, options in keywords.items():
+        if not options:
+            tokens.append(keyword)
+        elif len(options) == 1:
+            tokens.append(f"{keyword}={options[0]}")
+        else:
+            tokens.append(f"{keyword}=({','.join(options)})")
+    return " ".join(tokens)
+
+
+def get_option(options, name):
+    for option in options:
+        if option.lower().split("=")[0] == name:
+            return option.split("=")[1] if "=" in option else True
+    return None
+
+
+def set_option(options, name, value=None):
+    new_option = name if value is None else f"{name}={value}"
+    for i, option in enumerate(options):
+        if option.lower().split("=")[0] == name:
+            options[i] = new_option
+            return options
+    options.append(new_option)
+    return options
+
+
+def remove_option(options, name):
+    return [option for option in options if option.lower().split("=")[0] != name]
+
+
+# Each rule takes the route keywords and the number of times this failure class
+# was already remediated, edits the keywords in place and returns the geometry
+# to restart from ("last" or "backup") and a factor for the job ram.
+
+
+def remedy_scf_convergence(keywords, n_seen):
+    scf = keywords.setdefault("scf", [])
+    if n_seen == 0:
+        if get_option(scf, "qc") is None:
+            scf = set_option(scf, "xqc")
+        scf = set_option(scf, "maxcycle", 512)
+    else:
+        scf = remove_option(scf, "xqc")
+        scf = set_option(scf, "qc")
+        scf = set_option(scf, "maxcycle", 512)
+    keywords["scf"] = scf
+    return "last", 1.0
+
+
+def remedy_maxcycle(keywords, n_seen):
+    opt = keywords.setdefault("opt", [])
+    maxcycle = get_option(opt, "maxcycle")
+    maxcycle = int(maxcycle) if maxcycle not in (None, True) else 100
+    keywords["opt"] = set_option(opt, "maxcycle", min(2 * maxcycle, 512))
+    if n_seen > 0:
+        opt = remove_option(keywords["opt"], "calcfc")
+        keywords["opt"] = set_option(opt, "calcall")
+    return "last", 1.0
+
+
+def remedy_link9999(keywords, n_seen):
+    opt = keywords.setdefault("opt", [])
+    if get_option(opt, "calcall") is not None:
+        # calcall was already tried, start over from another geometry
+        return "backup", 1.0
+    keywords["opt"] = set_option(remove_option(opt, "calcfc"), "calcall")
+    return "last", 1.0
+
+
+def remedy_formbx(keywords, n_seen):
+    opt = keywords.setdefault("opt", [])
+    if get_option(opt, "cartesian") is None:
+        opt = remove_option(opt, "redundant")
+        keywords["opt"] = set_option(opt, "cartesian")
+        return "last", 1.0
+    maxstep = get_option(opt, "maxstep")
+    maxstep = int(maxstep) if maxstep not in (None, True) else 30
+    if maxstep <= 1:
+        # smaller steps were already tried, start over from another geometry
+        return "backup", 1.0
+    keywords["opt"] = set_option(opt, "maxstep", min(10, maxstep // 2))
+    return "last", 1.0
+
+
+def remedy_small_distance(keywords, n_seen):
+    return "backup", 1.0
+
+
+def remedy_memory_request(keywords, n_seen):
+    return "last", 0.75
+
+
+def remedy_memory_insufficient(keywords, n_seen):
+    return "last", 1.5
+
+
+REMEDIATION_RULES = {
+    "scf_convergence": remedy_scf_convergence,
+    "maxcycle": remedy_maxcycle,
+    "link9999": remedy_link9999,
+    "formbx": remedy_formbx,
+    "small_distance": remedy_small_distance,
+    "memory_request": remedy_memory_request,
+    "memory_insufficient": remedy_memory_insufficient,
+    # restart from the FF geometry when the bonds changed
+    "watchdog_connectivity": remedy_small_distance,
+    "watchdog_scf_oscillation": remedy_scf_convergence,
+}
+
+
+def get_last_geometry(logfile):
+    try:
+        xyz, step = load_geometry(logfile, standard_orientation=False)
+    except Exception:
+        return None
+    if step < 0 or not xyz:
+        return None
+    return xyz
+
+
+def dft_scf_opt_with_remediation(
+    job_id,
+    job_xyz,
+    g16_path,
+    level_of_theory,
+    n_procs,
+    job_ram,
+    charge,
+    mult,
+    scratch_dir,
+    subinputs_dir,
+    suboutputs_dir,
+    backup_xyz=None,
+    backup_level_of_theory=None,
+    max_retries=3,
+    watchdog=False,
+    ref_adj=None,
+):
+    """
+    Run dft_scf_opt and resubmit failed jobs with keyword changes and a restart
+    geometry chosen from the classified failure, up to max_retries times.
+    Every attempt is recorded in {job_id}_remediation.json in suboutputs_dir.
+    watchdog and ref_adj are passed on to dft_scf_opt.
+    """
+    logfile = os.path.join(suboutputs_dir, f"{job_id}.log")
+    gjffile = os.path.join(suboutputs_dir, f"{job_id}.gjf")
+    history_file = os.path.join(suboutputs_dir, f"{job_id}_remediation.json")
+
+    xyz = job_xyz
+    route = level_of_theory
+    geometry = "initial"
+    seen = dict()
+    history = []
+
+    for attempt in range(max_retries + 1):
+        converged = dft_scf_opt(
+            job_id,
+            xyz,
+            g16_path,
+            route,
+            n_procs,
+            job_ram,
+            charge,
+            mult,
+            scratch_dir,
+            subinputs_dir,
+            suboutputs_dir,
+            remove_tmp=False,
+            watchdog=watchdog,
+            ref_adj=ref_adj,
+        )
+
+        if converged:
+            failure, error = "normal", None
+        else:
+            failure, error = classify_g16_failure(logfile)
+        history.append(
+            {
+                "attempt": attempt,
+                "level_of_theory": route,
+                "geometry": geometry,
+                "n_procs": n_procs,
+                "job_ram": job_ram,
+                "failure": failure,
+                "error": error.strip() if error else None,
+            }
+        )
+        with open(history_file, "w") as f:
+            json.dump(history, f, indent=2)
+
+        if converged:
+            break
+
+        print(f"DFT optimization of {job_id} failed with {failure}: {error}")
+        if attempt == max_retries:
+            print(f"Retry budget exhausted for {job_id}")
+            break
+
+        prefix, keywords = parse_route(route)
+        previous_route, previous_geometry = route, geometry
+        if failure in REMEDIATION_RULES:
+            geometry, ram_factor = REMEDIATION_RULES[failure](
+                keywords, seen.get(failure, 0)
+            )
+            route = make_route(prefix, keywords)
+        elif backup_level_of_theory is not None and route != backup_level_of_theory:
+            # no targeted fix, fall back to the backup theory and geometry
+            geometry, ram_factor = "backup", 1.0
+            route = backup_level_of_theory
+        else:
+            print(f"No remediation for {failure} of {job_id}")
+            break
+        if route == previous_route and geometry == previous_geometry == "backup":
+            # the same job was just run
+            print(f"No new remediation for {failure} of {job_id}")
+            break
+        seen[failure] = seen.get(failure, 0) + 1
+
+        if geometry == "last":
+            last_xyz = get_last_geometry(logfile)
+            if last_xyz is not None:
+                xyz = last_xyz
+        elif geometry == "backup" and backup_xyz is not None:
+            xyz = backup_xyz
+        elif geometry == "backup":
+            # a geometry-related failure without any other geometry to try
+            print(f"No backup geometry for {job_id}")
+            break
+        job_ram = int(job_ram * ram_factor)
+
+        # keep the failed attempt for triage
+        for path in [logfile, gjffile]:
+            if os.path.exists(path):
+                root, ext = os.path.splitext(path)
+                shutil.move(path, f"{root}_attempt_{attempt}{ext}")
+
+        print(f"Resubmitting {job_id} with {route} from {geometry} geometry...")
+
+    try:
+        os.remove(os.path.join(subinputs_dir, f"{job_id}.tmp"))
+    except FileNotFoundError:
+        pass
+
+    return converged
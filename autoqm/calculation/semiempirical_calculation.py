@@ -1,6 +1,8 @@
 from genericpath import isfile
 from rdkit import Chem
 import os
+import re
+import json
 import shutil
 import subprocess
 import traceback
@@ -10,11 +12,62 @@ import numpy as np
 
 from .log_parser import XtbLog, G16Log
 from .file_parser import mol2xyz, xyz2com, write_mol_to_sdf, write_mols_to_sdf
+from .conf_rmsd import get_hydrogen_symmetry, min_rmsd_to
+from .watchdog import run_with_watchdog, ConnectivityCheck, DuplicateCheck
+from rdmc.mol import RDKitMol
+
+
+def read_opt_progress(logfile):
+    """
+    Read a running Gaussian optimization log and return the coordinates of the
+    last Input orientation, whether the forces of the last step are converged
+    and whether the job terminated normally.
+    """
+    coords, force_converged, termination = None, False, False
+    with open(logfile, "r") as f:
+        lines = f.readlines()
+    # the last line of a running job can be incomplete
+    if lines and not lines[-1].endswith("\n"):
+        lines = lines[:-1]
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if "Input orientation:" in line:
+            block = []
+            i += 5
+            while i < len(lines) and "-------" not in lines[i]:
+                block.append([float(x) for x in lines[i].split()[3:6]])
+                i += 1
+            if i < len(lines):
+                coords = np.array(block)
+            force_converged = False
+        elif "Maximum Force" in line:
+            force_converged = line.split()[-1] == "YES"
+        elif "RMS     Force" in line:
+            force_converged = force_converged and line.split()[-1] == "YES"
+        elif "Normal termination" in line:
+            termination = True
+        i += 1
+    return coords, force_converged, termination
 
 
 def run_xtb_opt(
-    xyz, charge, mult, mol_id, rdmc_path, g16_path, n_procs, job_ram, level_of_theory
+    xyz,
+    charge,
+    mult,
+    mol_id,
+    rdmc_path,
+    g16_path,
+    n_procs,
+    job_ram,
+    level_of_theory,
+    watchdog_checks=None,
+    poll_interval=5,
 ):
+    """
+    Optimize xyz with GFN2-xTB through Gaussian, watched by a LogWatchdog with
+    watchdog_checks. Returns the reason the watchdog killed the job or None.
+    """
     comfile = f"{mol_id}.gjf"
     logfile = f"{mol_id}.log"
     outfile = f"{mol_id}.out"
@@ -28,12 +81,129 @@ def run_xtb_opt(
     xyz2com(xyz, head=head, comfile=comfile, charge=charge, mult=mult, footer="\n")
 
     with open(outfile, "w") as out:
-        subprocess.run(
+        reason = run_with_watchdog(
             "{} < {} >> {}".format(g16_command, comfile, logfile),
-            shell=True,
-            stdout=out,
-            stderr=out,
+            logfile,
+            out,
+            checks=watchdog_checks,
+            poll_interval=poll_interval,
         )
+    return reason
+
+
+def parse_xyz(xyz):
+    """
+    Symbols and coordinates of an xyz string with or without the two header lines.
+    """
+    symbols, coords = [], []
+    for line in xyz.splitlines():
+        data = line.split()
+        if len(data) == 4 and data[0].isalpha():
+            symbols.append(data[0])
+            coords.append([float(x) for x in data[1:]])
+    return symbols, coords
+
+
+def get_xtb_time(lines, flag):
+    # the first timings after "total:" are those of the whole run
+    for i, line in enumerate(lines):
+        if line.strip() == "total:":
+            for line in lines[i + 1 : i + 4]:
+                if flag in line:
+                    data = re.findall(r"(\d+\.?\d*)", line)
+                    return (int(data[0]), int(data[1]), int(data[2]), float(data[3]))
+    return None
+
+
+def make_xtb_opt_record(logfile, opt_xyz_file, title_card):
+    """
+    Collect the results of a native xtb optimization into a dict with the
+    fields semiempirical_opt_parser extracts from Gaussian logs. xtb does not
+    reorient the molecule, so the standard orientation fields hold the same
+    geometry as the input orientation ones.
+    """
+    log = XtbLog(logfile)
+    with open(logfile, "r") as f:
+        lines = f.readlines()
+    text = "".join(lines)
+
+    record = dict()
+    record["termination"] = log.termination and os.path.isfile(opt_xyz_file)
+    record["title_card"] = title_card
+    if not record["termination"]:
+        return record
+
+    with open(opt_xyz_file, "r") as f:
+        symbols, coords = parse_xyz(f.read())
+    xyz = "".join(
+        f"{s}  {c[0]: .10f}  {c[1]: .10f}  {c[2]: .10f}\n"
+        for s, c in zip(symbols, coords)
+    )
+    record["xyz"] = xyz
+    record["xyz_dict"] = {
+        i + 1: (s, tuple(c)) for i, (s, c) in enumerate(zip(symbols, coords))
+    }
+
+    steps = re.findall(r"GEOMETRY OPTIMIZATION CONVERGED AFTER\s+(\d+)", text)
+    record["steps"] = int(steps[-1]) if steps else -1
+    record["freq"] = sorted(getattr(log, "wavenum", []))
+
+    scf = float(re.findall(r"TOTAL ENERGY\s+(-?\d+\.\d+)", text)[-1])
+    zpe = re.findall(r"zero point energy\s+(-?\d+\.\d+)", text)
+    gibbs = re.findall(r"TOTAL FREE ENERGY\s+(-?\d+\.\d+)", text)
+    zpe = float(zpe[-1]) if zpe else None
+    record["energy"] = {
+        "scf": scf,
+        "zpe_unscaled": zpe,
+        "scf_zpe_unscaled": scf + zpe if zpe is not None else None,
+        "gibbs": float(gibbs[-1]) if gibbs else None,
+    }
+    record["cpu"] = get_xtb_time(lines, "cpu-time")
+    record["wall"] = get_xtb_time(lines, "wall-time")
+    return record
+
+
+def run_xtb_native_opt(
+    xyz, charge, mult, mol_id, xtb_path, n_procs, xtb_opt_mode="ohess"
+):
+    """
+    Optimize xyz with GFN2-xTB using the optimizer of the xtb binary, with
+    frequencies if xtb_opt_mode is "ohess", and write the result record to
+    {mol_id}.json. The xtb output is kept in {mol_id}_xtb.log.
+    """
+    xyzfile = f"{mol_id}.xyz"
+    outfile = f"{mol_id}_xtb.log"
+    jsonfile = f"{mol_id}.json"
+
+    symbols, coords = parse_xyz(xyz)
+    with open(xyzfile, "w") as f:
+        f.write(f"{len(symbols)}\n{mol_id}\n")
+        for s, c in zip(symbols, coords):
+            f.write(f"{s} {c[0]:.8f} {c[1]:.8f} {c[2]:.8f}\n")
+
+    xtb_command = [
+        os.path.join(xtb_path, "xtb"),
+        xyzfile,
+        f"--{xtb_opt_mode}",
+        "--gfn",
+        "2",
+        "--chrg",
+        str(charge),
+        "--uhf",
+        str(mult - 1),
+        "-P",
+        str(n_procs),
+    ]
+    env = dict(os.environ, OMP_NUM_THREADS=str(n_procs))
+    with open(outfile, "w") as out:
+        subprocess.run(xtb_command, stdout=out, stderr=out, env=env)
+
+    record = make_xtb_opt_record(
+        outfile, "xtbopt.xyz", " ".join(["xtb"] + xtb_command[1:])
+    )
+    with open(jsonfile, "w") as f:
+        json.dump(record, f)
+    return record
 
 
 def semiempirical_opt(
@@ -51,21 +221,90 @@ def semiempirical_opt(
     tmp_mol_dir,
     suboutputs_dir,
     subinputs_dir,
+    smi=None,
+    cancel_duplicates=False,
+    check_connectivity=False,
+    duplicate_rms_thresh=0.1,
+    poll_interval=5,
+    opt_mode="gaussian",
 ):
+    """
+    Optimize the FF conformers of mol_id one after the other and tar the logs.
+    opt_mode "gaussian" runs xtb through the Gaussian external interface, while
+    "xtb_ohess" and "xtb_opt" run the xtb optimizer directly and tar a json
+    result record per conformer instead of the Gaussian log.
+    The Gaussian jobs are watched by a LogWatchdog given the smiles smi. With
+    cancel_duplicates, a conformer whose forces converge within
+    duplicate_rms_thresh RMSD of a minimum found by an earlier conformer is
+    cancelled. Hydrogens are included so that rotamers such as OH
+    orientations are not taken as duplicates. With check_connectivity, a
+    conformer whose bonds break or form is killed.
+    """
     current_dir = os.getcwd()
 
+    known_minima = dict()
+    if smi is not None and cancel_duplicates:
+        perms, h_groups = get_hydrogen_symmetry(RDKitMol.FromSmiles(smi)._mol)
+
+        def duplicate_check(coords):
+            if not known_minima:
+                return None
+            conf_inds = list(known_minima)
+            rmsd = min_rmsd_to(
+                coords, [known_minima[i] for i in conf_inds], perms, h_groups
+            )
+            if rmsd.min() < duplicate_rms_thresh:
+                return conf_inds[int(np.argmin(rmsd))]
+            return None
+
     for conf_ind, xyz in xyz_FF_dict[mol_id].items():
         comfile = f"{mol_id}_{conf_ind}.gjf"
         logfile = f"{mol_id}_{conf_ind}.log"
         outfile = f"{mol_id}_{conf_ind}.out"
 
+        if opt_mode != "gaussian":
+            jsonfile = f"{mol_id}_{conf_ind}.json"
+            xtb_outfile = f"{mol_id}_{conf_ind}_xtb.log"
+            if os.path.exists(os.path.join(tmp_mol_dir, jsonfile)):
+                continue
+            conf_scratch_dir = os.path.join(scratch_dir, f"{mol_id}_{conf_ind}")
+            os.makedirs(conf_scratch_dir)
+            os.chdir(conf_scratch_dir)
+            run_xtb_native_opt(
+                xyz,
+                charge,
+                mult,
+                f"{mol_id}_{conf_ind}",
+                xtb_path,
+                n_procs,
+                xtb_opt_mode=opt_mode.split("_")[1],
+            )
+            shutil.copyfile(xtb_outfile, os.path.join(tmp_mol_dir, xtb_outfile))
+            shutil.copyfile(jsonfile, os.path.join(tmp_mol_dir, jsonfile))
+            os.chdir(current_dir)
+            continue
+
         if os.path.exists(os.path.join(tmp_mol_dir, logfile)):
+            if smi is not None and cancel_duplicates:
+                add_known_minimum(
+                    known_minima, conf_ind, os.path.join(tmp_mol_dir, logfile)
+                )
             continue
 
         conf_scratch_dir = os.path.join(scratch_dir, f"{mol_id}_{conf_ind}")
         os.makedirs(conf_scratch_dir)
         os.chdir(conf_scratch_dir)
 
+        # checks keep state, so each job gets new ones
+        watchdog_checks = []
+        if smi is not None and cancel_duplicates:
+            watchdog_checks.append(DuplicateCheck(duplicate_check))
+        if smi is not None and check_connectivity:
+            ref_adj = RDKitMol.FromSmiles(smi).GetAdjacencyMatrix()
+            watchdog_checks.append(
+                ConnectivityCheck(ref_adj, orientation="Input orientation:")
+            )
+
         run_xtb_opt(
             xyz,
             charge,
@@ -76,9 +315,15 @@ def semiempirical_opt(
             n_procs,
             job_ram,
             level_of_theory,
+            watchdog_checks=watchdog_checks,
+            poll_interval=poll_interval,
         )
         shutil.copyfile(logfile, os.path.join(tmp_mol_dir, logfile))
         os.chdir(current_dir)
+        if smi is not None and cancel_duplicates:
+            add_known_minimum(
+                known_minima, conf_ind, os.path.join(tmp_mol_dir, logfile)
+            )
 
     mol_scratch_dir = os.path.join(scratch_dir, f"{mol_id}")
     os.makedirs(mol_scratch_dir)
@@ -88,8 +333,12 @@ def semiempirical_opt(
     tar_file = f"{mol_id}.tar"
     tar = tarfile.open(tar_file, "w")
     for conf_ind, xyz in xyz_FF_dict[mol_id].items():
-        logfile = f"{mol_id}_{conf_ind}.log"
-        tar.add(os.path.join(tmp_mol_dir, logfile))
+        if opt_mode != "gaussian":
+            for ext in [".json", "_xtb.log"]:
+                tar.add(os.path.join(tmp_mol_dir, f"{mol_id}_{conf_ind}{ext}"))
+        else:
+            logfile = f"{mol_id}_{conf_ind}.log"
+            tar.add(os.path.join(tmp_mol_dir, logfile))
     tar.close()
 
     shutil.copy(tar_file, os.path.join(suboutputs_dir, tar_file))
@@ -102,6 +351,19 @@ def semiempirical_opt(
     os.chdir(current_dir)
 
 
+def add_known_minimum(known_minima, conf_ind, logfile):
+    """
+    Add the final geometry of a normally terminated conformer optimization to
+    known_minima.
+    """
+    try:
+        coords, _, termination = read_opt_progress(logfile)
+    except (OSError, ValueError, IndexError):
+        return
+    if termination and coords is not None:
+        known_minima[conf_ind] = coords
+
+
 def xtb_status(folder, molid):
 
     try:
@@ -0,0 +1,110 @@
+import json
+import os
+import tarfile
+
+
+def read_journal(journal_path):
+    """
+    Members and end offset of a tar file recorded in its journal, (set(), None)
+    without a journal. A last line cut by a crash is ignored.
+    """
+    members = set()
+    offset = None
+    if not os.path.exists(journal_path):
+        return members, offset
+    with open(journal_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            members.update(entry["members"])
+            offset = entry["offset"]
+    return members, offset
+
+
+def read_tar_members(tar_file_path):
+    """
+    Basenames of the members of a tar file, from its journal if it has one,
+    otherwise from the tar file itself.
+    """
+    members, offset = read_journal(tar_file_path + ".journal")
+    if offset is not None:
+        return members
+    if not os.path.exists(tar_file_path):
+        return set()
+    with tarfile.open(tar_file_path, "r") as tar:
+        return set(os.path.basename(member.name) for member in tar.getmembers())
+
+
+class JournaledTarWriter:
+    """
+    Append files to a tar file in batches of flush_every units, a unit being
+    the files of one completed step. A flush writes the buffered files at the
+    end offset recorded in the journal next to the tar file, then records the
+    new members and end offset in the journal. The tar file is not reopened
+    in append mode, which rescans all its headers, and a flush cut by a crash
+    is overwritten by the next one since the journal was not updated.
+    """
+
+    def __init__(self, tar_file_path, flush_every=1):
+        self.tar_file_path = tar_file_path
+        self.journal_path = tar_file_path + ".journal"
+        self.flush_every = flush_every
+        self.buffer = []
+        self.n_units = 0
+
+        self.members, self.offset = read_journal(self.journal_path)
+        if self.offset is None or not os.path.exists(tar_file_path):
+            self.members = set()
+            self.offset = 0
+            if os.path.exists(tar_file_path):
+                # one scan of a tar file written before journals were kept
+                with tarfile.open(tar_file_path, "r") as tar:
+                    self.members = set(
+                        os.path.basename(member.name) for member in tar.getmembers()
+                    )
+                    self.offset = tar.offset
+            with open(self.journal_path, "w") as f:
+                f.write(
+                    json.dumps({"members": sorted(self.members), "offset": self.offset})
+                    + "\n"
+                )
+
+    def add(self, files):
+        """
+        Buffer the files of a completed unit, flushing every flush_every units.
+        """
+        self.buffer += files
+        self.n_units += 1
+        if self.n_units >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        mode = "r+b" if os.path.exists(self.tar_file_path) else "wb"
+        with open(self.tar_file_path, mode) as f:
+            f.seek(self.offset)
+            tar = tarfile.open(fileobj=f, mode="w")
+            for file in self.buffer:
+                tar.add(file, arcname=os.path.basename(file))
+            offset = tar.offset
+            tar.close()
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+        members = [os.path.basename(file) for file in self.buffer]
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps({"members": members, "offset": offset}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.members.update(members)
+        self.offset = offset
+        self.buffer = []
+        self.n_units = 0
+
+    def close(self):
+        self.flush()
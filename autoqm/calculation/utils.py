@@ -108,3 +108,42 @@ def add_gaussian_arguments(parser):
         "--g16_path", required=True, type=Path, help="path to installed Gaussian 16"
     )
     return parser
+
+
+def add_scheduling_arguments(parser):
+    scheduling_parser = parser.add_argument_group("Scheduling")
+    scheduling_parser.add_argument(
+        "--walltime",
+        default=None,
+        help="remaining wall time of the allocation as [days-]hours:minutes:seconds, read from SLURM if not given",
+    )
+    scheduling_parser.add_argument(
+        "--admission_margin",
+        type=float,
+        default=300,
+        help="seconds kept free at the end of the allocation when deciding whether to start a job",
+    )
+    scheduling_parser.add_argument(
+        "--admission_safety_factor",
+        type=float,
+        default=1.5,
+        help="factor applied to the predicted runtime of a job before checking that it fits",
+    )
+    scheduling_parser.add_argument(
+        "--cost_model",
+        default=None,
+        help="json file of a cost model fitted with scripts/parsing/fit_cost_model.py, default per stage estimates if not given",
+    )
+    scheduling_parser.add_argument(
+        "--job_order",
+        default="lpt",
+        choices=["lpt", "input"],
+        help="claim the jobs with the longest predicted runtime first (lpt) or in the order of their ids (input)",
+    )
+    scheduling_parser.add_argument(
+        "--claim_batch_size",
+        type=int,
+        default=1,
+        help="number of jobs a worker claims at once, the unstarted ones are released when it stops",
+    )
+    return parser
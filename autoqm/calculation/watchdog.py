@@ -0,0 +1,311 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+
+import numpy as np
+
+# appended to the log of a job killed by the watchdog, followed by the reason
+WATCHDOG_MARKER = "AutoQM watchdog killed the job:"
+CONNECTIVITY_REASON = "connectivity changed"
+SCF_OSCILLATION_REASON = "scf oscillation"
+DUPLICATE_REASON = "duplicate of conformer"
+
+SCF_ENERGY_LINE = re.compile(r"^\s*E=\s*(-?\d+\.\d+)\s+Delta-E=\s*(-?\d+\.\d+)")
+SCF_ROUTE_KEYWORD = re.compile(r"\bscf(?![a-z])\s*=?\s*(\([^)]*\)|[^\s(]+)", re.I)
+# SCF algorithms that take over from an oscillating DIIS by themselves
+SCF_QC_OPTIONS = {"qc", "xqc", "yqc"}
+
+
+def get_scf_options(route):
+    """
+    Options of the scf keyword of a Gaussian route as {name: value or None},
+    with lower case names.
+    """
+    options = dict()
+    for m in SCF_ROUTE_KEYWORD.finditer(route):
+        for option in re.split(r"[,\s]+", m[1].strip("()")):
+            if option:
+                name, _, value = option.lower().partition("=")
+                options[name] = value or None
+    return options
+
+
+class GeometryCheck:
+    """
+    Base class for checks that look at the geometries of a Gaussian log. Feed
+    it lines and it calls check_geometry with the atomic numbers and the
+    coordinates of each complete orientation block.
+    """
+
+    def __init__(self, orientation="Standard orientation:"):
+        self.orientation = orientation
+        self.block = None
+        self.n_skip = 0
+
+    def feed(self, line):
+        if self.orientation in line:
+            self.block = []
+            self.n_skip = 4
+            return None
+        if self.block is None:
+            return self.check_line(line)
+        if self.n_skip > 0:
+            self.n_skip -= 1
+            return None
+        if "-------" in line:
+            block, self.block = self.block, None
+            numbers = [int(data[1]) for data in block]
+            coords = np.array([[float(x) for x in data[3:6]] for data in block])
+            return self.check_geometry(numbers, coords)
+        self.block.append(line.split())
+        return None
+
+    def check_line(self, line):
+        return None
+
+    def check_geometry(self, numbers, coords):
+        return None
+
+
+class ConnectivityCheck(GeometryCheck):
+    """
+    Fail once patience successive geometries have a different adjacency matrix
+    than ref_adj. A job whose first geometry already differs is left alone.
+    """
+
+    def __init__(self, ref_adj, patience=2, orientation="Standard orientation:"):
+        super().__init__(orientation)
+        self.ref_adj = np.asarray(ref_adj)
+        self.patience = patience
+        self.enabled = None
+        self.n_changed = 0
+
+    def check_geometry(self, numbers, coords):
+        from rdkit import Chem
+        from rdmc.mol import RDKitMol
+
+        table = Chem.GetPeriodicTable()
+        xyz = "\n".join(
+            f"{table.GetElementSymbol(n)} {x:.8f} {y:.8f} {z:.8f}"
+            for n, (x, y, z) in zip(numbers, coords)
+        )
+        try:
+            adj = RDKitMol.FromXYZ(xyz, header=False, sanitize=False)
+            same = (adj.GetAdjacencyMatrix() == self.ref_adj).all()
+        except Exception:
+            same = False
+
+        if self.enabled is None:
+            self.enabled = same
+        if not self.enabled:
+            return None
+        self.n_changed = 0 if same else self.n_changed + 1
+        if self.n_changed >= self.patience:
+            return CONNECTIVITY_REASON
+        return None
+
+
+class SCFOscillationCheck:
+    """
+    Fail when the Delta-E of the SCF cycles printed with #P keeps changing
+    sign without decaying over the last window cycles of one SCF.
+    """
+
+    def __init__(self, window=64, min_delta=1e-5):
+        self.window = window
+        self.min_delta = min_delta
+        self.deltas = []
+
+    @classmethod
+    def from_route(cls, route, **kwargs):
+        """
+        Check for a job with the Gaussian route, or None if its SCF uses qc,
+        xqc or yqc, which are left to converge an oscillation. The window is
+        at most half the SCF maxcycle so that it can fire before the SCF stops.
+        """
+        options = get_scf_options(route)
+        if SCF_QC_OPTIONS & set(options):
+            return None
+        check = cls(**kwargs)
+        for name, value in options.items():
+            if name.startswith("maxcyc") and value is not None and value.isdigit():
+                check.window = max(2, min(check.window, int(value) // 2))
+        return check
+
+    def feed(self, line):
+        if "SCF Done" in line or "Cycle   1 " in line:
+            self.deltas = []
+            return None
+        m = SCF_ENERGY_LINE.match(line)
+        if m is None:
+            return None
+        self.deltas.append(float(m[2]))
+        if len(self.deltas) < self.window:
+            return None
+
+        last = np.array(self.deltas[-self.window :])
+        sign_changes = np.sum(np.sign(last[1:]) != np.sign(last[:-1]))
+        first_half = np.median(np.abs(last[: self.window // 2]))
+        second_half = np.median(np.abs(last[self.window // 2 :]))
+        if (
+            sign_changes >= self.window // 2
+            and second_half > self.min_delta
+            and second_half > 0.1 * first_half
+        ):
+            return SCF_OSCILLATION_REASON
+        return None
+
+
+class DuplicateCheck(GeometryCheck):
+    """
+    Fail when the forces of an optimization step are converged and
+    duplicate_check, called with its coordinates, returns the id of a known
+    minimum.
+    """
+
+    def __init__(self, duplicate_check, orientation="Input orientation:"):
+        super().__init__(orientation)
+        self.duplicate_check = duplicate_check
+        self.coords = None
+        self.force_converged = False
+
+    def check_geometry(self, numbers, coords):
+        self.coords = coords
+        self.force_converged = False
+        return None
+
+    def check_line(self, line):
+        if "Maximum Force" in line:
+            self.force_converged = line.split()[-1] == "YES"
+        elif "RMS     Force" in line:
+            if self.coords is None or line.split()[-1] != "YES":
+                return None
+            if not self.force_converged:
+                return None
+            duplicate_of = self.duplicate_check(self.coords)
+            if duplicate_of is not None:
+                return f"{DUPLICATE_REASON} {duplicate_of}"
+        return None
+
+
+class LogWatchdog(threading.Thread):
+    """
+    Tail the log of a running job by byte offset every poll_interval seconds,
+    feed the new complete lines to the checks and kill the process group of
+    the job as soon as one of them returns a failure reason.
+    """
+
+    def __init__(self, proc, logfile, checks, poll_interval=10):
+        super().__init__(daemon=True)
+        self.proc = proc
+        self.logfile = logfile
+        self.checks = checks
+        self.poll_interval = poll_interval
+        self.offset = 0
+        self.partial_line = ""
+        self.reason = None
+        self.stop_event = threading.Event()
+
+    def read_new_lines(self):
+        try:
+            with open(self.logfile, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+        lines = (self.partial_line + data.decode("utf-8", errors="ignore")).split(
+            "\n"
+        )
+        self.partial_line = lines.pop()
+        return lines
+
+    def run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            for line in self.read_new_lines():
+                for check in self.checks:
+                    reason = check.feed(line)
+                    if reason is not None:
+                        self.kill(reason)
+                        return
+            if self.proc.poll() is not None:
+                return
+
+    def kill(self, reason):
+        if self.proc.poll() is not None:
+            return
+        self.reason = reason
+        terminate_job(self.proc, group=True)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def terminate_job(proc, group=False):
+    """
+    Send SIGTERM to a job started with Popen, or to its whole process group.
+    """
+    try:
+        if group:
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            proc.terminate()
+    except ProcessLookupError:
+        pass
+
+
+def run_with_watchdog(command, logfile, out, checks=None, poll_interval=10):
+    """
+    Run a single shell command that writes logfile like subprocess.run,
+    watched by a LogWatchdog with checks. If the watchdog kills the job, a
+    WATCHDOG_MARKER line with the reason is appended to logfile and the reason
+    is returned.
+    The shell execs the command, and only a watched job gets its own session,
+    for the watchdog to kill all of its processes. The job is terminated if
+    the wait is interrupted, e.g. by a SIGTERM handler raising SystemExit.
+    """
+    proc = subprocess.Popen(
+        f"exec {command}",
+        shell=True,
+        stdout=out,
+        stderr=out,
+        start_new_session=bool(checks),
+    )
+    watchdog = None
+    if checks:
+        watchdog = LogWatchdog(proc, logfile, checks, poll_interval)
+        watchdog.start()
+    try:
+        proc.wait()
+    except BaseException:
+        terminate_job(proc, group=watchdog is not None)
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+    if watchdog is None:
+        return None
+
+    # a job that exited normally finished before the kill
+    if watchdog.reason is not None and proc.returncode == 0:
+        return None
+    if watchdog.reason is not None:
+        with open(logfile, "a") as f:
+            f.write(f"\n {WATCHDOG_MARKER} {watchdog.reason}\n")
+    return watchdog.reason
+
+
+def get_watchdog_reason(lines):
+    """
+    Return the reason a job was killed by the watchdog from the last lines of
+    its log, as str or bytes, or None.
+    """
+    for line in reversed(lines):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="ignore")
+        if WATCHDOG_MARKER in line:
+            return line.split(WATCHDOG_MARKER)[1].strip()
+    return None
@@ -1,60 +1,81 @@
-from fileinput import filename
 import os
+import re
 import shutil
 import subprocess
 
-from rdkit import Chem
-from .file_parser import mol2xyz
 
+def dlpno_sp_calc(mol_id, orca_path, script, scratch_dir, on_start=None):
+    """
+    Run ORCA on the input script in scratch_dir, a node-local folder emptied
+    first, and return the path of the log file, whether ORCA succeeded or not.
+    ORCA runs in its own session with its MPI processes, and on_start is
+    called with its Popen once started, e.g. to terminate the session when
+    the worker stops.
+    """
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    os.makedirs(scratch_dir)
 
-def dlpno_sp_calc(mol_id, orca_path, charge, mult, n_procs, job_ram, xyz_DFT_opt):
-    sdf = mol_id + ".sdf"
-    mol_dir = os.getcwd()
-
-    if xyz_DFT_opt:
-        coords = xyz_DFT_opt[mol_id]
-    else:
-        mol = Chem.SDMolSupplier(sdf, removeHs=False, sanitize=False)[0]
-        xyz = mol2xyz(mol)
-        coords = "\n".join(xyz.splitlines()[2:])
-
-    # create working directory
-    try:
-        shutil.rmtree("scratch")
-    except:
-        pass
-    os.makedirs("scratch")
-    os.chdir("scratch")
-
-    script = generate_dlpno_sp_input(coords, charge, mult, job_ram, n_procs)
-
-    infile = f"{mol_id}.in"
+    infile = os.path.join(scratch_dir, f"{mol_id}.in")
     with open(infile, "w+") as f:
         f.write(script)
 
-    # run jobs
+    # ORCA needs to be called with its full path to run in parallel
     orca_command = os.path.join(orca_path, "orca")
-    logfile = mol_id + ".log"
-    outfile = mol_id + ".out"
-    with open(outfile, "w") as out:
-        subprocess.run(
-            "{} {} > {}".format(orca_command, infile, logfile),
-            shell=True,
-            stdout=out,
-            stderr=out,
+    logfile = os.path.join(scratch_dir, f"{mol_id}.log")
+    with open(logfile, "w") as log:
+        proc = subprocess.Popen(
+            [orca_command, f"{mol_id}.in"],
+            cwd=scratch_dir,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
         )
+        if on_start is not None:
+            on_start(proc)
+        proc.wait()
+    return logfile
+
 
-    # check for normal termination
-    with open(logfile, "r") as f:
-        lines = f.readlines()
-    try:
-        assert any(["ORCA TERMINATED NORMALLY" in line for line in reversed(lines)])
-        os.chdir(mol_dir)
-        shutil.copy(os.path.join("scratch", logfile), logfile)
-        shutil.rmtree("scratch")
-    except:
-        os.chdir(mol_dir)
-        raise RuntimeError(f"ORCA calculation failed for {mol_id}")
+def get_orca_resources(script):
+    """
+    (maxcore, nprocs) of an ORCA input script, None where not set.
+    """
+    maxcore = re.search(r"^%maxcore\s+(\d+)", script, re.MULTILINE | re.IGNORECASE)
+    nprocs = re.search(r"^\s*nprocs\s+(\d+)", script, re.MULTILINE | re.IGNORECASE)
+    return (
+        int(maxcore.group(1)) if maxcore else None,
+        int(nprocs.group(1)) if nprocs else None,
+    )
+
+
+def get_orca_level_of_theory(script):
+    """
+    Keywords of the first ! line of an ORCA input script, None if there is
+    none.
+    """
+    for line in script.splitlines():
+        if line.startswith("!"):
+            return line[1:].strip()
+    return None
+
+
+def set_orca_resources(script, maxcore, nprocs):
+    """
+    ORCA input script with its %maxcore and %pal nprocs set to the given
+    values, as written by generate_dlpno_sp_input.
+    """
+    script = re.sub(
+        r"^%maxcore\s+\d+",
+        f"%maxcore {maxcore}",
+        script,
+        flags=re.MULTILINE | re.IGNORECASE,
+    )
+    return re.sub(
+        r"^(\s*)nprocs\s+\d+",
+        lambda match: f"{match.group(1)}nprocs {nprocs}",
+        script,
+        flags=re.MULTILINE | re.IGNORECASE,
+    )
 
 
 def generate_dlpno_sp_input(
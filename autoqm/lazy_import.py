@@ -0,0 +1,31 @@
+import importlib
+
+
+def lazy_star_import(package, submodules):
+    """
+    PEP 562 __getattr__ and __dir__ for a package that exposes the names of
+    its submodules as `from .submodule import *` would, but imports a
+    submodule only when one of its names is first used. As with star imports,
+    later submodules take precedence.
+    """
+
+    def __getattr__(name):
+        if name in submodules:
+            return importlib.import_module(f"{package}.{name}")
+        if not name.startswith("_"):
+            for submodule in reversed(submodules):
+                module = importlib.import_module(f"{package}.{submodule}")
+                try:
+                    return getattr(module, name)
+                except AttributeError:
+                    continue
+        raise AttributeError(f"module {package!r} has no attribute {name!r}")
+
+    def __dir__():
+        names = set(submodules)
+        for submodule in submodules:
+            module = importlib.import_module(f"{package}.{submodule}")
+            names.update(name for name in dir(module) if not name.startswith("_"))
+        return sorted(names)
+
+    return __getattr__, __dir__
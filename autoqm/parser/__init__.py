@@ -1,4 +1,13 @@
-from .utils import *
-from .ff_conf_parser import *
-from .semiempirical_opt_parser import *
-from .dft_opt_freq_parser import *
+from ..lazy_import import lazy_star_import
+
+__getattr__, __dir__ = lazy_star_import(
+    __name__,
+    [
+        "utils",
+        "ff_conf_parser",
+        "semiempirical_opt_parser",
+        "dft_opt_freq_parser",
+        "orca_parser",
+        "parse_driver",
+    ],
+)
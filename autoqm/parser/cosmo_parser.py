@@ -77,17 +77,91 @@ def cosmo_parser(tar_file_path):
         for member in tar:
             if member.name.endswith(".tab"):
                 f = tar.extractfile(member)
-                each_data_list = read_cosmo_tab_result_from_tar(f)
-                try:
-                    each_data_list = get_dHsolv_value(each_data_list)
-                except:
-                    print("dHsolv calculation failed")
-                    print(tar_file_path)
-                    print(each_data_list)
-                each_data_lists.append(each_data_list)
+                # the .tab of a batch of solvents holds the results of all of
+                # them, split it into one list per solvent
+                solvent_to_data_list = dict()
+                for each_data in read_cosmo_tab_result_from_tar(f):
+                    solvent_to_data_list.setdefault(each_data[0], []).append(
+                        each_data
+                    )
+                for each_data_list in solvent_to_data_list.values():
+                    try:
+                        each_data_list = get_dHsolv_value(each_data_list)
+                    except:
+                        print("dHsolv calculation failed")
+                        print(tar_file_path)
+                        print(each_data_list)
+                    each_data_lists.append(each_data_list)
         tar.close()
     except tarfile.ReadError:
         print("tar file read failed")
         print(tar_file_path)
         return None
     return each_data_lists
+
+
+COSMO_RESULT_COLUMNS = [
+    "solvent_name",
+    "solute_name",
+    "temp (K)",
+    "H (bar)",
+    "ln(gamma)",
+    "Pvap (bar)",
+    "Gsolv (kcal/mol)",
+]
+
+
+def cosmo_table_parser(tar_file_path):
+    """
+    Results of all the .tab members of a tar file as one table with a row per
+    solvent, solute and temperature and float columns for the values. None if
+    the tar file cannot be read.
+    """
+    import pandas as pd
+
+    rows = []
+    try:
+        with tarfile.open(tar_file_path) as tar:
+            for member in tar:
+                if member.name.endswith(".tab"):
+                    f = tar.extractfile(member)
+                    for each_data in read_cosmo_tab_result_from_tar(f):
+                        rows.append(
+                            [each_data[0], each_data[2], each_data[4]]
+                            + each_data[5:9]
+                        )
+    except tarfile.ReadError:
+        print("tar file read failed")
+        print(tar_file_path)
+        return None
+    df = pd.DataFrame(rows, columns=COSMO_RESULT_COLUMNS)
+    for column in COSMO_RESULT_COLUMNS[2:]:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df
+
+
+def get_dHsolv_values(df, T=298.15, dT=1.0):
+    """
+    Solvation enthalpy at T of every (solute, solvent) pair of a table from
+    cosmo_table_parser, from the solvation free energies at T - dT, T and
+    T + dT: dHsolv = dGsolv(T) + T * dSsolv with
+    dSsolv = -(dGsolv(T + dT) - dGsolv(T - dT)) / (2 * dT). It is set on the
+    rows at T and NaN elsewhere or when a temperature is missing.
+    """
+    import numpy as np
+
+    temps = df["temp (K)"].to_numpy()
+    gsolv = df["Gsolv (kcal/mol)"].to_numpy()
+    pairs = df["solute_name"].astype(str) + "\t" + df["solvent_name"].astype(str)
+    pair_codes, pair_index = np.unique(pairs.to_numpy(), return_inverse=True)
+
+    # Gsolv at T - dT, T and T + dT of each pair, NaN if missing
+    gsolv_at = np.full((len(pair_codes), 3), np.nan)
+    for k, temp in enumerate([T - dT, T, T + dT]):
+        mask = np.isclose(temps, temp)
+        gsolv_at[pair_index[mask], k] = gsolv[mask]
+    dSsolv = -(gsolv_at[:, 2] - gsolv_at[:, 0]) / (2 * dT)
+    dHsolv = gsolv_at[:, 1] + T * dSsolv
+
+    df["Hsolv (kcal/mol)"] = np.where(np.isclose(temps, T), dHsolv[pair_index], np.nan)
+    return df
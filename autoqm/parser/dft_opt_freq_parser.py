@@ -5,10 +5,8 @@ import os
 import re
 import numpy as np
 
-from rdmc.mol import RDKitMol
-from rdmc.external.logparser.gaussian import GaussianLog
-
 from .utils import make_xyz_str
+from autoqm.calculation.watchdog import get_watchdog_reason
 
 periodictable = [
     "",
@@ -192,6 +190,27 @@ def get_wall(self):
             return CPU
 
 
+def get_link0(self):
+    """
+    Number of processors and memory (MB) of the %nprocshared and %mem lines
+    echoed at the top of the log, None if not found.
+    """
+    n_procs = None
+    job_ram = None
+    units = {"kb": 1e-3, "mb": 1, "gb": 1e3, "kw": 8e-3, "mw": 8, "gw": 8e3}
+    for line in self:
+        line = line.strip().lower()
+        if line.startswith("%nprocshared=") or line.startswith("%nproc="):
+            n_procs = int(line.split("=")[1])
+        elif line.startswith("%mem="):
+            m = re.match(r"(\d+)\s*([kmg][bw])?", line.split("=")[1])
+            if m is not None:
+                job_ram = int(m[1]) * units.get(m[2], 8e-6)
+        elif line.startswith("#"):
+            break
+    return n_procs, job_ram
+
+
 # In[85]:
 
 
@@ -367,6 +386,9 @@ def dft_opt_freq_parser(
     check_connectivity=True,
     smi=None,
 ):
+    from rdmc.mol import RDKitMol
+    from rdmc.external.logparser.gaussian import GaussianLog
+
     failed_job = dict()
     valid_job = dict()
 
@@ -382,6 +404,10 @@ def dft_opt_freq_parser(
 
         if not job_stat:
             failed_job["reason"] = "error termination"
+            with open(g16_log, "r") as f:
+                watchdog_reason = get_watchdog_reason(f.readlines()[-5:])
+            if watchdog_reason is not None:
+                failed_job["reason"] = f"watchdog: {watchdog_reason}"
             try:
                 failed_job["dft_xyz_std_ori"] = load_geometry(
                     g16_log, standard_orientation=True
@@ -474,6 +500,10 @@ def dft_opt_freq_parser(
             valid_job["dft_steps"] = load_geometry(g16_log)[1]
             valid_job["dft_cpu"] = get_cpu(read_log_file(g16_log))
             valid_job["dft_wall"] = get_wall(read_log_file(g16_log))
+            (
+                valid_job["dft_n_procs"],
+                valid_job["dft_job_ram"],
+            ) = get_link0(read_log_file(g16_log))
             valid_job["dft_energy"] = load_energies(g16_log, zpe_scale_factor)
         except:
             valid_job = dict()
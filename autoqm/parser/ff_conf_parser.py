@@ -2,7 +2,6 @@
 # coding: utf-8
 
 import os
-from rdmc.mol import RDKitMol
 
 from .utils import make_xyz_str
 
@@ -25,6 +24,7 @@ def load_energy(mol):
 
 
 def ff_conf_parser(mol_id, mol_smi, mol_confs_sdf=None):
+    from rdmc.mol import RDKitMol
 
     failed_job = dict()
     valid_job = dict()
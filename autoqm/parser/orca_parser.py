@@ -0,0 +1,219 @@
+import os
+
+# markers of the ORCA log tail, in the order the error class is picked
+ORCA_ERROR_MARKERS = [
+    ("coordinates", b"You must have a"),
+    ("coordinates", b"block in your input"),
+    ("basis", b"The basis set was either not assigned or not available"),
+    ("scf_convergence", b"This wavefunction IS NOT CONVERGED!"),
+    ("scf_convergence", b"This wavefunction IS NOT FULLY CONVERGED!"),
+    ("scf", b"ORCA finished by error termination in SCF"),
+    ("maxcore", b"Please increase MaxCore - Skipping calculation"),
+    ("gtoint", b"ORCA finished by error termination in GTOInt"),
+    ("mdci", b"ORCA finished by error termination in MDCI"),
+    ("error_termination", b"ORCA finished by error termination"),
+]
+ORCA_NORMAL_TERMINATION = b"ORCA TERMINATED NORMALLY"
+
+
+def read_head_lines(f, n_lines, block_size=65536):
+    """
+    First n_lines lines of a file opened in binary mode, read in blocks so
+    that only the start of a long log is touched.
+    """
+    f.seek(0)
+    data = b""
+    while data.count(b"\n") < n_lines:
+        block = f.read(block_size)
+        if not block:
+            break
+        data += block
+    return data.splitlines(keepends=True)[:n_lines]
+
+
+def read_tail_lines(f, n_lines, block_size=8192):
+    """
+    Last n_lines lines of a file opened in binary mode, read backwards in
+    blocks from the end of the file like `tail -n`.
+    """
+    end = f.seek(0, os.SEEK_END)
+    pos = end
+    data = b""
+    # one more newline than lines asked for, unless the start is reached
+    while pos > 0 and data.count(b"\n") <= n_lines:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        data = f.read(read_size) + data
+    lines = data.splitlines(keepends=True)
+    if pos > 0:
+        # the first line may have been cut by the seek
+        lines = lines[1:]
+    return lines[-n_lines:] if n_lines else []
+
+
+def get_input_value(head_lines, keyword):
+    """
+    Integer ending the last line with keyword in the first lines of an ORCA
+    log, where the input is echoed, None if not found.
+    """
+    for line in reversed(head_lines):
+        if keyword in line:
+            try:
+                return int(line.split()[-1])
+            except ValueError:
+                return None
+    return None
+
+
+def get_orca_maxcore(head_lines):
+    """
+    maxcore (MB) echoed from the input in the first lines of an ORCA log,
+    None if not found.
+    """
+    return get_input_value(head_lines, b"maxcore")
+
+
+def get_orca_run_time(tail_lines):
+    """
+    Wall time (s) from the TOTAL RUN TIME line at the end of an ORCA log,
+    None if not found.
+    """
+    for line in reversed(tail_lines):
+        if line.startswith(b"TOTAL RUN TIME:"):
+            data = line.split(b":", 1)[1].split()
+            values = [float(value) for value in data[::2]]
+            days, hours, mins, secs, msecs = values
+            return days * 86400 + hours * 3600 + mins * 60 + secs + msecs / 1000
+    return None
+
+
+def inspect_orca_log(log_path, n_head_lines=200, n_tail_lines=30):
+    """
+    Status of an ORCA log from the first n_head_lines and last n_tail_lines
+    lines only. Returns a dict with
+        status: "normal", "error" or "incomplete" (still running or killed)
+        maxcore: maxcore (MB) of the input, None if not found
+        n_procs: number of processes of the input, None if not found
+        wall: wall time (s) of a finished run, None if not found
+        errors: set of the error classes found in the tail
+        error: the first of them in the order of ORCA_ERROR_MARKERS, or None
+    """
+    with open(log_path, "rb") as f:
+        head_lines = read_head_lines(f, n_head_lines)
+        tail_lines = read_tail_lines(f, n_tail_lines)
+
+    errors = set()
+    normal = False
+    for line in tail_lines:
+        for error_class, marker in ORCA_ERROR_MARKERS:
+            if marker in line:
+                errors.add(error_class)
+        if ORCA_NORMAL_TERMINATION in line:
+            normal = True
+
+    error = None
+    for error_class, _ in ORCA_ERROR_MARKERS:
+        if error_class in errors:
+            error = error_class
+            break
+
+    if normal:
+        status = "normal"
+    elif errors:
+        status = "error"
+    else:
+        status = "incomplete"
+
+    return {
+        "status": status,
+        "maxcore": get_orca_maxcore(head_lines),
+        "n_procs": get_input_value(head_lines, b"nprocs"),
+        "wall": get_orca_run_time(tail_lines),
+        "errors": errors,
+        "error": error,
+    }
+
+
+# messages of a failed single point, the last one found from the end of the log
+# gives the reason of the failure, as in process_dlpno_sp_result_parallel.py
+ORCA_RESULT_ERRORS = [
+    (b"This wavefunction IS NOT CONVERGED!", "This wavefunction IS NOT CONVERGED!"),
+    (b"ORCA finished by error termination in SCF", "SCF"),
+    (b"ORCA finished by error termination in MDCI", "MDCI"),
+    (b"Error : multiplicity", "The multiplicity and charge combination are wrong."),
+    (b"Wavefunction not fully converged!", "Wavefunction not fully converged!"),
+    (b"ORCA finished by error termination in GTOInt", "GTOInt"),
+]
+ORCA_FINAL_ENERGY = b"FINAL SINGLE POINT ENERGY"
+# bumped when the results of parse_orca_result change, so that cached results
+# are parsed again
+ORCA_RESULT_VERSION = 1
+
+
+class OrcaResultScanner:
+    """
+    Termination, failure reason and last single point energy (Hartree) of
+    ORCA log lines fed in file order.
+    """
+
+    def __init__(self):
+        self.normal = False
+        self.error = None
+        self.energy = None
+
+    def feed(self, line):
+        for marker, reason in ORCA_RESULT_ERRORS:
+            if marker in line:
+                self.normal, self.error = False, reason
+                break
+        else:
+            if ORCA_NORMAL_TERMINATION in line:
+                self.normal, self.error = True, None
+        if ORCA_FINAL_ENERGY in line:
+            self.energy = float(line.split()[-1])
+
+    def result(self):
+        if self.error is not None:
+            status = "error"
+        elif self.normal:
+            status = "normal"
+        else:
+            status = "incomplete"
+        return {"status": status, "error": self.error, "energy": self.energy}
+
+
+def parse_orca_result(log_path, n_tail_bytes=65536):
+    """
+    Status ("normal", "error" or "incomplete"), failure reason and final
+    single point energy (Hartree) of an ORCA log, from a single read of its
+    last n_tail_bytes. The whole log is scanned forward only when the tail
+    holds neither a termination message nor, for a finished run, the energy.
+    """
+    with open(log_path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        start = max(end - n_tail_bytes, 0)
+        f.seek(start)
+        lines = f.read().splitlines()
+        if start > 0:
+            # the first line may have been cut by the seek
+            lines = lines[1:]
+
+        scanner = OrcaResultScanner()
+        for line in lines:
+            scanner.feed(line)
+        result = scanner.result()
+        # the last termination or error message in the tail is the last one
+        # of the log, only the energy of a normal run may be further up
+        if (
+            start == 0
+            or result["status"] == "error"
+            or (result["status"] == "normal" and result["energy"] is not None)
+        ):
+            return result
+
+        scanner = OrcaResultScanner()
+        f.seek(0)
+        for line in f:
+            scanner.feed(line)
+        return scanner.result()
@@ -0,0 +1,134 @@
+import os
+import pickle as pkl
+
+# bumped when the layout of the cache file changes
+PARSE_CACHE_VERSION = 1
+
+
+def get_file_stamp(path):
+    """
+    (size, modification time) of a file, None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_parser_key(parse, parser_version=None):
+    """
+    Key of the results of parse in a cache: the cache layout, the qualified
+    name of parse and parser_version, to be bumped when its results change.
+    """
+    name = getattr(parse, "__qualname__", type(parse).__qualname__)
+    module = getattr(parse, "__module__", None)
+    return (PARSE_CACHE_VERSION, f"{module}.{name}", parser_version)
+
+
+class ParseCache:
+    """
+    Parse results of files saved in a pickle file between runs, reused while
+    a file keeps the size and modification time it was parsed with. The
+    results are dropped when the cache was written with another key, see
+    get_parser_key, or cannot be read.
+    """
+
+    def __init__(self, cache_path, key=None):
+        self.cache_path = cache_path
+        self.key = key
+        self.entries = self.load()
+
+    def load(self):
+        if not os.path.exists(self.cache_path):
+            return dict()
+        try:
+            with open(self.cache_path, "rb") as f:
+                data = pkl.load(f)
+        except Exception as e:
+            # truncated by a killed run or corrupted
+            print(f"Ignoring unreadable parse cache {self.cache_path}: {e!r}")
+            return dict()
+        if (
+            not isinstance(data, dict)
+            or "entries" not in data
+            or data.get("key") != self.key
+        ):
+            print(f"Ignoring parse cache {self.cache_path} of another parser")
+            return dict()
+        return data["entries"]
+
+    def get(self, path, stamp):
+        """
+        (True, result) if path was parsed with this stamp, (False, None)
+        otherwise.
+        """
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            return True, entry[1]
+        return False, None
+
+    def set(self, path, stamp, result):
+        self.entries[path] = (stamp, result)
+
+    def save(self):
+        tmp_cache_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_cache_path, "wb") as f:
+            pkl.dump(
+                {"key": self.key, "entries": self.entries},
+                f,
+                protocol=pkl.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_cache_path, self.cache_path)
+
+
+def parse_chunk(parse, paths):
+    return [parse(path) for path in paths]
+
+
+def parse_files(
+    parse, paths, n_jobs=1, chunk_size=500, cache_path=None, parser_version=None
+):
+    """
+    parse(path) of every existing file of paths, as a dict from path to
+    result. Files are sent to the joblib workers chunk_size at a time rather
+    than one by one. With cache_path, files unchanged since they were parsed
+    in an earlier run by the same parse and parser_version are not parsed
+    again.
+    """
+    from joblib import Parallel, delayed
+
+    cache = None
+    if cache_path is not None:
+        cache = ParseCache(cache_path, get_parser_key(parse, parser_version))
+    results = dict()
+    to_parse = []
+    stamps = dict()
+    for path in paths:
+        stamp = get_file_stamp(path)
+        if stamp is None:
+            continue
+        stamps[path] = stamp
+        if cache is not None:
+            found, result = cache.get(path, stamp)
+            if found:
+                results[path] = result
+                continue
+        to_parse.append(path)
+    print(f"Parsing {len(to_parse)} files, {len(results)} found in the cache")
+
+    chunks = [
+        to_parse[i : i + chunk_size] for i in range(0, len(to_parse), chunk_size)
+    ]
+    out = Parallel(n_jobs=n_jobs, backend="multiprocessing", verbose=5)(
+        delayed(parse_chunk)(parse, chunk) for chunk in chunks
+    )
+    for chunk, chunk_results in zip(chunks, out):
+        for path, result in zip(chunk, chunk_results):
+            results[path] = result
+            if cache is not None:
+                cache.set(path, stamps[path], result)
+
+    if cache is not None:
+        cache.save()
+    return results
@@ -3,6 +3,7 @@
 
 import os
 import re
+import json
 import tarfile
 import numpy as np
 import rdkit
@@ -10,6 +11,11 @@ import rdkit
 from rdmc.mol import RDKitMol
 
 from .utils import make_xyz_str
+from autoqm.calculation.conf_rmsd import get_hydrogen_symmetry, min_rmsd_to
+from autoqm.calculation.watchdog import get_watchdog_reason, DUPLICATE_REASON
+
+# Boltzmann constant in Hartree/K
+KB_HARTREE = 3.166811563e-6
 
 periodictable = [
     "",
@@ -134,6 +140,19 @@ periodictable = [
 ]
 
 
+def get_watchdog_failure(member, tar):
+    """
+    Return the failure reason of a job killed by the watchdog, or None.
+    """
+    f = tar.extractfile(member)
+    reason = get_watchdog_reason(f.readlines()[-5:])
+    if reason is None:
+        return None
+    if reason.startswith(DUPLICATE_REASON):
+        return f"duplicate of conf {reason.split()[-1]}"
+    return f"watchdog: {reason}"
+
+
 def check_job_status(member, tar):
     f = tar.extractfile(member)
     lines = f.readlines()
@@ -467,6 +486,96 @@ def get_title_card(member, tar, flag=b"Initial command:"):
     return title_card.decode()
 
 
+def xtb_opt_record_parser(member, tar, mol_smi, pre_adj):
+    """
+    Check the json record of a native xtb optimization like a Gaussian log and
+    return (failure reason or None, conformer dict).
+    """
+    record = json.load(tar.extractfile(member))
+    if not record["termination"]:
+        return "job status", None
+    if any(freq < 0 for freq in record["freq"]):
+        return "freq check", None
+
+    try:
+        post_mol = RDKitMol.FromXYZ(record["xyz"], header=False, sanitize=False)
+    except Exception as e:
+        return f"rdkit failed with {e}", None
+    if not (pre_adj == post_mol.GetAdjacencyMatrix()).all():
+        return "adjacency matrix", None
+
+    xyz_dict = {int(k): (v[0], tuple(v[1])) for k, v in record["xyz_dict"].items()}
+    conf_dict = dict()
+    conf_dict["mol_smi"] = mol_smi
+    conf_dict["semiempirical_title_card"] = record["title_card"]
+    conf_dict["semiempirical_freq"] = record["freq"]
+    conf_dict["semiempirical_xyz"] = record["xyz"]
+    conf_dict["semiempirical_xyz_dict"] = xyz_dict
+    conf_dict["semiempirical_steps"] = record["steps"]
+    # xtb keeps the input orientation
+    conf_dict["semiempirical_xyz_std_ori"] = record["xyz"]
+    conf_dict["semiempirical_xyz_dict_std_ori"] = xyz_dict
+    conf_dict["semiempirical_energy"] = record["energy"]
+    conf_dict["semiempirical_cpu"] = tuple(record["cpu"]) if record["cpu"] else None
+    conf_dict["semiempirical_wall"] = (
+        tuple(record["wall"]) if record["wall"] else None
+    )
+    return None, conf_dict
+
+
+def reduce_semiempirical_confs(
+    mol_smi, confs, energy_tol=5e-5, rms_thresh=0.125, temperature=298.15
+):
+    """
+    Find the valid conformers of one molecule that converged onto the same
+    minimum, i.e. scf energies within energy_tol Hartree and RMSD below
+    rms_thresh, and give the unique minima Boltzmann weights from their
+    Gibbs free energies at temperature, or their scf energies if a Gibbs free
+    energy is missing. Each conformer dict gets
+    semiempirical_duplicate_of (None for unique minima) and
+    semiempirical_boltzmann_weight (0 for duplicates).
+    """
+    perms, h_groups = get_hydrogen_symmetry(RDKitMol.FromSmiles(mol_smi)._mol)
+
+    conf_ids = sorted(confs, key=lambda x: confs[x]["semiempirical_energy"]["scf"])
+    unique_ids, unique_scfs, unique_coords = [], [], []
+    for conf_id in conf_ids:
+        conf = confs[conf_id]
+        scf = conf["semiempirical_energy"]["scf"]
+        coords = np.array(
+            [line.split()[1:4] for line in conf["semiempirical_xyz"].splitlines()],
+            dtype=float,
+        )
+
+        duplicate_of = None
+        same_energy = [
+            i for i, en in enumerate(unique_scfs) if abs(en - scf) < energy_tol
+        ]
+        if same_energy:
+            rmsd = min_rmsd_to(
+                coords, [unique_coords[i] for i in same_energy], perms, h_groups
+            )
+            if rmsd.min() < rms_thresh:
+                duplicate_of = unique_ids[same_energy[int(np.argmin(rmsd))]]
+
+        conf["semiempirical_duplicate_of"] = duplicate_of
+        conf["semiempirical_boltzmann_weight"] = 0.0
+        if duplicate_of is None:
+            unique_ids.append(conf_id)
+            unique_scfs.append(scf)
+            unique_coords.append(coords)
+
+    gibbs = [confs[x]["semiempirical_energy"]["gibbs"] for x in unique_ids]
+    if None in gibbs:
+        gibbs = [confs[x]["semiempirical_energy"]["scf"] for x in unique_ids]
+    gibbs = np.array(gibbs)
+    weights = np.exp(-(gibbs - gibbs.min()) / (KB_HARTREE * temperature))
+    weights /= weights.sum()
+    for conf_id, weight in zip(unique_ids, weights):
+        confs[conf_id]["semiempirical_boltzmann_weight"] = float(weight)
+    return unique_ids
+
+
 def semiempirical_opt_parser(mol_id, mol_smi, mol_confs_tar=None):
 
     valid_job = dict()
@@ -487,8 +596,26 @@ def semiempirical_opt_parser(mol_id, mol_smi, mol_confs_tar=None):
 
         tar = tarfile.open(mol_confs_tar)
         for member in tar:
-            conf_id = member.name.split(f"{mol_id}_")[1]
-            conf_id = int(conf_id.split(".log")[0])
+            name = os.path.basename(member.name)
+            if name.endswith(".json"):
+                conf_id = int(name[: -len(".json")].split(f"{mol_id}_")[1])
+                reason, conf_dict = xtb_opt_record_parser(
+                    member, tar, mol_smi, pre_adj
+                )
+                if reason is None:
+                    valid_job[mol_id][conf_id] = conf_dict
+                else:
+                    failed_job[mol_id][conf_id] = reason
+                continue
+            if not name.endswith(".log") or name.endswith("_xtb.log"):
+                # raw xtb output next to the json record
+                continue
+            conf_id = int(name[: -len(".log")].split(f"{mol_id}_")[1])
+
+            watchdog_failure = get_watchdog_failure(member, tar)
+            if watchdog_failure is not None:
+                failed_job[mol_id][conf_id] = watchdog_failure
+                continue
 
             job_stat = check_job_status(member, tar)
             if not job_stat:
@@ -539,6 +666,9 @@ def semiempirical_opt_parser(mol_id, mol_smi, mol_confs_tar=None):
                 failed_job[mol_id][conf_id] = "adjacency matrix"
                 continue
 
+        if valid_job[mol_id]:
+            reduce_semiempirical_confs(mol_smi, valid_job[mol_id])
+
         if not valid_job[mol_id]:
             del valid_job[mol_id]
             failed_job[mol_id]["reason"] = "all confs failed"
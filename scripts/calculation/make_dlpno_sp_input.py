@@ -3,9 +3,9 @@ import os
 import pickle as pkl
 import pandas as pd
 import rdkit.Chem as Chem
-import subprocess
 
 from autoqm.calculation.wft_calculation import generate_dlpno_sp_input
+from autoqm.parser.orca_parser import inspect_orca_log
 
 parser = ArgumentParser()
 parser.add_argument(
@@ -210,23 +210,7 @@ os.makedirs(outputs_dir, exist_ok=True)
 print("Make dlpno input files...")
 
 
-def get_maxcore(log_path):
-    proc = subprocess.run(
-        f"head -n 200 {log_path} | grep maxcore", shell=True, capture_output=True
-    )
-    strings = proc.stdout.split()
-    if strings:
-        return int(strings[-1])
-    return None
-
-
-def tail(f, n):
-    proc = subprocess.Popen(["tail", "-n", str(n), f], stdout=subprocess.PIPE)
-    lines = proc.stdout.readlines()
-    return lines
-
-
-def has_mdci_error(log_path, bypass=False, exclude_convergence=True):
+def has_mdci_error(log_info, bypass=False, exclude_convergence=True):
     """
     Check MDCI error in ORCA log. Most MDCI errors are due to ram issue or unexpected kill of the job. Use bypass to skip this test when needed as this might interference with maxcore check.
     """
@@ -234,75 +218,30 @@ def has_mdci_error(log_path, bypass=False, exclude_convergence=True):
     if bypass:
         return False
 
-    lines = tail(log_path, 30)
-
     # convergence error might also shown as MDCI error
-    if exclude_convergence:
-        for line in lines:
-            if b"ORCA finished by error termination in SCF" in line:
-                return False
-            if b"This wavefunction IS NOT CONVERGED!" in line:
-                return False
-
-    for line in lines:
-        if b"ORCA finished by error termination in MDCI" in line:
-            return True
-    else:
+    if exclude_convergence and log_info["errors"] & {"scf", "scf_convergence"}:
         return False
 
+    return "mdci" in log_info["errors"]
 
-def has_max_core_error(log_path, current_maxcore):
-    lines = tail(log_path, 30)
-    for line in lines:
-        if (
-            (b"Please increase MaxCore - Skipping calculation" in line)
-            or (b"ORCA finished by error termination in GTOInt" in line)
-            or (b"ORCA finished by error termination in MDCI" in line)
-        ):
-            maxcore = get_maxcore(log_path)
-            if maxcore is not None and maxcore < current_maxcore:
-                return True
-    # max core error can show up as SCF error
-    scf_error = False
-    wave_function_error = False
-    for line in lines:
-        if b"ORCA finished by error termination in SCF" in line:
-            scf_error = True
-        if b"This wavefunction IS NOT CONVERGED!" in line:
-            wave_function_error = True
-    if scf_error and not wave_function_error:
-        return True
-
-    return False
 
+def has_max_core_error(log_info, current_maxcore):
+    errors = log_info["errors"]
+    if errors & {"maxcore", "gtoint", "mdci"}:
+        maxcore = log_info["maxcore"]
+        if maxcore is not None and maxcore < current_maxcore:
+            return True
+    # max core error can show up as SCF error
+    return "scf" in errors and "scf_convergence" not in errors
 
-def has_wave_function_error(log_path):
-    lines = tail(log_path, 30)
-    # find wave function error
-    wave_function_error = False
-    for line in lines:
-        if b"This wavefunction IS NOT CONVERGED!" in line:
-            wave_function_error = True
-    if wave_function_error:
-        return True
 
-    return False
+def has_wave_function_error(log_info):
+    return "scf_convergence" in log_info["errors"]
 
 
 # added by oscar Jan 3, 2023
-def has_coordinates_error(log_path):
-    lines = tail(log_path, 30)
-    # find coordinates error
-    cord_error = False
-    for line in lines:
-        if b"You must have a" in line:
-            cord_error = True
-        if b"block in your input" in line:
-            cord_error = True
-    if cord_error:
-        return True
-
-    return False
+def has_coordinates_error(log_info):
+    return "coordinates" in log_info["errors"]
 
 
 mol_ids_smis = list(zip(mol_ids, smiles_list))
@@ -335,8 +274,11 @@ for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
     DLPNO_sp_level_of_theory = args.DLPNO_sp_level_of_theory
     if mol_id in xyz_DFT_opt_dict:
         if os.path.exists(log_path):
+            # head and tail of the log read once for all the checks below
+            log_info = inspect_orca_log(log_path)
+
             # check if maxcore error
-            # if has_max_core_error(log_path, args.DLPNO_sp_job_ram):
+            # if has_max_core_error(log_info, args.DLPNO_sp_job_ram):
             #     print(f"maxcore error for {mol_id}, removing...")
             #     try:
             #         os.remove(log_path)
@@ -344,7 +286,7 @@ for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
             #         print(f"file {log_path} not found, already removed?")
 
             # check if mdci error, set bypass if want to skip (not every restart need this, useful for core/ram change mostly)
-            if has_mdci_error(log_path, bypass=False):
+            if has_mdci_error(log_info, bypass=False):
                 print(f"mdci error for {mol_id}, removing...")
                 try:
                     os.remove(log_path)
@@ -352,7 +294,7 @@ for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
                     print(f"file {log_path} not found, already removed?")
 
             # check for cord error
-            if has_coordinates_error(log_path):
+            elif has_coordinates_error(log_info):
                 print(f"cords error for {mol_id}, removing...")
                 try:
                     os.remove(log_path)
@@ -360,7 +302,7 @@ for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
                     print(f"file {log_path} not found, already removed?")
 
             # check if wave function error
-        #     if has_wave_function_error(log_path):
+        #     if has_wave_function_error(log_info):
         #         try:
         #             if args.DLPNO_sp_level_of_theory == "uHF UNO DLPNO-CCSD(T)-F12D cc-pvtz-f12 def2/J cc-pvqz/c cc-pvqz-f12-cabs RIJCOSX VeryTightSCF NormalPNO":
         #                 DLPNO_sp_level_of_theory = "uHF UNO DLPNO-CCSD(T)-F12D cc-pvtz-f12 def2/J cc-pvqz/c cc-pvqz-f12-cabs RIJCOSX NormalSCF NormalPNO"
@@ -1,6 +1,5 @@
 from argparse import ArgumentParser
 import os
-import tarfile
 import shutil
 
 import pickle as pkl
@@ -8,8 +7,17 @@ import pandas as pd
 
 from rdkit import Chem
 
-from autoqm.calculation.cosmo_calculation import cosmo_calc
-from autoqm.calculation.utils import REPLACE_LETTER
+from autoqm.calculation.cosmo_calculation import cosmo_calc_multi_solute, SolventSet
+from autoqm.calculation.tar_writer import read_tar_members
+from autoqm.calculation.utils import REPLACE_LETTER, add_scheduling_arguments
+from autoqm.calculation.cost_model import get_xyz_size
+from autoqm.calculation.job_admission import JobAdmission
+from autoqm.calculation.job_queue import (
+    get_pending_jobs,
+    order_jobs,
+    JobClaimer,
+    DirListing,
+)
 
 parser = ArgumentParser()
 parser.add_argument(
@@ -63,6 +71,36 @@ parser.add_argument(
     default="common_solvent_list_final.csv",
     help="input file containing pure solvents used for COSMO calculation.",
 )
+parser.add_argument(
+    "--COSMO_batch_size",
+    type=int,
+    default=1,
+    help="number of solvents computed in a single COSMOtherm run, whose results are split back per solvent",
+)
+parser.add_argument(
+    "--COSMO_n_solutes",
+    type=int,
+    default=1,
+    help="number of molecules gathered by a worker to be computed in the same COSMOtherm runs, whose results are split back per molecule",
+)
+parser.add_argument(
+    "--COSMO_flush_every",
+    type=int,
+    default=10,
+    help="number of COSMOtherm runs whose results are buffered in the scratch directory before being written to the tar file of each molecule",
+)
+parser.add_argument(
+    "--COSMO_solvent_dir",
+    type=str,
+    default=None,
+    help="node-local directory, e.g. $TMPDIR, to copy the solvent .cosmo files to once per run instead of reading them from the shared databases",
+)
+parser.add_argument(
+    "--COSMO_turbomole_cache_dir",
+    type=str,
+    default=None,
+    help="directory of Turbomole results keyed by geometry, charge and multiplicity, shared between molecules, projects and reaction sets",
+)
 
 # specify paths
 parser.add_argument(
@@ -99,6 +137,7 @@ parser.add_argument(
 parser.add_argument(
     "--ORCA_path", type=str, required=False, default=None, help="path to ORCA"
 )
+add_scheduling_arguments(parser)
 
 args = parser.parse_args()
 
@@ -170,6 +209,8 @@ print(f"Number of tasks: {args.num_tasks}")
 
 mol_ids_smis = list(zip(mol_ids, mol_smis))
 
+# one listdir per folder instead of a few stats per molecule
+listing = DirListing()
 for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
     if mol_id in xyz_DFT_opt_dict:
         print(f"Mol id: {mol_id} in xyz dict")
@@ -177,32 +218,28 @@ for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
         ids = mol_id // 1000
         subinputs_dir = os.path.join(inputs_dir, f"inputs_{ids}")
         suboutputs_dir = os.path.join(outputs_dir, f"outputs_{ids}")
-        os.makedirs(suboutputs_dir, exist_ok=True)
+        listing.makedirs(suboutputs_dir)
         input_file_path = os.path.join(subinputs_dir, f"{mol_id}.in")
         tmp_input_file_path = os.path.join(subinputs_dir, f"{mol_id}.tmp")
         tar_file_path = os.path.join(suboutputs_dir, f"{mol_id}.tar")
         mol_tmp_dir = os.path.join(suboutputs_dir, f"{mol_id}")
         mol_tmp_log_path = os.path.join(mol_tmp_dir, f"{mol_id}.log")
 
-        if os.path.exists(tar_file_path):
-            tar = tarfile.open(tar_file_path, "r")
-            member_basename_list = set(
-                os.path.basename(member.name) for member in tar.getmembers()
-            )
+        if listing.exists(tar_file_path):
+            # from the journal of the tar file if it has one
+            member_basename_list = read_tar_members(tar_file_path)
             if any(
                 f"_{last_cosmo_name_replaced}.tab" in member_basename
                 for member_basename in member_basename_list
             ):
-                tar.close()
                 print(f"COSMO-RS calculation for {mol_id} already finished.")
 
                 if os.path.exists(mol_tmp_dir):
                     shutil.rmtree(mol_tmp_dir)
 
                 continue
-            tar.close()
 
-        if os.path.exists(mol_tmp_log_path):
+        if listing.exists(mol_tmp_log_path):
 
             with open(mol_tmp_log_path, "r") as f:
                 lines = f.readlines()
@@ -215,8 +252,8 @@ for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
 
                     continue
 
-        os.makedirs(subinputs_dir, exist_ok=True)
-        if not os.path.exists(input_file_path) and not os.path.exists(
+        listing.makedirs(subinputs_dir)
+        if not listing.exists(input_file_path) and not listing.exists(
             tmp_input_file_path
         ):
             with open(input_file_path, "w+") as f:
@@ -227,44 +264,89 @@ for mol_id, smi in mol_ids_smis[args.task_id :: args.num_tasks]:
         print(f"Mol id: {mol_id} not in xyz dict")
 
 print("Starting COSMO calculations...")
-for subinputs_folder in os.listdir(os.path.join(COSMO_dir, "inputs")):
-    ids = int(subinputs_folder.split("_")[1])
-    subinputs_dir = os.path.join(COSMO_dir, "inputs", subinputs_folder)
-    suboutputs_dir = os.path.join(COSMO_dir, "outputs", f"outputs_{ids}")
-    for input_file in os.listdir(subinputs_dir):
-        if input_file.endswith(".in"):
-            input_file_path = os.path.join(subinputs_dir, input_file)
-            mol_id = int(input_file.split(".in")[0])
-            tmp_input_file_path = os.path.join(subinputs_dir, f"{mol_id}.tmp")
-            if not os.path.exists(tmp_input_file_path):
-                try:
-                    os.rename(input_file_path, tmp_input_file_path)
-                except:
-                    continue
-                else:
-                    print(
-                        f"Starting COSMO-RS and Turbomole calculation for {mol_id}..."
-                    )
-                    ids = mol_id // 1000
-                    charge = mol_id_to_charge_dict[mol_id]
-                    mult = mol_id_to_mult_dict[mol_id]
-                    coords = xyz_DFT_opt_dict[mol_id]
-                    tmp_mol_dir = os.path.join(suboutputs_dir, f"{mol_id}")
-                    os.makedirs(tmp_mol_dir, exist_ok=True)
-                    cosmo_calc(
-                        mol_id,
-                        COSMOTHERM_PATH,
-                        COSMO_DATABASE_PATH,
-                        charge,
-                        mult,
-                        args.COSMO_temperatures,
-                        df_pure,
-                        coords,
-                        args.scratch_dir,
-                        tmp_mol_dir,
-                        suboutputs_dir,
-                        subinputs_dir,
-                    )
-                    print(f"Finished COSMO-RS and Turbomole calculation for {mol_id}")
+# only claim jobs that are predicted to finish before the allocation ends
+admission = JobAdmission.from_args(args)
+pending_jobs = get_pending_jobs(os.path.join(COSMO_dir, "inputs"))
+# molecules are gathered until COSMO_n_solutes are claimed, and run together
+group = []
+
+
+def predict_cosmo_wall(mol_id):
+    return admission.cost_model.predict_wall(
+        "COSMO", get_xyz_size(xyz_DFT_opt_dict[mol_id])
+    )
+
+
+def admit_cosmo(mol_id):
+    # the molecules already in the group run in the same go
+    return admission.admit(
+        "COSMO",
+        get_xyz_size(xyz_DFT_opt_dict[mol_id]),
+        mol_id,
+        reserved=sum(predict_cosmo_wall(other_id) for other_id, _ in group),
+    )
+
+
+claimer = JobClaimer(
+    order_jobs(pending_jobs, args.job_order, predict_cosmo_wall),
+    batch_size=args.claim_batch_size,
+    admit=admit_cosmo,
+)
+
+# solvents are resolved, and copied to COSMO_solvent_dir, once for all the jobs
+solvents = None
+
+
+def run_cosmo_group(group):
+    global solvents
+    if solvents is None:
+        solvents = SolventSet(
+            df_pure, COSMOTHERM_PATH, COSMO_DATABASE_PATH, args.COSMO_solvent_dir
+        )
+    mol_ids = [mol_id for mol_id, _ in group]
+    suboutputs_dirs = [
+        os.path.join(COSMO_dir, "outputs", f"outputs_{mol_id // 1000}")
+        for mol_id in mol_ids
+    ]
+    tmp_mol_dirs = [
+        os.path.join(suboutputs_dir, f"{mol_id}")
+        for mol_id, suboutputs_dir in zip(mol_ids, suboutputs_dirs)
+    ]
+    for tmp_mol_dir in tmp_mol_dirs:
+        os.makedirs(tmp_mol_dir, exist_ok=True)
+    print(f"Starting COSMO-RS and Turbomole calculation for {mol_ids}...")
+    cosmo_calc_multi_solute(
+        mol_ids,
+        COSMOTHERM_PATH,
+        COSMO_DATABASE_PATH,
+        [mol_id_to_charge_dict[mol_id] for mol_id in mol_ids],
+        [mol_id_to_mult_dict[mol_id] for mol_id in mol_ids],
+        args.COSMO_temperatures,
+        df_pure,
+        [xyz_DFT_opt_dict[mol_id] for mol_id in mol_ids],
+        args.scratch_dir,
+        tmp_mol_dirs,
+        suboutputs_dirs,
+        [subinputs_dir for _, subinputs_dir in group],
+        batch_size=args.COSMO_batch_size,
+        flush_every=args.COSMO_flush_every,
+        solvents=solvents,
+        turbomole_cache_dir=args.COSMO_turbomole_cache_dir,
+    )
+    print(f"Finished COSMO-RS and Turbomole calculation for {mol_ids}")
+
+
+try:
+    for mol_id, subinputs_dir in claimer:
+        group.append((mol_id, subinputs_dir))
+        if len(group) == args.COSMO_n_solutes:
+            started_group, group = group, []
+            run_cosmo_group(started_group)
+    if group:
+        started_group, group = group, []
+        run_cosmo_group(started_group)
+finally:
+    # molecules still waiting for their group were not started
+    claimer.release(group)
 
 print("Done!")
@@ -0,0 +1,12 @@
+from argparse import ArgumentParser
+
+from autoqm.calculation.dlpno_pipeline import add_dlpno_arguments, run_dlpno
+
+# runs the DLPNO single point inputs made by make_dlpno_sp_input.py for all
+# the levels in --DLPNO_sp_folders, see autoqm/calculation/dlpno_pipeline.py
+
+parser = ArgumentParser()
+add_dlpno_arguments(parser)
+args = parser.parse_args()
+
+run_dlpno(args)
@@ -8,7 +8,19 @@ from pathlib import Path
 
 import pandas as pd
 from autoqm.calculation.dft_calculation import dft_scf_qm_descriptor
-from autoqm.calculation.utils import add_gaussian_arguments, add_shared_arguments
+from autoqm.calculation.cost_model import get_xyz_size
+from autoqm.calculation.job_admission import JobAdmission
+from autoqm.calculation.job_queue import (
+    get_pending_jobs,
+    order_jobs,
+    JobClaimer,
+    DirListing,
+)
+from autoqm.calculation.utils import (
+    add_gaussian_arguments,
+    add_shared_arguments,
+    add_scheduling_arguments,
+)
 from rdkit import Chem
 
 logging.basicConfig(level=logging.INFO)
@@ -70,6 +82,8 @@ def main(args):
 
     id_smi_list = list(zip(job_ids, job_smis))
 
+    # one listdir per folder instead of a few stats per molecule
+    listing = DirListing()
     for job_id, job_smi in id_smi_list[args.task_id :: args.num_tasks]:
         if job_id not in id_to_xyz_dict:
             logging.info(f"Job id: {job_id} not in xyz dict")
@@ -84,7 +98,7 @@ def main(args):
         job_tmp_input_path = subinputs_dir / f"{job_id}.tmp"
         job_tmp_output_dir = suboutputs_dir / f"{job_id}"
 
-        if job_log_path.exists():
+        if listing.exists(job_log_path):
 
             if job_tmp_output_dir.exists():
                 shutil.rmtree(job_tmp_output_dir, ignore_errors=True)
@@ -101,75 +115,68 @@ def main(args):
 
             continue
 
-        if job_input_path.exists():
+        if listing.exists(job_input_path):
             continue
 
-        if job_tmp_input_path.exists():
+        if listing.exists(job_tmp_input_path):
             continue
 
-        subinputs_dir.mkdir(exist_ok=True)
+        listing.makedirs(subinputs_dir)
 
         logging.info(f"Creating input file for {job_id}: {job_input_path}")
         with open(job_input_path, "w") as f:
             f.write("")
 
     logging.info("Starting QM descriptor calculations...")
+    # only claim jobs that are predicted to finish before the allocation ends
+    admission = JobAdmission.from_args(args)
+
+    # every worker walks all the pending jobs in the same order and claims
+    # whatever is left, so the task stripes only matter for making inputs
+    pending_jobs = get_pending_jobs(inputs_dir)
+    claimer = JobClaimer(
+        order_jobs(
+            pending_jobs,
+            args.job_order,
+            lambda job_id: admission.cost_model.predict_wall(
+                "QM_des", get_xyz_size(id_to_xyz_dict[job_id])
+            ),
+        ),
+        batch_size=args.claim_batch_size,
+        admit=lambda job_id: admission.admit(
+            "QM_des", get_xyz_size(id_to_xyz_dict[job_id]), job_id
+        ),
+    )
+    for job_id, subinputs_dir in claimer:
+        subinputs_dir = Path(subinputs_dir)
+        job_id_div_1000 = job_id // 1000
+        suboutputs_dir = outputs_dir / f"outputs_{job_id_div_1000}"
+        suboutputs_dir.mkdir(exist_ok=True)
 
-    for i in range(2):
-
-        count = 0
-
-        for subinputs_dir in inputs_dir.iterdir():
-
-            count += 1
-
-            if (i == 0) and (count % args.num_tasks != args.task_id):
-                continue
-
-            job_id_div_1000 = int(subinputs_dir.stem.split("_")[1])
-            suboutputs_dir = outputs_dir / f"outputs_{job_id_div_1000}"
-            suboutputs_dir.mkdir(exist_ok=True)
-
-            for job_input_path in subinputs_dir.iterdir():
-                if job_input_path.suffix == ".in":
-
-                    job_id = int(job_input_path.stem)
-                    job_tmp_input_path = subinputs_dir / f"{job_id}.tmp"
-
-                    if job_tmp_input_path.exists():
-                        continue
-
-                    logging.info(f"Starting calculation for {job_input_path}...")
-
-                    try:
-                        job_input_path.rename(job_tmp_input_path)
-                    except FileNotFoundError:
-                        logging.error(
-                            f"Cannot find input file {job_input_path}. Assuming being calculated by another worker. Skipping..."
-                        )
-                        continue
+        logging.info(f"Starting calculation for {job_id} in {subinputs_dir}...")
 
-                    charge = id_to_charge_dict[job_id]
-                    mult = id_to_mult_dict[job_id]
-                    xyz_str = id_to_xyz_dict[job_id]
+        charge = id_to_charge_dict[job_id]
+        mult = id_to_mult_dict[job_id]
+        xyz_str = id_to_xyz_dict[job_id]
 
-                    dft_scf_qm_descriptor(
-                        g16_path=args.g16_path,
-                        job_id=job_id,
-                        xyz_str=xyz_str,
-                        charge=charge,
-                        mult=mult,
-                        template=template,
-                        scratch_dir=args.scratch_dir,
-                        subinputs_dir=subinputs_dir,
-                        suboutputs_dir=suboutputs_dir,
-                    )
+        dft_scf_qm_descriptor(
+            g16_path=args.g16_path,
+            job_id=job_id,
+            xyz_str=xyz_str,
+            charge=charge,
+            mult=mult,
+            template=template,
+            scratch_dir=args.scratch_dir,
+            subinputs_dir=subinputs_dir,
+            suboutputs_dir=suboutputs_dir,
+        )
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser = add_shared_arguments(parser)
     parser = add_gaussian_arguments(parser)
+    parser = add_scheduling_arguments(parser)
     args = parser.parse_args()
     main(args)
     logging.info("DONE!")
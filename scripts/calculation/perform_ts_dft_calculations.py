@@ -5,7 +5,16 @@ from argparse import ArgumentParser
 
 from rdmc.mol import RDKitMol
 
-from autoqm.calculation.dft_calculation import dft_scf_opt
+from autoqm.calculation.remediation import dft_scf_opt_with_remediation
+from autoqm.calculation.cost_model import get_xyz_size
+from autoqm.calculation.job_admission import JobAdmission
+from autoqm.calculation.job_queue import (
+    get_pending_jobs,
+    order_jobs,
+    JobClaimer,
+    DirListing,
+)
+from autoqm.calculation.utils import add_scheduling_arguments
 
 parser = ArgumentParser()
 parser.add_argument(
@@ -49,6 +58,17 @@ parser.add_argument(
     default="#P opt=(ts,calcall,maxcycle=32,noeig,nomicro,cartesian) scf=(xqc) iop(7/33=1) iop(2/9=2000) guess=mix wb97xd/def2svp",
     help="level of theory for the DFT calculation",
 )
+parser.add_argument(
+    "--DFT_opt_freq_max_retries",
+    type=int,
+    default=3,
+    help="maximum number of resubmissions of a failed DFT calculation",
+)
+parser.add_argument(
+    "--DFT_watchdog",
+    action="store_true",
+    help="kill TS optimizations with an oscillating SCF and resubmit them right away; only routes without scf=qc, xqc or yqc are checked, so this has no effect with the default route",
+)
 parser.add_argument(
     "--DFT_opt_freq_n_procs",
     type=int,
@@ -78,6 +98,7 @@ parser.add_argument(
     help="path to RDMC to use xtb-gaussian script for xtb optimization calculation.",
 )
 parser.add_argument("--scratch_dir", type=str, required=True, help="scratch directory")
+add_scheduling_arguments(parser)
 
 args = parser.parse_args()
 
@@ -125,6 +146,9 @@ for k, v in mol_id_to_rxn_smi.items():
 os.makedirs(args.scratch_dir, exist_ok=True)
 mol_ids_smis = list(zip(mol_ids, smiles_list))
 
+# only claim jobs that are predicted to finish before the allocation ends
+admission = JobAdmission.from_args(args)
+
 # create id to xyz mapping
 mols = RDKitMol.FromFile(args.input_geometry, removeHs=False, sanitize=False)
 mol_id_to_xyz = dict()
@@ -149,6 +173,8 @@ for _ in range(1):
     os.makedirs(inputs_dir, exist_ok=True)
     os.makedirs(outputs_dir, exist_ok=True)
 
+    # one listdir per folder instead of a few stats per molecule
+    listing = DirListing()
     for mol_id, smi in mol_ids_smis[args.task_id : len(mol_ids_smis) : args.num_tasks]:
         ids = mol_id // 1000
         input_rxns_dir = os.path.join(DFT_opt_freq_dir, "inputs", f"rxns_{ids}")
@@ -157,12 +183,12 @@ for _ in range(1):
         output_rxn_dir = os.path.join(output_rxns_dir, f"rxn_{mol_id}")
 
         if mol_id in mol_id_to_xyz:
-            if not os.path.exists(os.path.join(output_rxn_dir, f"{mol_id}.log")):
-                if not os.path.exists(
+            if not listing.exists(os.path.join(output_rxn_dir, f"{mol_id}.log")):
+                if not listing.exists(
                     os.path.join(input_rxn_dir, f"{mol_id}.in")
-                ) and not os.path.exists(os.path.join(input_rxn_dir, f"{mol_id}.tmp")):
-                    os.makedirs(input_rxns_dir, exist_ok=True)
-                    os.makedirs(input_rxn_dir, exist_ok=True)
+                ) and not listing.exists(os.path.join(input_rxn_dir, f"{mol_id}.tmp")):
+                    listing.makedirs(input_rxns_dir)
+                    listing.makedirs(input_rxn_dir)
                     with open(
                         os.path.join(input_rxn_dir, f"{mol_id}.in"),
                         "w",
@@ -175,48 +201,53 @@ for _ in range(1):
     DFT_opt_freq_theory = args.DFT_opt_freq_theory
 
     for _ in range(1):
-        for mol_id, smi in mol_ids_smis:
+        pending_jobs = [
+            job for job in get_pending_jobs(inputs_dir) if job[0] in mol_id_to_xyz
+        ]
+        claimer = JobClaimer(
+            order_jobs(
+                pending_jobs,
+                args.job_order,
+                lambda mol_id: admission.cost_model.predict_wall(
+                    "TS_DFT_opt_freq", get_xyz_size(mol_id_to_xyz[mol_id])
+                ),
+            ),
+            batch_size=args.claim_batch_size,
+            admit=lambda mol_id: admission.admit(
+                "TS_DFT_opt_freq", get_xyz_size(mol_id_to_xyz[mol_id]), mol_id
+            ),
+        )
+        for mol_id, input_rxn_dir in claimer:
             ids = mol_id // 1000
-            input_rxns_dir = os.path.join(DFT_opt_freq_dir, "inputs", f"rxns_{ids}")
             output_rxns_dir = os.path.join(DFT_opt_freq_dir, "outputs", f"rxns_{ids}")
-            input_rxn_dir = os.path.join(input_rxns_dir, f"rxn_{mol_id}")
             output_rxn_dir = os.path.join(output_rxns_dir, f"rxn_{mol_id}")
-            input_file_path = os.path.join(input_rxn_dir, f"{mol_id}.in")
-            print(input_file_path)
-            if os.path.exists(input_file_path):
-                try:
-                    os.rename(
-                        input_file_path,
-                        os.path.join(input_rxn_dir, f"{mol_id}.tmp"),
-                    )
-                except FileNotFoundError:
-                    continue
-                else:
-                    print(os.path.join(input_rxn_dir, f"{mol_id}.tmp"))
-                    rxn_smi = mol_id_to_rxn_smi[mol_id]
-                    charge = mol_id_to_charge[mol_id]
-                    mult = mol_id_to_mult[mol_id]
-                    xyz = mol_id_to_xyz[mol_id]
-
-                    print(mol_id)
-                    print(rxn_smi)
-
-                    os.makedirs(output_rxns_dir, exist_ok=True)
-                    os.makedirs(output_rxn_dir, exist_ok=True)
-
-                    dft_scf_opt(
-                        mol_id,
-                        xyz,
-                        G16_PATH,
-                        DFT_opt_freq_theory,
-                        args.DFT_opt_freq_n_procs,
-                        args.DFT_opt_freq_job_ram,
-                        charge,
-                        mult,
-                        args.scratch_dir,
-                        input_rxn_dir,
-                        output_rxn_dir,
-                    )
+            print(os.path.join(input_rxn_dir, f"{mol_id}.tmp"))
+            rxn_smi = mol_id_to_rxn_smi[mol_id]
+            charge = mol_id_to_charge[mol_id]
+            mult = mol_id_to_mult[mol_id]
+            xyz = mol_id_to_xyz[mol_id]
+
+            print(mol_id)
+            print(rxn_smi)
+
+            os.makedirs(output_rxns_dir, exist_ok=True)
+            os.makedirs(output_rxn_dir, exist_ok=True)
+
+            dft_scf_opt_with_remediation(
+                mol_id,
+                xyz,
+                G16_PATH,
+                DFT_opt_freq_theory,
+                args.DFT_opt_freq_n_procs,
+                args.DFT_opt_freq_job_ram,
+                charge,
+                mult,
+                args.scratch_dir,
+                input_rxn_dir,
+                output_rxn_dir,
+                max_retries=args.DFT_opt_freq_max_retries,
+                watchdog=args.DFT_watchdog,
+            )
 
     print("DFT optimization and frequency calculation done.")
 
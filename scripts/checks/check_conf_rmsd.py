@@ -0,0 +1,77 @@
+from argparse import ArgumentParser
+import sys
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+from autoqm.calculation.conf_rmsd import (
+    dedup_conformers,
+    get_heavy_atoms,
+    get_symmetry_permutations,
+)
+
+# exits with 1 if the conformers kept by dedup_conformers differ from those kept
+# by the same greedy filter using AllChem.GetBestRMS, on molecules with
+# conjugated terminal groups and a symmetric alkane
+
+parser = ArgumentParser()
+parser.add_argument(
+    "--smiles",
+    type=str,
+    nargs="+",
+    default=[
+        "CCCCC(=O)O",
+        "CCCC(=O)[O-]",
+        "CCC[N+](=O)[O-]",
+        "OC(=O)c1ccc(C(=O)O)cc1",
+        "CCCCCCCCCC",
+    ],
+    help="molecules to check",
+)
+parser.add_argument(
+    "--num_confs", type=int, default=40, help="number of MMFF conformers"
+)
+parser.add_argument(
+    "--rms", type=float, default=0.5, help="RMSD threshold of the filter (A)"
+)
+parser.add_argument("--seed", type=int, default=1, help="embedding random seed")
+
+args = parser.parse_args()
+
+
+def get_best_rms_keep(nh, rms):
+    keep = [0]
+    for i in range(1, nh.GetNumConformers()):
+        if all(AllChem.GetBestRMS(nh, nh, prbId=i, refId=j) >= rms for j in keep):
+            keep.append(i)
+    return keep
+
+
+n_failed = 0
+for smi in args.smiles:
+    mol = Chem.AddHs(Chem.MolFromSmiles(smi))
+    AllChem.EmbedMultipleConfs(mol, args.num_confs, randomSeed=args.seed)
+    results = AllChem.MMFFOptimizeMoleculeConfs(mol)
+    order = np.argsort([en for _, en in results], kind="stable")
+
+    # conformers sorted by energy, as in ff_conf_generation.postrmsd
+    sorted_mol = Chem.Mol(mol)
+    sorted_mol.RemoveAllConformers()
+    for i in order:
+        sorted_mol.AddConformer(mol.GetConformer(int(i)), assignId=True)
+
+    nh, heavy_atoms = get_heavy_atoms(sorted_mol)
+    coords = np.array([conf.GetPositions() for conf in sorted_mol.GetConformers()])
+    keep = dedup_conformers(
+        coords[:, heavy_atoms], get_symmetry_permutations(nh), args.rms
+    )
+    ref_keep = get_best_rms_keep(Chem.RemoveHs(sorted_mol), args.rms)
+
+    if keep == ref_keep:
+        print(f"{smi}: {len(keep)} conformers kept, same as GetBestRMS")
+    else:
+        n_failed += 1
+        print(f"{smi}: kept {keep}, GetBestRMS kept {ref_keep}")
+
+sys.exit(1 if n_failed else 0)
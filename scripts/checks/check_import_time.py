@@ -0,0 +1,60 @@
+from argparse import ArgumentParser
+import subprocess
+import sys
+
+# exits with 1 if importing the packages pulls in any of the heavy dependencies,
+# which the lazy imports of the package __init__ files only load when used
+
+parser = ArgumentParser()
+parser.add_argument(
+    "--modules",
+    type=str,
+    nargs="+",
+    default=["autoqm", "autoqm.calculation", "autoqm.parser"],
+    help="modules to import",
+)
+parser.add_argument(
+    "--forbidden",
+    type=str,
+    nargs="+",
+    default=["arkane", "rmgpy", "rdkit", "rdmc", "pandas"],
+    help="top level packages that must not be imported",
+)
+
+args = parser.parse_args()
+
+
+def get_import_times(module):
+    """
+    (module name, cumulative import time in us) of each module imported by
+    `import module` in a new interpreter, from the -X importtime report.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr)
+        sys.exit(f"import {module} failed")
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(cumulative)))
+    return times
+
+
+n_failed = 0
+for module in args.modules:
+    times = get_import_times(module)
+    eager = sorted({name.split(".")[0] for name, _ in times} & set(args.forbidden))
+    total = dict(times).get(module, 0) / 1e6
+    if eager:
+        n_failed += 1
+        print(f"import {module} ({total:.3f} s) imports {', '.join(eager)}")
+    else:
+        print(f"import {module} ({total:.3f} s) imports no forbidden package")
+
+sys.exit(1 if n_failed else 0)
@@ -1,3 +1,4 @@
+import os
 import sys
 import pickle as pkl
 import pandas as pd
@@ -262,21 +263,32 @@ if not only_cosmo:
             pkl.dump(results_df_merged, f, protocol=pkl.HIGHEST_PROTOCOL)
 
 logging.warning("Loading cosmo results")
+
+
+def load_cosmo_results(pkl_path):
+    """
+    Load a table of parse_cosmo_results.py, from its .parquet file if there is
+    one, else from the .pkl file it falls back to without a parquet engine.
+    """
+    parquet_path = os.path.splitext(pkl_path)[0] + ".parquet"
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path)
+    with open(pkl_path, "rb") as f:
+        return pkl.load(f)
+
+
 cosmo_results_dict = {}
 if job_type == "reactants_products":
-    with open(
-        "./calculations/aug11b/reactants_products_aug11b_cosmo_results.pkl", "rb"
-    ) as f:
-        cosmo_results_dict["aug11b"] = pkl.load(f)
-    with open(
-        "./calculations/sep1a_filtered/reactants_products_sep1a_filtered_cosmo_results.pkl",
-        "rb",
-    ) as f:
-        cosmo_results_dict["sep1a_filtered"] = pkl.load(f)
+    cosmo_results_dict["aug11b"] = load_cosmo_results(
+        "./calculations/aug11b/reactants_products_aug11b_cosmo_results.pkl"
+    )
+    cosmo_results_dict["sep1a_filtered"] = load_cosmo_results(
+        "./calculations/sep1a_filtered/reactants_products_sep1a_filtered_cosmo_results.pkl"
+    )
 elif job_type == "ts":
-    with open("./calculations/sep1a/ts_sep1a_cosmo_results.pkl", "rb") as f:
-        cosmo_results_dict["sep1a"] = pkl.load(f)
-
+    cosmo_results_dict["sep1a"] = load_cosmo_results(
+        "./calculations/sep1a/ts_sep1a_cosmo_results.pkl"
+    )
 
 def fill_column_cosmo(results_dict, hased_table_df_dict, mol_id_to_index_dict):
     props = [
@@ -326,11 +338,11 @@ def combine_cosmo_results(results_dict, mol_id_to_index_dict):
         "Hsolv (kcal/mol)",
     ]
 
-    df = pd.DataFrame(columns=header)
+    dfs = [pd.DataFrame(columns=header)]
     for project, cosmo_result in results_dict.items():
         cosmo_result["project"] = project
-        df = pd.concat([df, cosmo_result], axis=0)
-    return df
+        dfs.append(cosmo_result)
+    return pd.concat(dfs, axis=0)
 
 
 # logging.warning("Filling cosmo results")
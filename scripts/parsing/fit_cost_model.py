@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import pickle as pkl
+import pandas as pd
+from argparse import ArgumentParser
+
+from autoqm.calculation.cost_model import CostModel, get_smiles_size, time_to_seconds
+
+parser = ArgumentParser()
+parser.add_argument(
+    "--input_smiles_path",
+    type=str,
+    required=True,
+    help="path to a .csv file containing input smiles and ids",
+)
+parser.add_argument(
+    "--smiles_column", type=str, default="smi", help="column name for the smiles"
+)
+parser.add_argument(
+    "--stage",
+    type=str,
+    required=True,
+    help="stage to fit, e.g. semiempirical_opt, DFT_opt_freq or TS_DFT_opt_freq",
+)
+parser.add_argument(
+    "--level_of_theory",
+    type=str,
+    required=True,
+    help="level of theory of the parsed jobs, for DLPNO_sp the keyword line of the ORCA input without the leading !",
+)
+parser.add_argument(
+    "--results_pkl",
+    type=str,
+    default=None,
+    help="pickle file of valid jobs written by the parsing scripts",
+)
+parser.add_argument(
+    "--remediation_dir",
+    type=str,
+    default=None,
+    help="outputs folder of the stage to collect the memory needed from the remediation histories of resubmitted jobs, and the wall times of the ORCA jobs run by perform_dlpno_calculations.py",
+)
+parser.add_argument(
+    "--n_procs",
+    type=int,
+    default=None,
+    help="number of processors of jobs whose log does not record it",
+)
+parser.add_argument(
+    "--min_records",
+    type=int,
+    default=10,
+    help="minimum number of jobs to fit a quantity",
+)
+parser.add_argument(
+    "--cost_model",
+    type=str,
+    required=True,
+    help="json file of the cost model, updated if it exists",
+)
+args = parser.parse_args()
+
+
+def get_job_timings(job):
+    """
+    cpu and wall time (s) and processors of a parsed job, found from its
+    dft_ or semiempirical_ prefixed keys.
+    """
+    for key in job:
+        if key.endswith("_cpu"):
+            prefix = key[: -len("_cpu")]
+            cpu = job[key]
+            wall = job.get(f"{prefix}_wall")
+            if cpu is None or wall is None:
+                return None
+            n_procs = job.get(f"{prefix}_n_procs") or args.n_procs
+            return time_to_seconds(cpu), time_to_seconds(wall), n_procs
+    return None
+
+
+def get_history_timing(history):
+    """
+    Wall time (s) and processors of the attempt that finished normally, for
+    histories that record it. Only ORCA jobs do, which do not report their
+    cpu time.
+    """
+    if history[-1]["failure"] != "normal" or not history[-1].get("wall"):
+        return None
+    return history[-1]["wall"], history[-1]["n_procs"]
+
+
+def get_needed_mem(history):
+    """
+    Memory of the attempt that converged after running out of memory, None if
+    the job never ran out of memory.
+    """
+    if history[-1]["failure"] != "normal":
+        return None
+    if not any(attempt["failure"] == "memory_insufficient" for attempt in history):
+        return None
+    return history[-1]["job_ram"]
+
+
+df = pd.read_csv(args.input_smiles_path)
+mol_id_to_smi = dict(zip(df["id"], df[args.smiles_column]))
+
+valid_jobs = dict()
+if args.results_pkl is not None:
+    with open(args.results_pkl, "rb") as f:
+        valid_jobs = pkl.load(f)
+
+records = []
+for mol_id, valid_job in valid_jobs.items():
+    if mol_id not in mol_id_to_smi:
+        continue
+    size = get_smiles_size(mol_id_to_smi[mol_id])
+    # semiempirical results hold one job per conformer
+    if any(key.endswith("_cpu") for key in valid_job):
+        jobs = [valid_job]
+    else:
+        jobs = [job for job in valid_job.values() if isinstance(job, dict)]
+    for job in jobs:
+        timings = get_job_timings(job)
+        if timings is None:
+            continue
+        cpu, wall, n_procs = timings
+        records.append({"size": size, "cpu": cpu, "wall": wall, "n_procs": n_procs})
+print(f"Found timings of {len(records)} jobs")
+
+if args.remediation_dir is not None:
+    n_mem = 0
+    n_timings = 0
+    for root, dirs, files in os.walk(args.remediation_dir):
+        for file in files:
+            if not file.endswith("_remediation.json"):
+                continue
+            mol_id = int(file.split("_remediation.json")[0])
+            if mol_id not in mol_id_to_smi:
+                continue
+            with open(os.path.join(root, file)) as f:
+                history = json.load(f)
+            size = get_smiles_size(mol_id_to_smi[mol_id])
+            mem = get_needed_mem(history)
+            if mem is not None:
+                records.append({"size": size, "mem": mem})
+                n_mem += 1
+            timing = get_history_timing(history)
+            if timing is not None:
+                wall, n_procs = timing
+                records.append({"size": size, "wall": wall, "n_procs": n_procs})
+                n_timings += 1
+    print(f"Found the memory needed by {n_mem} jobs")
+    print(f"Found the wall times of {n_timings} jobs")
+
+if os.path.exists(args.cost_model):
+    cost_model = CostModel.load(args.cost_model)
+else:
+    cost_model = CostModel()
+
+fit = cost_model.fit(args.stage, args.level_of_theory, records, args.min_records)
+for quantity in ["work", "wall", "mem"]:
+    if quantity in fit:
+        print(
+            f"{quantity}: {fit[quantity]['n']} jobs, log residual {fit[quantity]['sigma']:.3f}"
+        )
+if "parallel_fraction" in fit:
+    print(
+        f"parallel fraction {fit['parallel_fraction']:.3f} at {fit['n_procs']} processors"
+    )
+elif "wall" in fit:
+    print(
+        f"all jobs ran on {fit['n_procs']} processors, the parallel fraction is not fitted"
+    )
+
+cost_model.save(args.cost_model)
+
+print("Done!")
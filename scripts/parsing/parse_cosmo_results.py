@@ -4,7 +4,11 @@ import pickle as pkl
 import pandas as pd
 from joblib import Parallel, delayed
 from tqdm import tqdm
-from autoqm.parser.cosmo_parser import cosmo_parser
+from autoqm.parser.cosmo_parser import (
+    COSMO_RESULT_COLUMNS,
+    cosmo_table_parser,
+    get_dHsolv_values,
+)
 
 
 def main(input_smiles_path, output_file_name, n_jobs, solvent_path, output_dir):
@@ -35,15 +39,20 @@ def main(input_smiles_path, output_file_name, n_jobs, solvent_path, output_dir):
                 tar_file_paths.append(os.path.join(root, file))
 
     out = Parallel(n_jobs=n_jobs, backend="multiprocessing", verbose=5)(
-        delayed(cosmo_parser)(tar_file_path) for tar_file_path in tqdm(tar_file_paths)
+        delayed(cosmo_table_parser)(tar_file_path)
+        for tar_file_path in tqdm(tar_file_paths)
     )
 
     out = [x for x in out if x is not None]
-    for each_data_lists in tqdm(out):
-        for each_data_list in each_data_lists:
-            for each_data in each_data_list:
-                each_data[1] = solvent_name_to_smi[each_data[0]]
-                each_data[3] = mol_id_to_mol_smi[float(each_data[2])]
+    if out:
+        df_cosmo = pd.concat(out, ignore_index=True)
+    else:
+        df_cosmo = pd.DataFrame(columns=COSMO_RESULT_COLUMNS)
+    get_dHsolv_values(df_cosmo)
+
+    df_cosmo["solvent_smiles"] = df_cosmo["solvent_name"].map(solvent_name_to_smi)
+    solute_ids = pd.to_numeric(df_cosmo["solute_name"])
+    df_cosmo["solute_smiles"] = solute_ids.map(mol_id_to_mol_smi)
 
     headers = [
         "solvent_name",
@@ -57,18 +66,17 @@ def main(input_smiles_path, output_file_name, n_jobs, solvent_path, output_dir):
         "Gsolv (kcal/mol)",
         "Hsolv (kcal/mol)",
     ]
-
-    cosmo_data_dict = {header: [] for header in headers}
-    for each_data_lists in tqdm(out):
-        for each_data_list in each_data_lists:
-            for each_data in each_data_list:
-                for i, header in enumerate(headers):
-                    cosmo_data_dict[header].append(each_data[i])
-
-    df_cosmo = pd.DataFrame(cosmo_data_dict)
-
-    with open(os.path.join(submit_dir, f"{output_file_name}.pkl"), "wb") as outfile:
-        pkl.dump(df_cosmo, outfile, protocol=pkl.HIGHEST_PROTOCOL)
+    df_cosmo = df_cosmo[headers]
+
+    try:
+        output_path = os.path.join(submit_dir, f"{output_file_name}.parquet")
+        df_cosmo.to_parquet(output_path, index=False)
+    except ImportError:
+        print("No parquet engine (pyarrow or fastparquet), saving as pickle")
+        output_path = os.path.join(submit_dir, f"{output_file_name}.pkl")
+        with open(output_path, "wb") as outfile:
+            pkl.dump(df_cosmo, outfile, protocol=pkl.HIGHEST_PROTOCOL)
+    print(f"Results saved to {output_path}")
 
     print(f"Total number of mols: {len(mol_ids)}")
     print(f"Total number of tar files: {len(tar_file_paths)}")
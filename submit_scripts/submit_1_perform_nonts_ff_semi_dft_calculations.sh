@@ -51,6 +51,9 @@ python -u $QMD_PATH/scripts/calculation/perform_nonts_ff_semi_dft_calculations.p
     --task_id $LLSUB_RANK \
     --num_tasks $LLSUB_SIZE
 
+# to keep one process per task pulling jobs of any stage until none is left,
+# run `python -u -m autoqm worker` with the same arguments instead
+
 rm -rf $scratch_dir
 
 
@@ -1,6 +1,7 @@
 #!/bin/bash -l
 #SBATCH -o slurm-orca_%A-%a.out
 #SBATCH --array=0-31
+# the whole node is shared by the ORCA jobs of the task
 #SBATCH --exclusive
 #SBATCH --mem=0
 
@@ -44,174 +45,58 @@ input_smiles=$1
 echo $input_smiles
 output_name=$2
 echo $output_name
-xyz_DFT_opt_dict=$3
-echo $xyz_DFT_opt_dict
+xyz_column=${3:-xyz}
+echo $xyz_column
 DLPNO_sp_n_procs=24
 DLPNO_sp_job_ram=7200
 
 echo "DLPNO_sp_n_procs $DLPNO_sp_n_procs"
 echo "DLPNO_sp_job_ram $DLPNO_sp_job_ram"
 
-#svp calculations
-DLPNO_sp_folder="DLPNO_sp"
-DLPNO_level_of_theory="uHF dlpno-ccsd(t) def2-svp def2-svp/c TightSCF NormalPNO"
-echo $DLPNO_sp_folder
-echo $DLPNO_level_of_theory
-
-python -u $QMD_PATH/scripts/calculation/make_dlpno_sp_input.py \
---input_smiles $input_smiles \
---xyz_DFT_opt_dict $xyz_DFT_opt_dict \
---DLPNO_sp_folder $DLPNO_sp_folder \
---DLPNO_level_of_theory "$DLPNO_level_of_theory" \
---DLPNO_sp_n_procs $DLPNO_sp_n_procs \
---DLPNO_sp_job_ram $DLPNO_sp_job_ram \
---task_id $SLURM_ARRAY_TASK_ID \
---num_tasks $SLURM_ARRAY_TASK_COUNT \
---ORCA_path $orcadir
-
-SubmitDir=`pwd`
-
-echo "Starting DLPNO calculations..."
-
-for i in {1..5}; do
-    cd $SubmitDir
-    for folder in $SubmitDir/output/$DLPNO_sp_folder/inputs/inputs_*; do
-
-        folderind="${folder##$SubmitDir/output/$DLPNO_sp_folder/inputs/inputs_}"
-        echo "folderind $folderind"
-        
-        for filename in $folder/*.in; do
-            
-            input=`basename $filename .in`
-            
-            if [ -e $folder/$input.in ]
-            then
-                echo "input $input"
-                mv $folder/$input.in $folder/$input.tmp
-                ScratchDir=$TMPDIR/$USER/orca/$SLURM_JOB_ID-$SLURM_ARRAY_TASK_ID-$input
-                echo "ScratchDir $ScratchDir"
-                mkdir -p $ScratchDir
-
-                cd $ScratchDir
-                echo $PATH
-                cp $folder/$input.tmp $input.in
-                $orcadir/orca $input.in > $input.log
-                if [ -e $input.log ]
-                then
-                    if grep -Fq "ORCA TERMINATED NORMALLY" $input.log
-                    then
-                        echo "done"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    elif grep -Fq "ORCA finished by error termination" $input.log
-                    then
-                        echo "done with error termination"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    elif grep -Fq "The basis set was either not assigned or not available for this element" $input.log
-                    then
-                        echo "basis set not available"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    elif grep -Fq "This wavefunction IS NOT FULLY CONVERGED!" $input.log
-                    then
-                        echo "wavefunction not converged"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    else
-                        echo "failed - unknown error"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/inputs/inputs_$folderind/
-                        mv $folder/$input.tmp $folder/$input.in
-                    fi
-                else
-                    echo "failed - no log file"
-                    mv $folder/$input.tmp $folder/$input.in
-                fi
-                cd $SubmitDir
-                rm -rf $ScratchDir
-            fi
-        done
-    done
+#svp and f12 inputs
+DLPNO_sp_folders=("DLPNO_sp" "DLPNO_sp_f12")
+DLPNO_levels_of_theory=(
+    "uHF dlpno-ccsd(t) def2-svp def2-svp/c TightSCF NormalPNO"
+    "uHF UNO DLPNO-CCSD(T)-F12D cc-pvtz-f12 def2/J cc-pvqz/c cc-pvqz-f12-cabs RIJCOSX VeryTightSCF NormalPNO"
+)
+
+for i in 0 1; do
+    DLPNO_sp_folder=${DLPNO_sp_folders[$i]}
+    DLPNO_level_of_theory=${DLPNO_levels_of_theory[$i]}
+    echo $DLPNO_sp_folder
+    echo $DLPNO_level_of_theory
+
+    python -u $QMD_PATH/scripts/calculation/make_dlpno_sp_input.py \
+    --input_smiles $input_smiles \
+    --xyz_column $xyz_column \
+    --DLPNO_sp_folder $DLPNO_sp_folder \
+    --DLPNO_sp_level_of_theory "$DLPNO_level_of_theory" \
+    --DLPNO_sp_n_procs $DLPNO_sp_n_procs \
+    --DLPNO_sp_job_ram $DLPNO_sp_job_ram \
+    --task_id $SLURM_ARRAY_TASK_ID \
+    --num_tasks $SLURM_ARRAY_TASK_COUNT \
+    --ORCA_path $orcadir
 done
 
-# f12 calculations
-DLPNO_sp_folder="DLPNO_sp_f12"
-DLPNO_level_of_theory="uHF UNO DLPNO-CCSD(T)-F12D cc-pvtz-f12 def2/J cc-pvqz/c cc-pvqz-f12-cabs RIJCOSX VeryTightSCF NormalPNO"
-echo $DLPNO_sp_folder
-echo $DLPNO_level_of_theory
-
-python -u $QMD_PATH/scripts/calculation/main_make_dlpno_sp_input.py \
---input_smiles $input_smiles \
---xyz_DFT_opt_dict $xyz_DFT_opt_dict \
---DLPNO_sp_folder $DLPNO_sp_folder \
---DLPNO_level_of_theory "$DLPNO_level_of_theory" \
---DLPNO_sp_n_procs $DLPNO_sp_n_procs \
---DLPNO_sp_job_ram $DLPNO_sp_job_ram \
---ORCA_path $orcadir \
---task_id $SLURM_ARRAY_TASK_ID \
---num_tasks $SLURM_ARRAY_TASK_COUNT
-
-SubmitDir=`pwd`
+# time left in the allocation, so that jobs predicted to run past its end are
+# not started, and a cost model fitted with fit_cost_model.py if there is one
+walltime=$(squeue -h -j $SLURM_JOB_ID -o %L)
+echo "walltime $walltime"
+cost_model=cost_model.json
+scheduling_args=()
+if [ -n "$walltime" ]; then
+    scheduling_args+=(--walltime "$walltime")
+fi
+if [ -f "$cost_model" ]; then
+    scheduling_args+=(--cost_model "$cost_model")
+fi
 
 echo "Starting DLPNO calculations..."
 
-for i in {1..5}; do
-    cd $SubmitDir
-    for folder in $SubmitDir/output/$DLPNO_sp_folder/inputs/inputs_*; do
-
-        folderind="${folder##$SubmitDir/output/$DLPNO_sp_folder/inputs/inputs_}"
-        echo "folderind $folderind"
-        
-        for filename in $folder/*.in; do
-            
-            input=`basename $filename .in`
-            
-            if [ -e $folder/$input.in ]
-            then
-                echo "input $input"
-                mv $folder/$input.in $folder/$input.tmp
-                ScratchDir=$TMPDIR/$USER/orca/$SLURM_JOB_ID-$SLURM_ARRAY_TASK_ID-$input
-                echo "ScratchDir $ScratchDir"
-                mkdir -p $ScratchDir
-
-                cd $ScratchDir
-                echo $PATH
-                cp $folder/$input.tmp $input.in
-                $orcadir/orca $input.in > $input.log
-                if [ -e $input.log ]
-                then
-                    if grep -Fq "ORCA TERMINATED NORMALLY" $input.log
-                    then
-                        echo "done"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    elif grep -Fq "ORCA finished by error termination" $input.log
-                    then
-                        echo "done with error termination"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    elif grep -Fq "The basis set was either not assigned or not available for this element" $input.log
-                    then
-                        echo "basis set not available"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    elif grep -Fq "This wavefunction IS NOT FULLY CONVERGED!" $input.log
-                    then
-                        echo "wavefunction not converged"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/outputs/outputs_$folderind/
-                        rm $folder/$input.tmp
-                    else
-                        echo "failed - unknown error"
-                        cp $input.log $SubmitDir/output/$DLPNO_sp_folder/inputs/inputs_$folderind/
-                        mv $folder/$input.tmp $folder/$input.in
-                    fi
-                else
-                    echo "failed - no log file"
-                    mv $folder/$input.tmp $folder/$input.in
-                fi
-                cd $SubmitDir
-                rm -rf $ScratchDir
-            fi
-        done
-    done
-done
\ No newline at end of file
+# the f12 job of a molecule starts once its svp job is done, memory errors are
+# retried with a larger maxcore and jobs that do not finish are released
+python -u $QMD_PATH/scripts/calculation/perform_dlpno_calculations.py \
+--DLPNO_sp_folders "${DLPNO_sp_folders[@]}" \
+--scratch_dir $TMPDIR/$USER/orca/$SLURM_JOB_ID-$SLURM_ARRAY_TASK_ID \
+--ORCA_path $orcadir \
+"${scheduling_args[@]}"